@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def hash_bytes(data):
+    """Return the hex SHA-256 digest of raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def prompt_fingerprint(prompt_text, model_name):
+    """Fingerprint of everything besides the image that shapes a Gemini analysis"""
+    return hash_bytes(f"{model_name}\n{prompt_text}".encode('utf-8'))
+
+
+class AnalysisCache:
+    """Content-addressed on-disk cache of Gemini flyer analyses
+
+    Entries are keyed by the SHA-256 of the image bytes plus a fingerprint of the
+    prompt and model, so changing either one naturally invalidates old entries.
+    Each entry is a small JSON file; eviction drops entries older than max_age
+    and then the least recently used ones until the cache fits in max_bytes.
+
+    An entry's age is its file's mtime, which is only set when it is written;
+    reads bump the access time instead, which orders least recently used
+    eviction. The cache directory is walked once, the first time the cache is
+    used, and afterwards sizes and times are tracked in memory, so writes and
+    stats() never walk it again. Expired entries are swept every
+    sweep_interval writes and dropped as they are read.
+    """
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, max_age=30 * 24 * 3600, sweep_interval=100):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # path -> [created, last_used, size], None until the directory has been walked
+        self._index = None
+        self._bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, image_bytes, prompt_hash):
+        return f"{hash_bytes(image_bytes)}-{prompt_hash[:16]}"
+
+    def _path(self, key):
+        # Fan out into sub-directories so a big cache doesn't end up in one folder
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _expired(self, created, now):
+        return bool(self.max_age) and now - created > self.max_age
+
+    def get(self, key):
+        """Return the cached analysis text for key, or None"""
+        path = self._path(key)
+        try:
+            created = os.stat(path).st_mtime
+            if self._expired(created, time.time()):
+                self._remove(path)
+                with self._lock:
+                    self.evictions += 1
+                    self.misses += 1
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Bump only the access time, the mtime stays the write time the age is measured from
+        now = time.time()
+        try:
+            os.utime(path, (now, created))
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+            if self._index is not None and path in self._index:
+                self._index[path][1] = now
+        return entry.get('analysis')
+
+    def set(self, key, analysis, **metadata):
+        """Store an analysis; written atomically so concurrent readers never see partial files"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {'analysis': analysis, 'created': time.time()}
+        entry.update(metadata)
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            stat = os.stat(path)
+        except OSError:
+            self._remove(tmp_path)
+            return
+
+        with self._lock:
+            self._load_index()
+            previous = self._index.get(path)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._index[path] = [stat.st_mtime, stat.st_mtime, stat.st_size]
+            self._bytes += stat.st_size
+            self.writes += 1
+            sweep = self.sweep_interval and self.writes % self.sweep_interval == 0
+        if sweep or (self.max_bytes and self._bytes > self.max_bytes):
+            self.evict()
+
+    def _walk(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat))
+        return entries
+
+    def _load_index(self):
+        """Walk the cache directory once; call with the lock held"""
+        if self._index is not None:
+            return
+        self._index = {path: [stat.st_mtime, max(stat.st_atime, stat.st_mtime), stat.st_size]
+                       for path, stat in self._walk()}
+        self._bytes = sum(size for _, _, size in self._index.values())
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self._lock:
+            if self._index is not None and path in self._index:
+                self._bytes -= self._index.pop(path)[2]
+
+    def evict(self):
+        """Drop expired entries, then the least recently used until under max_bytes"""
+        now = time.time()
+        with self._lock:
+            self._load_index()
+            entries = [(last_used, created, path) for path, (created, last_used, _) in self._index.items()]
+        removed = 0
+
+        if self.max_age:
+            for _, created, path in entries:
+                if self._expired(created, now):
+                    self._remove(path)
+                    removed += 1
+
+        if self.max_bytes and self._bytes > self.max_bytes:
+            for _, _, path in sorted(entries):
+                if self._bytes <= self.max_bytes:
+                    break
+                if path in self._index:
+                    self._remove(path)
+                    removed += 1
+
+        if removed:
+            with self._lock:
+                self.evictions += removed
+
+    def clear(self):
+        for path, _ in self._walk():
+            self._remove(path)
+        with self._lock:
+            self._index = {}
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'entries': len(self._index),
+                'bytes': self._bytes
+            }
@@ -0,0 +1,149 @@
+import threading
+import time
+
+# How long to wait between checks for a free key when every key is busy
+POLL_INTERVAL = 0.05
+
+
+def parse_api_keys(value):
+    """Keys from a comma-separated string (GEMINI_API_KEYS), blanks and repeats dropped"""
+    keys = []
+    for key in (value or '').split(','):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def mask_api_key(key):
+    """Short label for a key that is safe to show and log"""
+    return f"...{key[-4:]}" if len(key) > 8 else "..."
+
+
+class ApiKey:
+    """One Gemini API key with its own limiter, counters and cool-down"""
+
+    def __init__(self, key, limiter=None):
+        self.key = key
+        self.label = mask_api_key(key)
+        self.limiter = limiter
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.tokens = 0
+        self.cooldown_until = 0.0
+        self.disabled = False
+
+    def load(self):
+        if self.limiter:
+            return self.limiter.load()
+        return float(self.in_flight)
+
+
+class ApiKeyPool:
+    """Routes Gemini requests across several API keys
+
+    Every request goes to the least-loaded key that is neither cooling down
+    after a 429 nor disabled after the API rejected it (401/403). Keys have
+    their own AdaptiveLimiter from limiter_factory, so each project's quota
+    and rate limiting is tracked separately.
+    """
+
+    def __init__(self, keys, cooldown=30.0, limiter_factory=None):
+        if not keys:
+            raise ValueError("At least one API key is required")
+        self.keys = [ApiKey(key, limiter_factory() if limiter_factory else None) for key in keys]
+        self.cooldown = cooldown
+        self.queued = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, now):
+        enabled = [k for k in self.keys if not k.disabled] or self.keys
+        return [k for k in enabled if k.cooldown_until <= now], enabled
+
+    def has_available_key(self, exclude=None):
+        """Whether some key other than exclude could take a request right now without cooling down"""
+        with self._cond:
+            return any(api_key is not exclude for api_key in self._candidates(time.monotonic())[0])
+
+    def acquire(self, deadline=None):
+        """Wait for the least-loaded healthy key with a free slot, returns (ApiKey, slot)
+
+        Pass both to release(). Raises TimeoutError if deadline (an absolute
+        time.monotonic() value) passes first.
+        """
+        with self._cond:
+            self.queued += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    healthy, enabled = self._candidates(now)
+                    for api_key in sorted(healthy, key=ApiKey.load):
+                        slot = api_key.limiter.try_acquire() if api_key.limiter else now
+                        if slot is not None:
+                            api_key.in_flight += 1
+                            api_key.requests += 1
+                            return api_key, slot
+
+                    wait_time = POLL_INTERVAL
+                    if not healthy:
+                        wait_time = max(wait_time, min(k.cooldown_until for k in enabled) - now)
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise TimeoutError("Deadline exceeded waiting for a Gemini API key")
+                        wait_time = min(wait_time, remaining)
+                    self._cond.wait(wait_time)
+            finally:
+                self.queued -= 1
+
+    def release(self, api_key, slot, status=None, latency=None, retry_after=None):
+        """Return a key taken with acquire(), recording the response status and latency"""
+        if api_key.limiter:
+            api_key.limiter.release(slot, status, latency)
+        with self._cond:
+            api_key.in_flight -= 1
+            if status == 429:
+                api_key.throttled += 1
+                # A lone key gains nothing from cooling down beyond the caller's own backoff
+                cooldown = retry_after if retry_after is not None else self.cooldown if len(self.keys) > 1 else 0.0
+                api_key.cooldown_until = max(api_key.cooldown_until, time.monotonic() + cooldown)
+            elif status in (401, 403):
+                api_key.errors += 1
+                api_key.disabled = True
+            elif status is None or status >= 400:
+                api_key.errors += 1
+            self._cond.notify_all()
+
+    def add_tokens(self, api_key, tokens):
+        if not tokens:
+            return
+        with self._cond:
+            api_key.tokens += tokens
+        if api_key.limiter:
+            api_key.limiter.add_tokens(tokens)
+
+    def stats(self):
+        """Per-key counters plus the pool's queue depth"""
+        now = time.monotonic()
+        with self._cond:
+            keys = []
+            for api_key in self.keys:
+                key_stats = {
+                    'key': api_key.label,
+                    'in_flight': api_key.in_flight,
+                    'requests': api_key.requests,
+                    'throttled': api_key.throttled,
+                    'errors': api_key.errors,
+                    'tokens': api_key.tokens,
+                    'cooldown': max(0.0, api_key.cooldown_until - now),
+                    'disabled': api_key.disabled
+                }
+                if api_key.limiter:
+                    key_stats.update(api_key.limiter.stats())
+                keys.append(key_stats)
+            return {'queued': self.queued, 'keys': keys}
@@ -1,17 +1,32 @@
 import streamlit as st
 from PIL import Image
-import requests
-import base64
 import io
 import os
+import time
+import uuid
 import zipfile
 import tempfile
 from dotenv import load_dotenv
 import pandas as pd
-import re
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
+from api_keys import parse_api_keys
+from flyer_analysis import (
+    BATCH_MAX_IMAGE_BYTES, BATCH_SIZE, DEFAULT_MAX_WORKERS, DEFAULT_PREPROCESS,
+    ANALYSIS_CACHE_ENABLED, IMAGE_MIME_TYPES, MAX_WORKERS_LIMIT, STRUCTURED_OUTPUT_ENABLED,
+    TILE_OVERLAP, TILE_SIZE, TILE_THRESHOLD, analyze_flyers, get_analysis_cache
+)
+from columnar_export import (
+    CSV_CHUNK_ROWS, EXPORT_FORMATS, EXPORT_OUTPUT_DIR, create_export_zip, export_output_path, write_export_dir
+)
+from export_cache import flyer_data_fingerprint
+from flyer_export import create_excel_data, create_excel_file, get_export_cache
+from gemini_client import get_call_telemetry, resolve_api_key_pool
+from search_index import FUZZY_RESULT_LIMIT, ProductSearchIndex, get_search_cache
+from flyer_parser import parse_flyer_data
+from rerun_timing import RerunTimings
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,6 +38,12 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Per-section cost of this run, shown under "Rerun Timings" at the bottom of the page
+if 'rerun_timings' not in st.session_state:
+    st.session_state.rerun_timings = RerunTimings()
+rerun_timings = st.session_state.rerun_timings
+rerun_timings.start_run()
+
 # Professional Neon Theme CSS with Enhanced Visuals
 st.markdown("""
 <style>
@@ -395,245 +416,6 @@ header {visibility: hidden;}
 </style>
 """, unsafe_allow_html=True)
 
-def convert_image_to_text(image, api_key):
-    """Convert image to text using Gemini Vision API - Structured Analysis"""
-    
-    try:
-        # Convert image to base64
-        img_buffer = io.BytesIO()
-        image.save(img_buffer, format='PNG')
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-        
-        # Gemini API endpoint
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
-        
-        # Structured analysis prompt
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": """Analyze this image and provide a detailed structured analysis. Format your response like this:
-
-**Store Name:** [Store/Business name]
-
-**Slogan/Motto:** [Any taglines or slogans]
-
-**Featured Products & Prices:**
-* **Product Name:** Size/Weight for $Price (Description/Features)
-* **Product Name:** Size/Weight for $Price (Description/Features)
-[Continue for all products]
-
-**Contact Information:**
-* **Address:** [Full address if visible]
-* **Website:** [Website URL if visible]  
-* **Phone Number:** [Phone number if visible]
-
-**Overall Impression:**
-[Describe the design, colors, main message, and overall marketing approach]
-
-Please analyze this image thoroughly and provide all visible information in this structured format."""},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/png",
-                                "data": img_base64
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        
-        # Make API request
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if 'candidates' in result and len(result['candidates']) > 0:
-                extracted_text = result['candidates'][0]['content']['parts'][0]['text']
-                return extracted_text
-            else:
-                return "No analysis generated"
-        else:
-            error_info = response.json() if response.content else {"error": "Unknown error"}
-            return f"API Error: {error_info.get('error', {}).get('message', 'Request failed')}"
-            
-    except requests.exceptions.Timeout:
-        return "Request timed out. Please try again."
-    except Exception as e:
-        return f"Error: {str(e)}"
-
-def parse_flyer_data(analysis_text, filename):
-    """Extract structured data from flyer analysis"""
-    
-    # Initialize data structure
-    flyer_data = {
-        'filename': filename,
-        'store_name': '',
-        'slogan': '',
-        'address': '',
-        'website': '',
-        'phone': '',
-        'products': []
-    }
-    
-    try:
-        # Extract store name
-        store_match = re.search(r'\*\*Store Name:\*\*\s*(.+?)(?:\n|\*\*)', analysis_text, re.IGNORECASE)
-        if store_match:
-            flyer_data['store_name'] = store_match.group(1).strip()
-        
-        # Extract slogan/motto
-        slogan_match = re.search(r'\*\*Slogan/Motto:\*\*\s*(.+?)(?:\n|\*\*)', analysis_text, re.IGNORECASE)
-        if slogan_match:
-            flyer_data['slogan'] = slogan_match.group(1).strip()
-        
-        # Extract contact info
-        address_match = re.search(r'\*\*Address:\*\*\s*(.+?)(?:\n|\*\*)', analysis_text, re.IGNORECASE)
-        if address_match:
-            flyer_data['address'] = address_match.group(1).strip()
-            
-        website_match = re.search(r'\*\*Website:\*\*\s*(.+?)(?:\n|\*\*)', analysis_text, re.IGNORECASE)
-        if website_match:
-            flyer_data['website'] = website_match.group(1).strip()
-            
-        phone_match = re.search(r'\*\*Phone Number:\*\*\s*(.+?)(?:\n|\*\*)', analysis_text, re.IGNORECASE)
-        if phone_match:
-            flyer_data['phone'] = phone_match.group(1).strip()
-        
-        # Extract products - look for the products section with more flexible patterns
-        products_section = re.search(r'\*\*Featured Products & Prices:\*\*(.*?)(?:\*\*Contact Information|\*\*Overall Impression|\*\*Address|\*\*Website|\*\*Phone|\Z)', 
-                                   analysis_text, re.DOTALL | re.IGNORECASE)
-        
-        if products_section:
-            products_text = products_section.group(1)
-            
-            # Find all product lines that start with * **Product Name:** or similar patterns
-            product_patterns = [
-                r'\*\s*\*\*(.+?):\*\*\s*(.+?)(?:\n|\Z)',  # * **Product Name:** details
-                r'\*\s*(.+?):\s*(.+?)(?:\n|\Z)',          # * Product Name: details
-                r'^\s*\*\s*(.+?)\s*[-–]\s*(.+?)(?:\n|\Z)', # * Product - details
-                r'^\s*\*\s*(.+?)\s*:\s*(.+?)(?:\n|\Z)',   # * Product: details
-            ]
-            
-            for pattern in product_patterns:
-                product_lines = re.findall(pattern, products_text, re.MULTILINE | re.IGNORECASE)
-                if product_lines:
-                    break
-            
-            for product_line in product_lines:
-                product_name = product_line[0].strip()
-                product_details = product_line[1].strip()
-                
-                # Skip empty or invalid entries
-                if not product_name or not product_details or len(product_name) < 2:
-                    continue
-                
-                # More flexible price extraction
-                price_patterns = [
-                    r'\$(\d+\.?\d*)',  # $5.99
-                    r'(\d+\.?\d*)\s*(?:dollars?|bucks?)',  # 5.99 dollars
-                    r'(\d+\.?\d*)\s*(?:for|each|ea)',  # 5.99 for
-                    r'(\d+\.?\d*)\s*(?:\$|dollars?)',  # 5.99$
-                ]
-                
-                price = ''
-                for pattern in price_patterns:
-                    price_match = re.search(pattern, product_details, re.IGNORECASE)
-                    if price_match:
-                        price = f"${price_match.group(1)}"
-                        break
-                
-                # If no price found, try to extract any number
-                if not price:
-                    number_match = re.search(r'(\d+\.?\d*)', product_details)
-                    if number_match:
-                        price = f"${number_match.group(1)}"
-                
-                # Try to extract size/weight with more comprehensive patterns
-                size_patterns = [
-                    r'(\d+\.?\d*\s*(?:gal|gallon|gallons)\b)',  # gallons
-                    r'(\d+\.?\d*\s*(?:l|liter|liters|litre|litres)\b)',  # liters
-                    r'(\d+\.?\d*\s*(?:ml|milliliter|milliliters|millilitre|millilitres)\b)',  # milliliters
-                    r'(\d+\.?\d*\s*(?:oz|ounce|ounces|fl\s*oz|fluid\s*ounce)\b)',  # ounces
-                    r'(\d+\.?\d*\s*(?:lb|lbs|pound|pounds)\b)',  # pounds
-                    r'(\d+\.?\d*\s*(?:kg|kilogram|kilograms)\b)',  # kilograms
-                    r'(\d+\.?\d*\s*(?:g|gram|grams)\b)',  # grams
-                    r'(\d+\.?\d*\s*(?:pack|count|ct|pieces?|pcs?)\b)',  # count/pack
-                    r'(\d+\.?\d*\s*(?:qt|quart|quarts)\b)',  # quarts
-                    r'(\d+\.?\d*\s*(?:pt|pint|pints)\b)',  # pints
-                    r'(\d+\s*x\s*\d+\.?\d*\s*(?:oz|ml|l|gal))',  # multi-pack like "12 x 12oz"
-                    r'(\d+\.?\d*(?:g|kg|ml|l|oz|lb|lbs|pack|count|ct|gal|qt|pt)\b)',  # shorter versions
-                ]
-                
-                size = ''
-                for pattern in size_patterns:
-                    size_match = re.search(pattern, product_details, re.IGNORECASE)
-                    if size_match:
-                        size = size_match.group(1).strip()
-                        break
-                
-                # If no size found in product details, try to extract from product name
-                if not size and product_name:
-                    for pattern in size_patterns:
-                        size_match = re.search(pattern, product_name, re.IGNORECASE)
-                        if size_match:
-                            size = size_match.group(1).strip()
-                            break
-                
-                # Clean up description (remove price and size) with more comprehensive patterns
-                description = product_details
-                if price:
-                    description = re.sub(r'\$\d+\.?\d*', '', description)
-                if size:
-                    # Remove the found size from description
-                    description = re.sub(re.escape(size), '', description, flags=re.IGNORECASE)
-                    # Also remove common size patterns
-                    description = re.sub(r'\d+\.?\d*\s*(?:g|kg|ml|l|oz|lb|lbs|pack|count|ct|gal|gallon|gallons|liter|liters|litre|litres|milliliter|milliliters|quart|quarts|pint|pints|qt|pt|fl\s*oz|fluid\s*ounce|gram|grams|kilogram|kilograms|milliliter|milliliters|ounce|ounces|pound|pounds)\b', '', description, flags=re.IGNORECASE)
-                
-                # Clean up common words and extra spaces
-                description = re.sub(r'\bfor\b|\(|\)|,|\s+', ' ', description, flags=re.IGNORECASE).strip()
-                
-                flyer_data['products'].append({
-                    'product_name': product_name,
-                    'size_weight': size,
-                    'price': price if price else 'Price not found',
-                    'description': description
-                })
-        
-        # If no products found in structured format, try to extract from raw text
-        if not flyer_data['products']:
-            # Look for any product-like patterns in the entire text
-            lines = analysis_text.split('\n')
-            for line in lines:
-                # Skip header lines
-                if any(header in line.lower() for header in ['store name', 'slogan', 'contact', 'address', 'website', 'phone', 'overall impression']):
-                    continue
-                
-                # Look for lines that might contain products
-                if re.search(r'[a-zA-Z]+.*\$?\d+\.?\d*', line):
-                    # Extract product name (first part before price)
-                    parts = re.split(r'[\$\d]', line, 1)
-                    if parts:
-                        product_name = parts[0].strip(' -*')
-                        if len(product_name) > 2:  # Only if reasonable product name
-                            # Try to find price in the line
-                            price_match = re.search(r'\$?(\d+\.?\d*)', line)
-                            price = f"${price_match.group(1)}" if price_match else 'Price not found'
-                            
-                            flyer_data['products'].append({
-                                'product_name': product_name,
-                                'size_weight': '',
-                                'price': price,
-                                'description': line.strip()
-                            })
-        
-    except Exception as e:
-        st.warning(f"Error parsing data from {filename}: {str(e)}")
-    
-    return flyer_data
-
 def extract_images_from_zip(zip_file):
     """Extract image files from uploaded ZIP file"""
     image_files = []
@@ -665,115 +447,52 @@ def extract_images_from_zip(zip_file):
         st.error(f"Error extracting ZIP file: {str(e)}")
         return []
 
-def create_excel_data(all_flyer_data):
-    """Create structured Excel data from analyzed flyers"""
-    
-    # Create stores summary
-    stores_data = []
-    for flyer in all_flyer_data:
-        stores_data.append({
-            'Store_Name': flyer['store_name'] if flyer['store_name'] else 'Unknown Store',
-            'Slogan': flyer['slogan'],
-            'Address': flyer['address'],
-            'Website': flyer['website'],
-            'Phone': flyer['phone'],
-            'Flyer_Source': flyer['filename'],
-            'Products_Count': len(flyer['products'])
-        })
-    
-    # Create products data
-    products_data = []
-    for flyer in all_flyer_data:
-        for product in flyer['products']:
-            # Extract numeric price for calculations
-            price_numeric = 0
-            if product['price'] and product['price'] != 'Price not found':
-                price_match = re.search(r'(\d+\.?\d*)', str(product['price']))
-                if price_match:
-                    try:
-                        price_numeric = float(price_match.group(1))
-                    except:
-                        price_numeric = 0
-            
-            products_data.append({
-                'Product_ID': len(products_data) + 1,
-                'Product_Name': product['product_name'],
-                'Store_Name': flyer['store_name'] if flyer['store_name'] else 'Unknown Store',
-                'Price_Text': product['price'],
-                'Price_Numeric': price_numeric,
-                'Size_Weight': product['size_weight'],
-                'Description': product['description'],
-                'Flyer_Source': flyer['filename']
-            })
-    
-    # Create price comparison data (products grouped by similar names)
-    comparison_data = []
-    product_groups = {}
-    
-    # Group similar products
-    for product in products_data:
-        product_name = product['Product_Name'].lower().strip()
-        # Simple grouping by first word or key terms
-        key_words = product_name.split()
-        if key_words:
-            base_name = key_words[0]
-            if base_name not in product_groups:
-                product_groups[base_name] = []
-            product_groups[base_name].append(product)
-    
-    # Create comparison entries for groups with multiple stores
-    for group_name, products in product_groups.items():
-        if len(products) > 1:  # Only include products available in multiple stores
-            stores_in_group = set(p['Store_Name'] for p in products)
-            if len(stores_in_group) > 1:  # Multiple stores selling similar product
-                for product in products:
-                    if product['Price_Numeric'] > 0:  # Only include products with valid prices
-                        comparison_data.append({
-                            'Product_Group': group_name.title(),
-                            'Product_Name': product['Product_Name'],
-                            'Store_Name': product['Store_Name'],
-                            'Price': product['Price_Numeric'],
-                            'Size_Weight': product['Size_Weight'],
-                            'Stores_Selling': len(stores_in_group)
-                        })
-    
-    return {
-        'stores': pd.DataFrame(stores_data),
-        'products': pd.DataFrame(products_data),
-        'comparisons': pd.DataFrame(comparison_data)
-    }
-
-def create_excel_file(excel_data):
-    """Create downloadable Excel file with multiple sheets"""
-    
-    # Create Excel file in memory
-    output = io.BytesIO()
-    
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Write each sheet
-        excel_data['stores'].to_excel(writer, sheet_name='Stores', index=False)
-        excel_data['products'].to_excel(writer, sheet_name='Products', index=False)
-        excel_data['comparisons'].to_excel(writer, sheet_name='Price_Comparisons', index=False)
-        
-        # Format the sheets
-        for sheet_name in ['Stores', 'Products', 'Price_Comparisons']:
-            worksheet = writer.sheets[sheet_name]
-            
-            # Adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column_name = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_name].width = adjusted_width
-    
-    output.seek(0)
-    return output
+def apply_search_suggestion():
+    """Put the picked suggestion in place of the term being typed, which runs the search for it"""
+    suggestion = st.session_state.search_suggestion
+    if suggestion:
+        terms = [term.strip() for term in st.session_state.get('search_input', '').split(',')][:-1]
+        st.session_state.search_input = ', '.join(terms + [suggestion])
+    st.session_state.search_suggestion = None
+
+def price_comparison_chart(df_single, search_term):
+    """Bar chart of the priced results for one search term"""
+    # Create completely separate bar chart - NO GROUPING
+    fig_individual = px.bar(
+        df_single,
+        x='Store_Name',
+        y='Price_Numeric',
+        title=f'{search_term.title()} - Price Comparison',
+        labels={'Price_Numeric': 'Price ($)', 'Store_Name': 'Store'},
+        height=400,
+        # Single color gradient - no grouping by search term
+        color='Price_Numeric',
+        color_continuous_scale='Viridis',
+        text='Price_Numeric'
+    )
+    # Style the chart
+    fig_individual.update_traces(
+        texttemplate='$%{text:.2f}',
+        textposition='outside',
+        cliponaxis=False
+    )
+
+    fig_individual.update_layout(
+        height=400,
+        showlegend=False,
+        xaxis_title="Store",
+        yaxis_title="Price ($)",
+        title_font_size=16,
+        margin=dict(t=80, b=100, l=80, r=80),
+        yaxis=dict(
+            range=[0, max(df_single['Price_Numeric']) * 1.2]
+        ),
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='white'),
+        xaxis_tickangle=-45
+    )
+    return fig_individual
 
 # Main App Header
 st.markdown("""
@@ -814,10 +533,10 @@ with col3:
 
 st.markdown("<div style='margin: 2rem 0;'></div>", unsafe_allow_html=True)
 
-# Load API key from environment variable
-api_key = os.getenv('GEMINI_API_KEY')
+# Load API key from environment variable, GEMINI_API_KEYS spreads requests over several comma-separated keys
+api_key = os.getenv('GEMINI_API_KEYS') or os.getenv('GEMINI_API_KEY')
 
-if not api_key:
+if not parse_api_keys(api_key):
     st.markdown("""
     <div style='border: 2px solid rgba(255, 100, 100, 0.4); background: rgba(255, 0, 0, 0.05); border-radius: 16px; padding: 2rem; margin: 2rem 0;'>
         <h3 style='color: #ff6666; margin-bottom: 1rem; text-align: center;'>Configuration Required</h3>
@@ -879,26 +598,134 @@ if uploaded_files:
     st.markdown("---")
     st.subheader("Uploaded Flyers")
     
-    # Create responsive grid for image preview
-    cols_per_row = 4
-    for i in range(0, len(uploaded_files), cols_per_row):
-        cols = st.columns(cols_per_row)
-        for j, uploaded_file in enumerate(uploaded_files[i:i+cols_per_row]):
-            with cols[j]:
-                try:
-                    image = Image.open(uploaded_file)
-                    st.image(image, caption=getattr(uploaded_file, 'name', f'Flyer {i+j+1}'), use_container_width=True)
+    with rerun_timings.section("Flyer preview"):
+        # Create responsive grid for image preview
+        cols_per_row = 4
+        for i in range(0, len(uploaded_files), cols_per_row):
+            cols = st.columns(cols_per_row)
+            for j, uploaded_file in enumerate(uploaded_files[i:i+cols_per_row]):
+                with cols[j]:
+                    try:
+                        image = Image.open(uploaded_file)
+                        st.image(image, caption=getattr(uploaded_file, 'name', f'Flyer {i+j+1}'), use_container_width=True)
                     
-                    # Reset file pointer for ZIP extracted files
-                    if upload_method == "zip":
-                        uploaded_file.seek(0)
+                        # Reset file pointer for ZIP extracted files
+                        if upload_method == "zip":
+                            uploaded_file.seek(0)
                         
-                except Exception as e:
-                    st.error(f"Could not display {getattr(uploaded_file, 'name', f'Image {i+j+1}')}")
+                    except Exception as e:
+                        st.error(f"Could not display {getattr(uploaded_file, 'name', f'Image {i+j+1}')}")
     
     # Show total count and analysis button
     st.info(f"{len(uploaded_files)} flyer(s) ready for analysis")
     
+    # Analysis settings
+    with st.expander("Analysis Settings"):
+        max_workers = st.slider(
+            "Parallel analyses",
+            min_value=1,
+            max_value=MAX_WORKERS_LIMIT,
+            value=max(1, min(DEFAULT_MAX_WORKERS, MAX_WORKERS_LIMIT)),
+            help="Most flyers sent to Gemini at the same time; the adaptive limiter backs off below this when Gemini rate limits",
+            key="max_workers"
+        )
+        shrink_images = st.checkbox(
+            "Shrink images before upload",
+            value=True,
+            help="Downscale and re-encode flyers to cut upload time and token usage",
+            key="shrink_images"
+        )
+        if shrink_images:
+            prep_col1, prep_col2, prep_col3 = st.columns(3)
+            with prep_col1:
+                max_dimension = st.number_input(
+                    "Max dimension (px)",
+                    min_value=256,
+                    max_value=8192,
+                    value=DEFAULT_PREPROCESS['max_dimension'],
+                    step=256,
+                    key="image_max_dimension"
+                )
+            with prep_col2:
+                image_format = st.selectbox(
+                    "Format",
+                    list(IMAGE_MIME_TYPES),
+                    index=list(IMAGE_MIME_TYPES).index(DEFAULT_PREPROCESS['image_format']),
+                    key="image_format"
+                )
+            with prep_col3:
+                image_quality = st.slider(
+                    "Quality",
+                    min_value=30,
+                    max_value=100,
+                    value=DEFAULT_PREPROCESS['quality'],
+                    disabled=image_format == 'PNG',
+                    key="image_quality"
+                )
+            grayscale = st.checkbox("Grayscale", value=DEFAULT_PREPROCESS['grayscale'], key="image_grayscale")
+            preprocess = {
+                'max_dimension': int(max_dimension),
+                'image_format': image_format,
+                'quality': int(image_quality),
+                'grayscale': grayscale
+            }
+        else:
+            preprocess = None
+        
+        split_large = st.checkbox(
+            "Split large flyers into tiles",
+            value=False,
+            help=f"Flyers larger than {TILE_THRESHOLD}px are analyzed as overlapping tiles and the products merged",
+            key="split_large_flyers"
+        )
+        tiling = {'tile_size': TILE_SIZE, 'overlap': TILE_OVERLAP, 'threshold': TILE_THRESHOLD} if split_large else None
+        
+        batch_small = st.checkbox(
+            "Batch small flyers",
+            value=False,
+            help=f"Send up to {BATCH_SIZE} coupons or small flyers (under {BATCH_MAX_IMAGE_BYTES // 1024} KB) in one request",
+            key="batch_small_flyers"
+        )
+        
+        structured_output = st.checkbox(
+            "Structured JSON output",
+            value=STRUCTURED_OUTPUT_ENABLED,
+            help="Ask Gemini for JSON matching a product schema instead of parsing markdown",
+            key="structured_output"
+        )
+        
+        stream_results = st.checkbox(
+            "Show products as they arrive",
+            value=False,
+            help="Stream Gemini responses and fill in the products table while flyers are still being analyzed",
+            key="stream_results"
+        )
+        
+        skip_duplicates = st.checkbox(
+            "Skip duplicate flyers",
+            value=False,
+            help="Flyers with identical pixels (the same file uploaded twice, or re-saved without re-encoding) are "
+                 "analyzed once and their products listed once. Skipped flyers are listed after the analysis.",
+            key="skip_duplicates"
+        )
+        
+        use_cache = st.checkbox(
+            "Reuse cached analyses",
+            value=ANALYSIS_CACHE_ENABLED,
+            help="Skip Gemini for flyers that were already analyzed with the same prompt and model",
+            key="use_analysis_cache"
+        )
+        
+        # Running totals kept by the cache, so this doesn't walk the cache directory on every rerun
+        cache_stats = get_analysis_cache().stats()
+        st.caption(
+            f"Cache: {cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KB) • "
+            f"{cache_stats['hits']} hits • {cache_stats['misses']} misses"
+        )
+        if st.button("Clear Cache", key="clear_analysis_cache"):
+            get_analysis_cache().clear()
+            st.rerun()
+    
     # Center the button
     col1, col2, col3 = st.columns([1, 1, 1])
     with col2:
@@ -909,50 +736,55 @@ if uploaded_files:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            all_analyses = []
+            live_table = st.empty()
             
-            for idx, uploaded_file in enumerate(uploaded_files):
-                # Update progress
-                progress = (idx + 1) / len(uploaded_files)
-                progress_bar.progress(progress)
-                
-                file_name = getattr(uploaded_file, 'name', f'Image_{idx+1}')
-                status_text.text(f"Analyzing {file_name}... ({idx + 1}/{len(uploaded_files)})")
-                
-                try:
-                    # Analyze individual flyer
-                    image = Image.open(uploaded_file)
-                    analysis_result = convert_image_to_text(image, api_key)
-                    
-                    if analysis_result and not analysis_result.startswith("Error"):
-                        all_analyses.append({
-                            'filename': file_name,
-                            'analysis': analysis_result,
-                            'status': 'Success'
-                        })
-                    else:
-                        all_analyses.append({
-                            'filename': file_name,
-                            'analysis': analysis_result,
-                            'status': 'Error'
-                        })
-                except Exception as e:
-                    all_analyses.append({
-                        'filename': file_name,
-                        'analysis': f"Error processing image: {str(e)}",
-                        'status': 'Error'
-                    })
-                
-                # Reset file pointer for ZIP extracted files
-                if upload_method == "zip":
-                    uploaded_file.seek(0)
+            # Products shown while the batch runs, per flyer so finished flyers can replace their streamed rows
+            live_products = {}
+            
+            def show_live_products():
+                rows = [
+                    {'Product_Name': p['product_name'], 'Price': p['price'], 'Size_Weight': p['size_weight'], 'Flyer_Source': name}
+                    for name, products in live_products.items()
+                    for p in products
+                ]
+                if rows:
+                    live_table.dataframe(pd.DataFrame(rows), use_container_width=True, height=300)
+            
+            def add_live_products(file_name, products):
+                live_products.setdefault(file_name, []).extend(products)
+                show_live_products()
+            
+            key_pool = resolve_api_key_pool(api_key)
+            
+            def update_progress(completed, analysis):
+                progress_bar.progress(completed / len(uploaded_files))
+                status = f"Analyzed {analysis['filename']} ({completed}/{len(uploaded_files)})"
+                pool_stats = key_pool.stats()
+                limits = [k['limit'] for k in pool_stats['keys'] if 'limit' in k]
+                if limits:
+                    status += f" • concurrency limit {sum(limits)}, {pool_stats['queued']} queued"
+                status_text.text(status)
+                if stream_results and analysis['status'] == 'Success' and not analysis.get('duplicate_of'):
+                    live_products[analysis['filename']] = parse_flyer_data(analysis['analysis'], analysis['filename'])['products']
+                    show_live_products()
+            
+            status_text.text(f"Analyzing {len(uploaded_files)} flyer(s) with {max_workers} worker(s)...")
+            analysis_cache = get_analysis_cache() if use_cache else None
+            all_analyses = analyze_flyers(uploaded_files, api_key, max_workers=max_workers,
+                                          on_result=update_progress, cache=analysis_cache,
+                                          preprocess=preprocess, tiling=tiling,
+                                          batch_size=BATCH_SIZE if batch_small else None,
+                                          on_products=add_live_products if stream_results else None,
+                                          structured=structured_output,
+                                          skip_duplicates=skip_duplicates)
             
             # Clear progress indicators
             progress_bar.empty()
             status_text.empty()
+            live_table.empty()
             
-            # Parse all flyer data and store in session state
-            successful_analyses = [a for a in all_analyses if a['status'] == 'Success']
+            # Parse all flyer data and store in session state, duplicates would only repeat products
+            successful_analyses = [a for a in all_analyses if a['status'] == 'Success' and not a.get('duplicate_of')]
             
             if successful_analyses:
                 all_flyer_data = []
@@ -975,288 +807,361 @@ if uploaded_files:
                         })
                 
                 st.session_state.products_data = products_data
+                st.session_state.search_index = ProductSearchIndex(products_data)
                 st.session_state.all_flyer_data = all_flyer_data  # Store complete flyer data for Excel
+                st.session_state.flyer_data_fingerprint = flyer_data_fingerprint(all_flyer_data)
                 
             
                 st.markdown(f'<div style="background-color: 0; color: 1; padding: 0.75rem 1.25rem; border-radius: 0.375rem; border: 0.90px solid #c3e6cb; white-space: nowrap; overflow: hidden; text-overflow: ellipsis;"> Found {len(products_data)} products from {len(all_flyer_data)} flyers.</div>',
                 unsafe_allow_html=True)
+                
+                cached_count = sum(1 for a in all_analyses if a.get('cached'))
+                if cached_count:
+                    st.caption(f"{cached_count} of {len(all_analyses)} flyer(s) loaded from the analysis cache")
+                
+                duplicate_analyses = [a for a in all_analyses if a.get('duplicate_of')]
+                if duplicate_analyses:
+                    with st.expander(f"{len(duplicate_analyses)} duplicate flyer(s) skipped", expanded=True):
+                        for analysis in duplicate_analyses:
+                            st.markdown(f"**{analysis['filename']}:** same as {analysis['duplicate_of']}, "
+                                        "its products are listed once under that flyer")
+                
+                partial_analyses = [a for a in all_analyses if a['status'] == 'Success' and a.get('failed_tiles')]
+                if partial_analyses:
+                    st.warning(f"{len(partial_analyses)} flyer(s) are missing products from tiles that failed: " + ", ".join(
+                        f"{a['filename']} ({len(a['failed_tiles'])} tile(s): {a['failed_tiles'][0]})" for a in partial_analyses))
+                
+                shrunk = [a for a in all_analyses if a.get('payload_bytes') is not None]
+                if shrunk:
+                    saved_bytes = sum(a['original_bytes'] - a['payload_bytes'] for a in shrunk)
+                    st.caption(f"Pre-processing saved {saved_bytes / 1024:.0f} KB of upload across {len(shrunk)} flyer(s)")
             else:
                 st.error("No successful analyses found.")
+            
+            # Report per-flyer failures without discarding the rest of the batch
+            failed_analyses = [a for a in all_analyses if a['status'] != 'Success']
+            if failed_analyses:
+                with st.expander(f"{len(failed_analyses)} flyer(s) could not be analyzed"):
+                    for analysis in failed_analyses:
+                        st.markdown(f"**{analysis['filename']}:** {analysis['analysis']}")
 # EXCEL PREVIEW AND DOWNLOAD SECTION (NEW)
-if 'all_flyer_data' in st.session_state and st.session_state.all_flyer_data:
-    st.markdown("---")
-    
-    # Create Excel data
-    excel_data = create_excel_data(st.session_state.all_flyer_data)
-    
-    st.markdown("""
+@st.fragment
+def render_excel_preview(excel_data):
+    """Preview tabs of the export tables; a fragment, so other sections' widgets don't rerun it"""
+    with rerun_timings.section("Excel preview"):
+        st.markdown("""
     <div class='excel-preview-section' style='padding: 1rem; margin: 1rem auto; max-width: 500px;'>
         <h3 style='text-align: center; color: 0; margin-bottom: 1rem; font-size: 1.5rem;'>Excel Data Preview</h3>
     </div>
     """, unsafe_allow_html=True)
     
-    # Create tabs for different data views
-    tab1, tab2, tab3 = st.tabs(["🏪 Stores Overview", "🛒 Products Catalog", "💰 Price Comparisons"])
+        # Create tabs for different data views
+        tab1, tab2, tab3 = st.tabs(["🏪 Stores Overview", "🛒 Products Catalog", "💰 Price Comparisons"])
     
-    with tab1:
-        st.markdown("""
+        with tab1:
+            st.markdown("""
         <div class='tab-header'>
             <h4 style='margin: 0; color: #ffffff;'>Stores Information</h4>
             <p style='margin: 0.5rem 0 0 0; color: #cccccc;'>Complete store details extracted from flyers</p>
         </div>
         """, unsafe_allow_html=True)
         
-        if not excel_data['stores'].empty:
-            # Clean the dataframe - remove empty rows
-            stores_df = excel_data['stores'].dropna(how='all').reset_index(drop=True)
-            stores_df.index = range(1, len(stores_df) + 1)
-            # Calculate dynamic height based on number of rows
-            row_height = 35  # approximate height per row
-            header_height = 40
-            min_height = 200
-            max_height = 600
-            calculated_height = min(max(len(stores_df) * row_height + header_height, min_height), max_height)
+            if not excel_data['stores'].empty:
+                # Clean the dataframe - remove empty rows
+                stores_df = excel_data['stores'].dropna(how='all').reset_index(drop=True)
+                stores_df.index = range(1, len(stores_df) + 1)
+                # Calculate dynamic height based on number of rows
+                row_height = 35  # approximate height per row
+                header_height = 40
+                min_height = 200
+                max_height = 600
+                calculated_height = min(max(len(stores_df) * row_height + header_height, min_height), max_height)
             
-            st.dataframe(stores_df, use_container_width=True, height=calculated_height)
+                st.dataframe(stores_df, use_container_width=True, height=calculated_height)
             
             
 
-            # Store statistics
-            col1, col2, col3 , col4, col5,col6 = st.columns([1,1,2,2,2,1])
-            with col3:
-                st.metric("Total Stores", len(stores_df))
-            with col4:
-                st.metric("Stores with Address", len(stores_df[stores_df['Address'] != '']))
-            with col5:
-                st.metric("Stores with Website", len(stores_df[stores_df['Website'] != '']))
-        else:
-            st.warning("No store data available")
+                # Store statistics
+                col1, col2, col3 , col4, col5,col6 = st.columns([1,1,2,2,2,1])
+                with col3:
+                    st.metric("Total Stores", len(stores_df))
+                with col4:
+                    st.metric("Stores with Address", len(stores_df[stores_df['Address'] != '']))
+                with col5:
+                    st.metric("Stores with Website", len(stores_df[stores_df['Website'] != '']))
+            else:
+                st.warning("No store data available")
     
-    with tab2:
-        st.markdown("""
+        with tab2:
+            st.markdown("""
         <div class='tab-header'>
             <h4 style='margin: 0; color: #ffffff;'>Products Catalog</h4>
             <p style='margin: 0.5rem 0 0 0; color: #cccccc;'>All products extracted with pricing information</p>
         </div>
         """, unsafe_allow_html=True)
         
-        if not excel_data['products'].empty:
-            # Clean the dataframe - remove empty rows
-            products_df = excel_data['products'].dropna(how='all').reset_index(drop=True)
+            if not excel_data['products'].empty:
+                # Clean the dataframe - remove empty rows
+                products_df = excel_data['products'].dropna(how='all').reset_index(drop=True)
             
-            products_df.index = range(1, len(products_df) + 1)
-            # Calculate dynamic height
-            row_height = 35
-            header_height = 40
-            min_height = 200
-            max_height = 600
-            calculated_height = min(max(len(products_df) * row_height + header_height, min_height), max_height)
+                products_df.index = range(1, len(products_df) + 1)
+                # Calculate dynamic height
+                row_height = 35
+                header_height = 40
+                min_height = 200
+                max_height = 600
+                calculated_height = min(max(len(products_df) * row_height + header_height, min_height), max_height)
             
-            st.dataframe(products_df, use_container_width=True, height=calculated_height)
+                st.dataframe(products_df, use_container_width=True, height=calculated_height)
             
-            # Product statistics
-            col1, col2, col3 , col4, col5,col6 = st.columns([1,2,2,2,2,1])
-            with col2:
-                st.metric("Total Products", len(products_df))
-            with col3:
-                products_with_prices = len(products_df[products_df['Price_Numeric'] > 0])
-                st.metric("Products with Prices", products_with_prices)
-            with col4:
-                avg_price = products_df[products_df['Price_Numeric'] > 0]['Price_Numeric'].mean()
-                st.metric("Average Price", f"${avg_price:.2f}" if avg_price else "N/A")
-            with col5:
-                unique_stores = products_df['Store_Name'].nunique()
-                st.metric("Unique Stores", unique_stores)
-        else:
-            st.warning("No product data available")
+                # Product statistics
+                col1, col2, col3 , col4, col5,col6 = st.columns([1,2,2,2,2,1])
+                with col2:
+                    st.metric("Total Products", len(products_df))
+                with col3:
+                    products_with_prices = len(products_df[products_df['Price_Numeric'] > 0])
+                    st.metric("Products with Prices", products_with_prices)
+                with col4:
+                    avg_price = products_df[products_df['Price_Numeric'] > 0]['Price_Numeric'].mean()
+                    st.metric("Average Price", f"${avg_price:.2f}" if avg_price else "N/A")
+                with col5:
+                    unique_stores = products_df['Store_Name'].nunique()
+                    st.metric("Unique Stores", unique_stores)
+            else:
+                st.warning("No product data available")
     
-    with tab3:
-        st.markdown("""
+        with tab3:
+            st.markdown("""
         <div class='tab-header'>
             <h4 style='margin: 0; color: #ffffff;'>Price Comparisons</h4>
             <p style='margin: 0.5rem 0 0 0; color: #cccccc;'>Products available across multiple stores for comparison</p>
         </div>
         """, unsafe_allow_html=True)
         
-        if not excel_data['comparisons'].empty:
-            # Clean the dataframe - remove empty rows
-            comparisons_df = excel_data['comparisons'].dropna(how='all').reset_index(drop=True)
-            comparisons_df.index = range(1, len(comparisons_df) + 1)
-            # Calculate dynamic height
-            row_height = 35
-            header_height = 40
-            min_height = 200
-            max_height = 600
-            calculated_height = min(max(len(comparisons_df) * row_height + header_height, min_height), max_height)
+            if not excel_data['comparisons'].empty:
+                # Clean the dataframe - remove empty rows
+                comparisons_df = excel_data['comparisons'].dropna(how='all').reset_index(drop=True)
+                comparisons_df.index = range(1, len(comparisons_df) + 1)
+                # Calculate dynamic height
+                row_height = 35
+                header_height = 40
+                min_height = 200
+                max_height = 600
+                calculated_height = min(max(len(comparisons_df) * row_height + header_height, min_height), max_height)
             
-            st.dataframe(comparisons_df, use_container_width=True, height=calculated_height)
+                st.dataframe(comparisons_df, use_container_width=True, height=calculated_height)
             
-            # Comparison statistics
-            col1, col2, col3 , col4, col5,col6 = st.columns([1,1,2,2,2,1])
-            with col3:
-                st.metric("Comparable Products", len(comparisons_df))
-            with col4:
-                product_groups = comparisons_df['Product_Group'].nunique()
-                st.metric("Product Categories", product_groups)
-            with col5:
-                if len(comparisons_df) > 0:
-                    avg_savings = comparisons_df.groupby('Product_Group')['Price'].apply(lambda x: x.max() - x.min()).mean()
-                    st.metric("Avg Potential Savings", f"${avg_savings:.2f}" if avg_savings else "N/A")
-        else:
-            st.info("No comparable products found across multiple stores")
-    
-    # Download Section
-    st.markdown("---")
-    st.markdown("""
+                # Comparison statistics
+                col1, col2, col3 , col4, col5,col6 = st.columns([1,1,2,2,2,1])
+                with col3:
+                    st.metric("Comparable Products", len(comparisons_df))
+                with col4:
+                    product_groups = comparisons_df['Product_Group'].nunique()
+                    st.metric("Product Categories", product_groups)
+                with col5:
+                    if len(comparisons_df) > 0:
+                        avg_savings = comparisons_df.groupby('Product_Group')['Price'].apply(lambda x: x.max() - x.min()).mean()
+                        st.metric("Avg Potential Savings", f"${avg_savings:.2f}" if avg_savings else "N/A")
+            else:
+                st.info("No comparable products found across multiple stores")
+    st.caption(rerun_timings.describe("Excel preview"))
+
+
+@st.fragment
+def render_downloads(excel_data, data_fingerprint):
+    """Excel report and data exports; a fragment, so preparing a download reruns only this section"""
+    export_cache = get_export_cache()
+    with rerun_timings.section("Downloads"):
+        # Download Section
+        st.markdown("---")
+        st.markdown("""
     <div style='text-align: center; margin: 2rem 0;'>
         <h3 style='color: #ffffff; margin-bottom: 1rem;'>Download Complete Analysis</h3>
         <p style='color: #cccccc; margin-bottom: 2rem;'>Get your complete price analysis in Excel format with all stores, products, and comparisons</p>
     </div>
     """, unsafe_allow_html=True)
     
-    # Center the download button
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
-        # Create Excel file
-        excel_file = create_excel_file(excel_data)
+        # Center the download button
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col2:
+            # The workbook is only built once it is asked for, then reused until the flyer data changes
+            excel_file = export_cache.get(('xlsx', data_fingerprint))
+            if excel_file is None and st.button("PREPARE EXCEL REPORT", key="prepare_excel", use_container_width=True):
+                with st.spinner("Building the Excel report..."):
+                    build_started = time.perf_counter()
+                    excel_file = create_excel_file(excel_data).getvalue()
+                    st.session_state.excel_build = (data_fingerprint, time.perf_counter() - build_started)
+                export_cache.set(('xlsx', data_fingerprint), excel_file)
         
-        # Generate filename with timestamp
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"Cartiously_Price_Analysis_{timestamp}.xlsx"
-        
-        # Download button
-        st.download_button(
-            label="DOWNLOAD EXCEL REPORT",
-            data=excel_file,
-            file_name=filename,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key="download_excel"
-        )
+            if excel_file is not None:
+                # Generate filename with timestamp
+                from datetime import datetime
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"Cartiously_Price_Analysis_{timestamp}.xlsx"
+            
+                # Download button
+                st.download_button(
+                    label="DOWNLOAD EXCEL REPORT",
+                    data=excel_file,
+                    file_name=filename,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key="download_excel"
+                )
+            
+                # File info
+                build_note = ""
+                build_fingerprint, build_seconds = st.session_state.get('excel_build', (None, None))
+                if build_fingerprint == data_fingerprint:
+                    build_note = f" • Built in {build_seconds:.1f} s"
+                st.caption(f"File: {filename} • {len(excel_file) / 1024 / 1024:.1f} MB • "
+                           f"Contains 3 sheets: Stores, Products, Price Comparisons{build_note}")
         
-        # File info
-        st.caption(f"File: {filename} • Contains 3 sheets: Stores, Products, Price Comparisons")
-
+            # Columnar exports of the same tables for BI jobs that shouldn't have to parse xlsx
+            with st.expander("Other formats: Parquet, Arrow IPC, CSV"):
+                export_formats = st.multiselect(
+                    "Formats",
+                    options=list(EXPORT_FORMATS),
+                    default=list(EXPORT_FORMATS),
+                    format_func=EXPORT_FORMATS.get,
+                    key="export_formats"
+                )
+                export_key = ('export_zip', data_fingerprint, tuple(sorted(export_formats)))
+                export_zip = export_cache.get(export_key)
+                if export_formats and export_zip is None and st.button("PREPARE DATA EXPORT", key="prepare_export"):
+                    with st.spinner("Writing the data export..."):
+                        export_zip = create_export_zip(excel_data, export_formats)
+                    export_cache.set(export_key, export_zip)
+            
+                if export_zip is not None:
+                    from datetime import datetime
+                    st.download_button(
+                        label="DOWNLOAD DATA EXPORT (ZIP)",
+                        data=export_zip,
+                        file_name=f"Cartiously_Price_Data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                        mime="application/zip",
+                        key="download_export"
+                    )
+                    st.caption(f"{len(export_zip) / 1024 / 1024:.1f} MB • one folder per format, "
+                               f"CSV split every {CSV_CHUNK_ROWS:,} rows")
+            
+                # Each session writes to its own folder under EXPORT_OUTPUT_DIR unless it picks another name
+                if 'export_name' not in st.session_state:
+                    st.session_state.export_name = f"session-{uuid.uuid4().hex[:8]}"
+                export_name = st.text_input("Export folder", key="export_name",
+                                            help=f"Folder name under {EXPORT_OUTPUT_DIR} on the machine running the app")
+                if st.button("WRITE TO DIRECTORY", key="write_export", disabled=not (export_formats and export_name)):
+                    try:
+                        output_dir = export_output_path(export_name)
+                        written = write_export_dir(excel_data, output_dir, export_formats)
+                        st.success(f"Wrote {len(written)} file(s) to {output_dir}")
+                    except ValueError as e:
+                        st.error(str(e))
+                    except OSError as e:
+                        st.error(f"Could not write the export: {e}")
+    st.caption(rerun_timings.describe("Downloads"))
 
-# PERSISTENT PRODUCT SEARCH (Outside analysis block)
 
-if 'products_data' in st.session_state and st.session_state.products_data:
+if 'all_flyer_data' in st.session_state and st.session_state.all_flyer_data:
     st.markdown("---")
-    st.subheader("Quick Product Search")
-    st.markdown("**Search across all analyzed stores:**")
     
-    products_data = st.session_state.products_data
+    # Create Excel data, reused across reruns until the flyer data changes
+    export_cache = get_export_cache()
+    all_flyer_data = st.session_state.all_flyer_data
+    data_fingerprint = (st.session_state.get('flyer_data_fingerprint')
+                        or flyer_data_fingerprint(all_flyer_data))
+    with rerun_timings.section("Export tables"):
+        excel_data = export_cache.get_or_build(('tables', data_fingerprint), lambda: create_excel_data(all_flyer_data))
+    
+    render_excel_preview(excel_data)
+    render_downloads(excel_data, data_fingerprint)
+
+
+# PERSISTENT PRODUCT SEARCH (Outside analysis block)
+
+@st.fragment
+def render_product_search(product_index, data_fingerprint):
+    """Quick Product Search; a fragment, so searching reruns only this section"""
+    search_cache = get_search_cache()
+    with rerun_timings.section("Product search"):
+        st.markdown("---")
+        st.subheader("Quick Product Search")
+        st.markdown("**Search across all analyzed stores:**")
     
-    # Search interface using form for better alignment
-    with st.form("search_form", clear_on_submit=False):
-        col_search, col_button = st.columns([7, 1])
+        # Search interface using form for better alignment
+        with st.form("search_form", clear_on_submit=False):
+            col_search, col_button = st.columns([7, 1])
         
-        with col_search:
-            search_product = st.text_input(
-                "Product Search",
-                placeholder="Search for products (e.g., milk, bread, eggs)",
-                key="search_input",
-                label_visibility="collapsed"
-            )
+            with col_search:
+                search_product = st.text_input(
+                    "Product Search",
+                    placeholder="Search for products (e.g., milk, bread, eggs)",
+                    key="search_input",
+                    label_visibility="collapsed"
+                )
         
-        with col_button:
-            search_clicked = st.form_submit_button("SEARCH", use_container_width=True)
+            with col_button:
+                st.form_submit_button("SEARCH", use_container_width=True)
+        
+            fuzzy_search = st.checkbox(
+                f"Typo-tolerant: best {FUZZY_RESULT_LIMIT} matches by relevance, then price",
+                key="search_fuzzy"
+            )
     
-    # Available products reference
-    all_product_names = list(set([p['Product_Name'].lower() for p in products_data]))[:12]
-    st.caption(f"Available: {', '.join(all_product_names)}")
+        # Autocomplete for the term being typed (the last after a comma), most widely carried products for an empty box
+        typed_term = st.session_state.get('search_input', '').split(',')[-1]
+        suggestions = dict(product_index.suggest(typed_term))
+        if suggestions:
+            st.pills(
+                "Suggestions" if typed_term.strip() else "Carried by the most stores",
+                list(suggestions),
+                format_func=lambda name: f"{name} ({suggestions[name]} stores)" if suggestions[name] > 1 else name,
+                key="search_suggestion",
+                on_change=apply_search_suggestion
+            )
     
-    # Perform search
-    if search_product:
-        # Handle multiple search terms
-        search_terms = [term.strip() for term in search_product.split(',') if term.strip()]
+        # Perform search
+        if search_product:
+            # Handle multiple search terms
+            search_terms = [term.strip() for term in search_product.split(',') if term.strip()]
         
-        st.success(f"Searching for {len(search_terms)} item(s): {', '.join(search_terms)}")
+            st.success(f"Searching for {len(search_terms)} item(s): {', '.join(search_terms)}")
         
-        # Process each search term individually and completely separately
-        for search_index, search_term in enumerate(search_terms):
-            st.markdown(f"### Results for: **{search_term.title()}**")
+            # Process each search term individually and completely separately
+            for search_index, search_term in enumerate(search_terms):
+                st.markdown(f"### Results for: **{search_term.title()}**")
             
-            # Find products for ONLY this specific search term
-            single_term_results = []
-            for product in products_data:
-                if search_term.lower() in product['Product_Name'].lower():
-                    price_num = 0
-                    if product['Price'] and product['Price'] != 'Price not found':
-                        price_match = re.search(r'(\d+\.?\d*)', str(product['Price']))
-                        if price_match:
-                            try:
-                                price_num = float(price_match.group(1))
-                            except:
-                                price_num = 0
-                    
-                    single_term_results.append({
-                        'Product_Name': product['Product_Name'],
-                        'Store_Name': product['Store_Name'],
-                        'Price_Text': product['Price'],
-                        'Price_Numeric': price_num,
-                        'Size_Weight': product['Size_Weight']
-                    })
+                # Find products for ONLY this specific search term, reusing the results of earlier reruns
+                term_key = (data_fingerprint, search_term.lower(), fuzzy_search)
+                results_df_single = search_cache.get_or_build(
+                    ('results',) + term_key,
+                    lambda: product_index.fuzzy_search(search_term) if fuzzy_search else product_index.search(search_term))
             
-            if single_term_results:
-                st.success(f"Found {len(single_term_results)} products matching '{search_term}'")
+                if len(results_df_single):
+                    if fuzzy_search:
+                        st.success(f"Top {len(results_df_single)} matches for '{search_term}'")
+                    else:
+                        st.success(f"Found {len(results_df_single)} products matching '{search_term}'")
                 
-                # Filter for valid prices - ONLY for this search term
-                chart_data_single = [item for item in single_term_results if item['Price_Numeric'] > 0]
+                    # Filter for valid prices - ONLY for this search term
+                    df_single = results_df_single[results_df_single['Price_Numeric'] > 0]
                 
-                if len(chart_data_single) >= 1:
-                    # Create DataFrame with ONLY this search term's data
-                    df_single = pd.DataFrame(chart_data_single)
-                    
-                    # Create completely separate bar chart - NO GROUPING
-                    fig_individual = px.bar(
-                        df_single,
-                        x='Store_Name',
-                        y='Price_Numeric',
-                        title=f'{search_term.title()} - Price Comparison',
-                        labels={'Price_Numeric': 'Price ($)', 'Store_Name': 'Store'},
-                        height=400,
-                        # Single color gradient - no grouping by search term
-                        color='Price_Numeric',
-                        color_continuous_scale='Viridis',
-                        text='Price_Numeric'
-                    )
-                    
-                    # Style the chart
-                    fig_individual.update_traces(
-                        texttemplate='$%{text:.2f}',
-                        textposition='outside',
-                        cliponaxis=False
-                    )
-                    
-                    fig_individual.update_layout(
-                        height=400,
-                        showlegend=False,
-                        xaxis_title="Store",
-                        yaxis_title="Price ($)",
-                        title_font_size=16,
-                        margin=dict(t=80, b=100, l=80, r=80),
-                        yaxis=dict(
-                            range=[0, max(df_single['Price_Numeric']) * 1.2]
-                        ),
-                        plot_bgcolor='rgba(0,0,0,0)',
-                        paper_bgcolor='rgba(0,0,0,0)',
-                        font=dict(color='white'),
-                        xaxis_tickangle=-45
-                    )
+                    if len(df_single) >= 1:
+                        # Chart of this term's prices, cached as JSON with the results until the data changes
+                        fig_json = search_cache.get_or_build(
+                            ('figure',) + term_key, lambda: price_comparison_chart(df_single, search_term).to_json())
+                        fig_individual = pio.from_json(fig_json, skip_invalid=True)
                     
-                    # Display with completely unique key
-                    st.plotly_chart(fig_individual, use_container_width=True, key=f"persistent_chart_{search_index}_{search_term.replace(' ', '_').replace(',', '')}")
+                        # Display with completely unique key
+                        st.plotly_chart(fig_individual, use_container_width=True, key=f"persistent_chart_{search_index}_{search_term.replace(' ', '_').replace(',', '')}")
                     
-                    # Best deals analysis for this specific term
-                    if len(chart_data_single) > 1:
-                        cheapest_item = min(chart_data_single, key=lambda x: x['Price_Numeric'])
-                        expensive_item = max(chart_data_single, key=lambda x: x['Price_Numeric'])
-                        savings_amount = expensive_item['Price_Numeric'] - cheapest_item['Price_Numeric']
+                        # Best deals analysis for this specific term
+                        if len(df_single) > 1:
+                            cheapest_item = df_single.loc[df_single['Price_Numeric'].idxmin()]
+                            expensive_item = df_single.loc[df_single['Price_Numeric'].idxmax()]
+                            savings_amount = expensive_item['Price_Numeric'] - cheapest_item['Price_Numeric']
                         
-                       
-                        # Deal cards - centered on page
-                    st.markdown(f"""
+                            # Deal cards - centered on page
+                            st.markdown(f"""
 <div style='width: 100%; display: flex; justify-content: center;'>
     <div style='display: flex; gap: 1rem; margin: 1.5rem 0;'>
         <div class='deal-card best'>
@@ -1277,29 +1182,89 @@ if 'products_data' in st.session_state and st.session_state.products_data:
     </div>
 </div>
 """, unsafe_allow_html=True)                
-                # Results table for this specific search term
-                st.markdown(f"#### All {search_term.title()} Results")
-                results_df_single = pd.DataFrame(single_term_results)
-                results_df_single.index = range(1, len(results_df_single) + 1)
-                st.dataframe(
-                    results_df_single[['Product_Name', 'Store_Name', 'Price_Text', 'Size_Weight']], 
-                    use_container_width=True,
-                    key=f"persistent_table_{search_index}_{search_term.replace(' ', '_').replace(',', '')}"
-                )
+                    # Results table for this specific search term
+                    st.markdown(f"#### All {search_term.title()} Results")
+                    table_columns = ['Product_Name', 'Store_Name', 'Price_Text', 'Size_Weight']
+                    if fuzzy_search:
+                        table_columns.append('Relevance')
+                    st.dataframe(
+                        results_df_single[table_columns], 
+                        use_container_width=True,
+                        key=f"persistent_table_{search_index}_{search_term.replace(' ', '_').replace(',', '')}"
+                    )
                 
-            else:
-                st.warning(f"No results found for '{search_term}'")
+                else:
+                    st.warning(f"No results found for '{search_term}'")
             
-            # Add separator between search terms (not for the last one)
-            if search_index < len(search_terms) - 1:
-                st.markdown("---")
-                st.markdown("<div style='margin: 2rem 0;'></div>", unsafe_allow_html=True)
+                # Add separator between search terms (not for the last one)
+                if search_index < len(search_terms) - 1:
+                    st.markdown("---")
+                    st.markdown("<div style='margin: 2rem 0;'></div>", unsafe_allow_html=True)
+    st.caption(rerun_timings.describe("Product search"))
+
+
+if 'products_data' in st.session_state and st.session_state.products_data:
+    products_data = st.session_state.products_data
+    # Built when the analysis finished; sessions from before the index existed get one here
+    if 'search_index' not in st.session_state:
+        st.session_state.search_index = ProductSearchIndex(products_data)
+    product_index = st.session_state.search_index
+    data_fingerprint = st.session_state.get('flyer_data_fingerprint') or flyer_data_fingerprint(products_data)
+    
+    render_product_search(product_index, data_fingerprint)
 
 else:
     # Welcome section when no data available AND no files uploaded
     if not uploaded_files:
         st.info("Upload and analyze flyers to start searching products and accessing Excel features!")
 
+# GEMINI DIAGNOSTICS - per-call latency, payload size and token usage
+call_telemetry = get_call_telemetry()
+if call_telemetry.snapshot():
+    with st.expander("Gemini Diagnostics"):
+        call_summary = call_telemetry.summary()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Calls", call_summary['calls'], f"{call_summary['errors']} failed", delta_color="off")
+        col2.metric("Retries", call_summary['retries'])
+        col3.metric("Sent", f"{call_summary['request_bytes'] / (1024 * 1024):.1f} MB")
+        col4.metric("Tokens", f"{call_summary['prompt_tokens'] + call_summary['candidate_tokens']:,}")
+        
+        # Per-key routing, quota and adaptive concurrency state
+        pool_stats = resolve_api_key_pool(api_key).stats()
+        st.caption(f"{len(pool_stats['keys'])} API key(s) • {pool_stats['queued']} request(s) queued")
+        key_rows = pd.DataFrame(pool_stats['keys'])
+        key_rows['cooldown'] = key_rows['cooldown'].round(1)
+        st.dataframe(key_rows, use_container_width=True, hide_index=True)
+        
+        st.caption(" • ".join(
+            f"{label} p50 {call_summary[field]['p50'] * 1000:.0f} ms / p95 {call_summary[field]['p95'] * 1000:.0f} ms"
+            for label, field in [("Encode", 'encode_seconds'), ("TTFB", 'ttfb_seconds'), ("Latency", 'latency_seconds')]
+        ))
+        
+        histogram_field = st.selectbox(
+            "Histogram",
+            ['latency_seconds', 'ttfb_seconds', 'encode_seconds', 'request_bytes', 'prompt_tokens', 'candidate_tokens'],
+            key="telemetry_histogram_field"
+        )
+        histogram = pd.DataFrame(call_telemetry.histogram(histogram_field), columns=['Bucket', 'Calls'])
+        fig_histogram = px.bar(histogram, x='Bucket', y='Calls')
+        fig_histogram.update_layout(height=300, margin=dict(l=20, r=20, t=20, b=20))
+        st.plotly_chart(fig_histogram, use_container_width=True, key="telemetry_histogram")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="Download call log (JSONL)",
+                data=call_telemetry.to_jsonl(),
+                file_name="gemini_calls.jsonl",
+                mime="application/x-ndjson",
+                key="download_telemetry"
+            )
+        with col2:
+            if st.button("Clear Diagnostics", key="clear_telemetry"):
+                call_telemetry.clear()
+                st.rerun()
+
 # Hide Streamlit elements
 hide_st_style = """
 <style>
@@ -1310,3 +1275,17 @@ header {visibility: hidden;}
 </style>
 """
 st.markdown(hide_st_style, unsafe_allow_html=True)
+
+rerun_timings.finish_run()
+
+# RERUN TIMINGS - full-script run versus section-only (fragment) rerun cost
+@st.fragment
+def render_rerun_timings():
+    with st.expander("Rerun Timings"):
+        st.caption("Search, the Excel preview and the downloads rerun on their own; "
+                   "the rest of the page only reruns when something outside them changes")
+        st.dataframe(pd.DataFrame(rerun_timings.rows()), use_container_width=True, hide_index=True)
+        st.button("Refresh", key="refresh_rerun_timings")
+
+
+render_rerun_timings()
@@ -0,0 +1,639 @@
+"""Offline benchmarks for the flyer pipeline
+
+    python benchmark.py pipeline --flyers 60 --workers 8 --latency 0.8 --rate-limit-rate 0.05
+
+    python benchmark.py parser --repeat 20
+    python benchmark.py tables --products 100000
+    python benchmark.py matching --products 10000,100000
+    python benchmark.py excel --products 200000
+    python benchmark.py exports --products 200000
+    python benchmark.py search --products 10000,100000,1000000
+
+The pipeline benchmark starts a local Gemini stand-in (gemini_stub.py), unless
+--base-url points at one already running, and pushes synthetic flyers through
+upload -> analyze -> parse -> export. It reports flyers/second and per-flyer
+latency percentiles.
+
+The parser benchmark checks parse_flyer_data against the expected output of the
+analyses in parser_corpus/ and reports products parsed per second. The tables
+benchmark times create_excel_data on a synthetic catalog, and the matching
+benchmark times product grouping at several catalog sizes. The excel benchmark
+times writing the xlsx report, the exports benchmark writing and reading back
+the Parquet, Arrow and CSV exports, and the search benchmark times product
+search queries against the index and the old linear scan.
+"""
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+import gemini_stub
+from telemetry import percentile
+
+
+def format_latency(values):
+    return (f"p50 {percentile(values, 50) * 1000:.0f} ms, p95 {percentile(values, 95) * 1000:.0f} ms, "
+            f"p99 {percentile(values, 99) * 1000:.0f} ms")
+
+
+def synthetic_flyers(count, width=1200, height=1600, seed=0):
+    """In-memory flyer images shaped like uploads (BytesIO with a name)"""
+    rng = random.Random(seed)
+    flyers = []
+    for idx in range(count):
+        image = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(image)
+        for _ in range(60):
+            x, y = rng.randrange(width), rng.randrange(height)
+            draw.rectangle([x, y, x + rng.randrange(40, 300), y + rng.randrange(20, 160)],
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+            draw.text((x + 5, y + 5), f"${rng.uniform(1, 20):.2f}", fill='black')
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        flyer = io.BytesIO(buffer.getvalue())
+        flyer.name = f"flyer_{idx + 1:03d}.jpg"
+        flyers.append(flyer)
+    return flyers
+
+
+def run_pipeline_benchmark(args):
+    server = None
+    stub = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        stub = gemini_stub.stub_from_args(args)
+        server, base_url = gemini_stub.start_stub_server(stub)
+
+    # The pipeline modules read their configuration when imported
+    os.environ['GEMINI_BASE_URL'] = base_url
+    os.environ['ANALYSIS_CACHE_ENABLED'] = '0'
+    os.environ['GEMINI_ADAPTIVE_CONCURRENCY'] = '0' if args.no_adaptive else '1'
+    os.environ['GEMINI_RPM'] = str(args.rpm)
+    os.environ['GEMINI_TPM'] = str(args.tpm)
+    from flyer_analysis import DEFAULT_PREPROCESS, analyze_flyers
+    from flyer_export import create_excel_data, create_excel_file
+    from flyer_parser import parse_flyer_data
+    from gemini_client import get_call_telemetry, resolve_api_key_pool
+
+    flyers = synthetic_flyers(args.flyers, seed=args.seed or 0)
+    print(f"Benchmarking {len(flyers)} flyers against {base_url} with {args.workers} worker(s)")
+
+    timings = {}
+    started = time.perf_counter()
+
+    streamed_products = []
+    stage_started = time.perf_counter()
+    analyses = analyze_flyers(
+        flyers, args.api_key, max_workers=args.workers,
+        preprocess=None if args.no_preprocess else DEFAULT_PREPROCESS,
+        batch_size=args.batch_size, structured=args.structured,
+        on_products=(lambda file_name, products: streamed_products.extend(products)) if args.stream else None
+    )
+    timings['analyze'] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    all_flyer_data = [parse_flyer_data(a['analysis'], a['filename']) for a in analyses if a['status'] == 'Success']
+    timings['parse'] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    excel_data = create_excel_data(all_flyer_data)
+    timings['tables'] = time.perf_counter() - stage_started
+
+    stage_started = time.perf_counter()
+    workbook = create_excel_file(excel_data)
+    timings['excel'] = time.perf_counter() - stage_started
+
+    total = time.perf_counter() - started
+    latencies = [a['elapsed'] for a in analyses if 'elapsed' in a]
+    failures = [a for a in analyses if a['status'] != 'Success']
+
+    print(f"Throughput: {len(flyers) / total:.2f} flyers/s ({total:.2f} s total)")
+    print(f"Per-flyer latency: {format_latency(latencies)}")
+    print("Stages: " + ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in timings.items()))
+    if args.stream:
+        parsed_count = sum(len(flyer['products']) for flyer in all_flyer_data)
+        print(f"Streamed products: {len(streamed_products)} of {parsed_count} parsed from the full analyses")
+    print(f"Products: {len(excel_data['products'])}, workbook {len(workbook.getvalue()) / 1024:.0f} KB, "
+          f"failed flyers: {len(failures)}")
+    calls = get_call_telemetry().summary()
+    print(f"Gemini calls: {calls['calls']} ({calls['errors']} failed, {calls['retries']} retries), "
+          f"{calls['request_bytes'] / 1024:.0f} KB sent, "
+          f"{calls['prompt_tokens']} prompt / {calls['candidate_tokens']} candidate tokens")
+    print(f"Gemini TTFB p50 {calls['ttfb_seconds']['p50'] * 1000:.0f} ms, p95 {calls['ttfb_seconds']['p95'] * 1000:.0f} ms; "
+          f"encode p50 {calls['encode_seconds']['p50'] * 1000:.0f} ms")
+    for key_stats in resolve_api_key_pool(args.api_key).stats()['keys']:
+        print(f"Key {key_stats['key']}: " + ", ".join(f"{name} {value}" for name, value in key_stats.items() if name != 'key'))
+    if stub:
+        print(f"Stub: {stub.stats()}")
+        server.shutdown()
+
+
+SYNTHETIC_SIZES = ['1 gal', '2 L', '500ml', '12 x 355ml', '6 x 710 mL', '24 pack', '12 count', '2 lb', '5 lbs',
+                   '1.5 kg', '907 g', '16 oz', '64 fl oz', '1 qt', '2 pints', '']
+
+
+def synthetic_catalog(product_count, store_count=20, seed=0):
+    """Parsed flyers (as parse_flyer_data returns them) holding product_count products in total"""
+    rng = random.Random(seed)
+    stores = [f"{gemini_stub.STUB_STORES[idx % len(gemini_stub.STUB_STORES)]} {idx + 1}" for idx in range(store_count)]
+    flyers = []
+    per_flyer = 200
+    for flyer_idx in range(0, product_count, per_flyer):
+        store = rng.choice(stores)
+        products = []
+        for _ in range(min(per_flyer, product_count - flyer_idx)):
+            name, _ = rng.choice(gemini_stub.STUB_PRODUCTS)
+            products.append({
+                'product_name': f"{rng.choice(['', 'Organic ', 'Large ', 'Family '])}{name}",
+                'size_weight': rng.choice(SYNTHETIC_SIZES),
+                'price': rng.choice([f"${rng.uniform(0.5, 30):.2f}", 'Price not found']),
+                'description': rng.choice(['On sale', 'Fresh', ''])
+            })
+        flyers.append({'filename': f"flyer_{flyer_idx // per_flyer + 1:05d}.jpg", 'store_name': store, 'slogan': '',
+                       'address': '', 'website': '', 'phone': '', 'products': products})
+    return flyers
+
+
+def row_wise_excel_data(all_flyer_data):
+    """create_excel_data as it was before the columnar build: rows of dicts, then DataFrames
+
+    Kept as the reference the tables benchmark checks and times the columnar build against.
+    """
+    import re
+
+    import pandas as pd
+
+    from flyer_export import add_unit_price_columns
+    from product_matching import group_products
+
+    stores_data = []
+    products_data = []
+    for flyer in all_flyer_data:
+        store_name = flyer['store_name'] if flyer['store_name'] else 'Unknown Store'
+        stores_data.append({'Store_Name': store_name, 'Slogan': flyer['slogan'], 'Address': flyer['address'],
+                            'Website': flyer['website'], 'Phone': flyer['phone'], 'Flyer_Source': flyer['filename'],
+                            'Products_Count': len(flyer['products'])})
+        for product in flyer['products']:
+            price_numeric = 0
+            if product['price'] and product['price'] != 'Price not found':
+                price_match = re.search(r'(\d+\.?\d*)', str(product['price']))
+                if price_match:
+                    price_numeric = float(price_match.group(1))
+            products_data.append({'Product_ID': len(products_data) + 1, 'Product_Name': product['product_name'],
+                                  'Store_Name': store_name, 'Price_Text': product['price'],
+                                  'Price_Numeric': price_numeric, 'Size_Weight': product['size_weight'],
+                                  'Description': product['description'], 'Flyer_Source': flyer['filename']})
+
+    product_groups = {}
+    group_ids, group_labels = group_products([product['Product_Name'] for product in products_data])
+    for product, group_id in zip(products_data, group_ids):
+        product_groups.setdefault(group_id, []).append(product)
+    comparison_data = []
+    for group_id, products in product_groups.items():
+        stores_in_group = set(p['Store_Name'] for p in products)
+        if len(products) > 1 and group_labels[group_id] and len(stores_in_group) > 1:
+            for product in products:
+                if product['Price_Numeric'] > 0:
+                    comparison_data.append({'Product_Group': group_labels[group_id],
+                                            'Product_Name': product['Product_Name'],
+                                            'Store_Name': product['Store_Name'], 'Price': product['Price_Numeric'],
+                                            'Size_Weight': product['Size_Weight'],
+                                            'Stores_Selling': len(stores_in_group)})
+
+    return {
+        'stores': pd.DataFrame(stores_data),
+        'products': add_unit_price_columns(pd.DataFrame(products_data), 'Price_Numeric'),
+        'comparisons': add_unit_price_columns(pd.DataFrame(comparison_data), 'Price')
+    }
+
+
+def table_differences(expected, actual):
+    """Names of the tables whose values differ (categorical columns compared by value)"""
+    import pandas as pd
+
+    differences = []
+    for name, expected_df in expected.items():
+        actual_df = actual[name].copy()
+        for column in actual_df.columns:
+            if isinstance(actual_df[column].dtype, pd.CategoricalDtype) and column in expected_df:
+                actual_df[column] = actual_df[column].astype(expected_df[column].dtype)
+        try:
+            pd.testing.assert_frame_equal(expected_df, actual_df, check_dtype=False)
+        except AssertionError:
+            differences.append(name)
+    return differences
+
+
+def frame_memory(tables):
+    return sum(df.memory_usage(deep=True).sum() for df in tables.values())
+
+
+def run_tables_benchmark(args):
+    from flyer_export import create_excel_data
+
+    flyers = synthetic_catalog(args.products, store_count=args.stores, seed=args.seed)
+    started = time.perf_counter()
+    excel_data = create_excel_data(flyers)
+    elapsed = time.perf_counter() - started
+
+    products = excel_data['products']
+    print(f"create_excel_data: {len(products)} products, {len(excel_data['comparisons'])} comparison rows "
+          f"in {elapsed:.3f} s, {frame_memory(excel_data) / 1e6:.1f} MB")
+    print(f"Unit prices for {products['Unit_Price'].notna().sum()} of {len(products)} products")
+
+    if args.compare:
+        started = time.perf_counter()
+        row_wise = row_wise_excel_data(flyers)
+        row_wise_elapsed = time.perf_counter() - started
+        print(f"row-wise build: {row_wise_elapsed:.3f} s, {frame_memory(row_wise) / 1e6:.1f} MB "
+              f"({row_wise_elapsed / elapsed:.1f}x the columnar time)")
+        differences = table_differences(row_wise, excel_data)
+        if differences:
+            print(f"Tables differ from the row-wise build: {', '.join(differences)}")
+            return 1
+        print("Tables match the row-wise build")
+
+
+def cell_walk_excel_file(excel_data):
+    """create_excel_file as it was before the streaming export: DataFrame.to_excel, then widths from every cell
+
+    Kept as the reference the excel benchmark times the streaming export against.
+    """
+    import pandas as pd
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, table in [('Stores', 'stores'), ('Products', 'products'), ('Price_Comparisons', 'comparisons')]:
+            excel_data[table].to_excel(writer, sheet_name=sheet_name, index=False)
+            worksheet = writer.sheets[sheet_name]
+            for column in worksheet.columns:
+                max_length = max(len(str(cell.value)) for cell in column)
+                worksheet.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+    output.seek(0)
+    return output
+
+
+def run_excel_benchmark(args):
+    import tracemalloc
+
+    from flyer_export import create_excel_data, create_excel_file
+
+    excel_data = create_excel_data(synthetic_catalog(args.products, store_count=args.stores, seed=args.seed))
+    rows = sum(len(df) for df in excel_data.values())
+    builders = [('streaming export', create_excel_file)]
+    if args.compare:
+        builders.append(('cell-walk export', cell_walk_excel_file))
+
+    for label, build in builders:
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        workbook = build(excel_data).getvalue()
+        elapsed = time.perf_counter() - started
+        memory = ''
+        if args.memory:
+            memory = f", {tracemalloc.get_traced_memory()[1] / 1e6:.0f} MB peak traced memory"
+            tracemalloc.stop()
+        print(f"{label}: {len(excel_data['products'])} product rows ({rows} rows in all) in {elapsed:.2f} s, "
+              f"{len(workbook) / 1e6:.1f} MB file{memory}")
+
+
+def run_exports_benchmark(args):
+    import zipfile
+
+    import pandas as pd
+
+    from columnar_export import EXPORT_FORMATS, create_export_zip
+    from flyer_export import create_excel_data, create_excel_file
+
+    excel_data = create_excel_data(synthetic_catalog(args.products, store_count=args.stores, seed=args.seed))
+    readers = {
+        'parquet': pd.read_parquet,
+        'feather': pd.read_feather,
+        'csv': pd.read_csv
+    }
+    for export_format in EXPORT_FORMATS:
+        started = time.perf_counter()
+        export_zip = create_export_zip(excel_data, formats=(export_format,))
+        write_seconds = time.perf_counter() - started
+
+        archive = zipfile.ZipFile(io.BytesIO(export_zip))
+        started = time.perf_counter()
+        products = pd.concat([readers[export_format](io.BytesIO(archive.read(name)))
+                              for name in sorted(archive.namelist()) if '/products' in name])
+        read_seconds = time.perf_counter() - started
+        print(f"{EXPORT_FORMATS[export_format]}: written in {write_seconds:.2f} s, {len(export_zip) / 1e6:.1f} MB zip, "
+              f"{len(products)} products read back in {read_seconds:.2f} s")
+
+    if args.xlsx:
+        workbook = create_excel_file(excel_data)
+        started = time.perf_counter()
+        products = pd.read_excel(workbook, sheet_name='Products')
+        print(f"xlsx: {len(products)} products read back in {time.perf_counter() - started:.2f} s")
+
+
+def synthetic_product_names(count, seed=0):
+    """count product names from a large vocabulary, most distinct, with reworded and resized variants"""
+    rng = random.Random(seed)
+    syllables = ['ba', 'ko', 'ri', 'mu', 'te', 'lo', 'sa', 'ne', 'vi', 'du', 'ga', 'pe', 'fi', 'ho', 'ja', 'ru', 'zo', 'ci', 'we', 'ta']
+    words = sorted({''.join(rng.choice(syllables) for _ in range(rng.randint(2, 3))) for _ in range(5000)})
+    bases = [' '.join(rng.sample(words, rng.randint(2, 4))) for _ in range(max(1, count // 4))]
+    names = []
+    for _ in range(count):
+        tokens = rng.choice(bases).split()
+        if rng.random() < 0.3:
+            tokens.insert(rng.randint(0, len(tokens)), rng.choice(['Organic', 'Large', 'Family', 'Fresh']))
+        if rng.random() < 0.2:
+            tokens.append(rng.choice(words))
+        if rng.random() < 0.3:
+            tokens.append(rng.choice(SYNTHETIC_SIZES))
+        names.append(' '.join(tokens).title())
+    return names
+
+
+def run_matching_benchmark(args):
+    import numpy as np
+    from product_matching import (candidate_pairs, group_products, minhash_signatures, normalize_product_name,
+                                  rare_token_pairs)
+
+    for count in args.products:
+        names = synthetic_product_names(count, seed=args.seed)
+        started = time.perf_counter()
+        group_ids, labels = group_products(names)
+        elapsed = time.perf_counter() - started
+
+        unique_sets = list(dict.fromkeys(normalize_product_name(name) for name in names))
+        pairs = len(np.unique(np.r_[candidate_pairs(minhash_signatures(unique_sets)), rare_token_pairs(unique_sets)],
+                              axis=0))
+        all_pairs = len(unique_sets) * (len(unique_sets) - 1) // 2
+        print(f"{count:>8} names, {len(unique_sets):>7} distinct: {len(labels):>7} groups in {elapsed:.3f} s, "
+              f"{pairs} candidate pairs ({pairs / max(all_pairs, 1):.4%} of {all_pairs} all-pairs comparisons)")
+
+
+def synthetic_search_products(count, seed=0):
+    """products_data entries (as the app stores them) with mostly distinct names"""
+    rng = random.Random(seed)
+    stores = [f"{store} {idx + 1}" for idx, store in enumerate(gemini_stub.STUB_STORES)]
+    return [{
+        'Product_ID': idx + 1,
+        'Product_Name': name,
+        'Store_Name': rng.choice(stores),
+        'Price': rng.choice([f"${rng.uniform(0.5, 30):.2f}", 'Price not found']),
+        'Size_Weight': rng.choice(SYNTHETIC_SIZES),
+        'Description': '',
+        'Flyer_Source': f"flyer_{idx // 200 + 1:05d}.jpg"
+    } for idx, name in enumerate(synthetic_product_names(count, seed=seed))]
+
+
+def search_queries(products, count, seed=0):
+    """Queries in the shapes people type: whole words, word starts, word middles, two words, short ones"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(products)['Product_Name'].split()
+        word = rng.choice(words)
+        shape = rng.randrange(5)
+        if shape == 0:
+            queries.append(word)
+        elif shape == 1:
+            queries.append(word[:rng.randint(3, max(3, len(word)))])
+        elif shape == 2 and len(word) > 4:
+            start = rng.randint(1, len(word) - 4)
+            queries.append(word[start:start + 3])
+        elif shape == 3 and len(words) > 1:
+            queries.append(' '.join(words[:2]))
+        else:
+            queries.append(word[:2])
+    return queries
+
+
+def misspell(word, rng):
+    """word with one typo: a dropped, doubled, swapped or replaced letter"""
+    if len(word) < 3:
+        return word
+    idx = rng.randrange(1, len(word) - 1)
+    typo = rng.randrange(4)
+    if typo == 0:
+        return word[:idx] + word[idx + 1:]
+    if typo == 1:
+        return word[:idx] + word[idx] + word[idx:]
+    if typo == 2:
+        return word[:idx] + word[idx + 1] + word[idx] + word[idx + 2:]
+    return word[:idx] + rng.choice('aeioustr') + word[idx + 1:]
+
+
+def fuzzy_queries(products, count, seed=0):
+    """One- and two-word queries taken from product names, with a typo in one word"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(products)['Product_Name'].split()
+        picked = rng.sample(words, min(len(words), rng.randint(1, 2)))
+        typo = rng.randrange(len(picked))
+        queries.append(' '.join(misspell(word, rng) if idx == typo else word for idx, word in enumerate(picked)))
+    return queries
+
+
+def run_search_benchmark(args):
+    from search_index import FUZZY_RESULT_LIMIT, ProductSearchIndex
+
+    for count in args.products:
+        products = synthetic_search_products(count, seed=args.seed)
+        started = time.perf_counter()
+        index = ProductSearchIndex(products)
+        build_seconds = time.perf_counter() - started
+
+        latencies = []
+        lookup_latencies = []
+        matches = 0
+        for query in search_queries(products, args.queries, seed=args.seed):
+            started = time.perf_counter()
+            rows = index.find(query)
+            lookup_latencies.append(time.perf_counter() - started)
+            matches += len(index.results(rows))
+            latencies.append(time.perf_counter() - started)
+
+        fuzzy_latencies = []
+        for query in fuzzy_queries(products, args.queries, seed=args.seed):
+            started = time.perf_counter()
+            index.fuzzy_search(query)
+            fuzzy_latencies.append(time.perf_counter() - started)
+
+        # Autocomplete as the start of a name is typed, one keystroke at a time
+        suggest_latencies = []
+        rng = random.Random(args.seed)
+        for _ in range(args.queries // 5):
+            name = rng.choice(products)['Product_Name']
+            for length in range(1, min(len(name), 6) + 1):
+                started = time.perf_counter()
+                index.suggest(name[:length])
+                suggest_latencies.append(time.perf_counter() - started)
+
+        # The scan the search used to do per term, for a few of the same queries
+        scan_latencies = []
+        for query in search_queries(products, args.scan_queries, seed=args.seed):
+            started = time.perf_counter()
+            [product for product in products if query.lower() in product['Product_Name'].lower()]
+            scan_latencies.append(time.perf_counter() - started)
+
+        print(f"{count} products ({len(index.names)} distinct names), index built in {build_seconds:.2f} s, "
+              f"{matches / args.queries:.0f} matches per query on average")
+        print(f"  index lookup:      {format_latency(lookup_latencies)}")
+        print(f"  lookup + results:  {format_latency(latencies)}")
+        print(f"  fuzzy (top {FUZZY_RESULT_LIMIT}):    {format_latency(fuzzy_latencies)}")
+        print(f"  autocomplete:      {format_latency(suggest_latencies)}")
+        print(f"  old linear scan:   {format_latency(scan_latencies)}")
+
+
+PARSER_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parser_corpus')
+PARSER_EXPECTED_FILE = os.path.join(PARSER_CORPUS_DIR, 'expected.json')
+
+
+def load_parser_corpus(corpus_dir=PARSER_CORPUS_DIR):
+    """{file name: analysis text} for the recorded analyses in the corpus"""
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.md'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            corpus[os.path.basename(path)] = f.read()
+    return corpus
+
+
+# Tiles whose products must survive merge_tile_analyses unchanged: an empty
+# field right before another product, overlap repeats, markdown and JSON mixed
+TILE_ROUND_TRIP_CASES = [
+    (['{"store_name": "Fresh Mart", "products": [{"name": "Bananas", "price": null, "description": ""}, '
+      '{"name": "Deli Special", "price": 20, "description": "Sandwich platter"}]}',
+      '{"products": [{"name": "Deli Special", "price": 20, "description": "Sandwich platter, serves 10"}, '
+      '{"name": "Milk", "price": 3.49, "size": "1 gal"}]}'],
+     [('Bananas', 'Price not found'), ('Deli Special', '$20.00'), ('Milk', '$3.49')]),
+    (['**Store Name:** Corner Grocer\n**Featured Products & Prices:**\n* **Apples:** $1.99/lb\n* **Bread:** $2.50\n',
+      '{"products": [{"name": "Bread", "price": 2.5}, {"name": "Eggs: Large", "price": 4, "description": "**Dozen**"}]}'],
+     [('Apples', '$1.99'), ('Bread', '$2.50'), ('Eggs: Large', '$4.00')]),
+]
+
+
+def check_tile_round_trip(corpus):
+    """Names of corpus analyses and TILE_ROUND_TRIP_CASES that merge_tile_analyses changes"""
+    from flyer_parser import merge_tile_analyses, parse_flyer_data
+
+    failures = [name for name, text in corpus.items()
+                if parse_flyer_data(merge_tile_analyses([text], name), name) != parse_flyer_data(text, name)]
+    for idx, (tiles, products) in enumerate(TILE_ROUND_TRIP_CASES):
+        merged = parse_flyer_data(merge_tile_analyses(tiles), '')
+        if [(product['product_name'], product['price']) for product in merged['products']] != products:
+            failures.append(f"tile case {idx}")
+    return failures
+
+
+def run_parser_benchmark(args):
+    from flyer_parser import parse_flyer_data
+
+    corpus = load_parser_corpus(args.corpus)
+    parsed = {name: parse_flyer_data(text, name) for name, text in corpus.items()}
+
+    if args.update:
+        with open(PARSER_EXPECTED_FILE, 'w', encoding='utf-8') as f:
+            json.dump(parsed, f, indent=1, sort_keys=True)
+        print(f"Wrote expected output for {len(parsed)} analyses to {PARSER_EXPECTED_FILE}")
+        return 0
+
+    with open(PARSER_EXPECTED_FILE, 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+    mismatches = [name for name in corpus if parsed[name] != expected.get(name)]
+    for name in mismatches[:10]:
+        print(f"Mismatch: {name}")
+    print(f"Corpus: {len(corpus)} analyses, {len(mismatches)} differ from {os.path.basename(PARSER_EXPECTED_FILE)}")
+    round_trip_failures = check_tile_round_trip(corpus)
+    for name in round_trip_failures[:10]:
+        print(f"Tile merge changed: {name}")
+    print(f"Tile merge round trip: {len(corpus) + len(TILE_ROUND_TRIP_CASES)} cases, {len(round_trip_failures)} changed")
+
+    product_count = sum(len(flyer['products']) for flyer in parsed.values())
+    texts = list(corpus.items())
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for name, text in texts:
+            parse_flyer_data(text, name)
+    elapsed = time.perf_counter() - started
+    print(f"Parsed {product_count * args.repeat} products in {elapsed:.3f} s: "
+          f"{product_count * args.repeat / elapsed:,.0f} products/s")
+    return 1 if mismatches or round_trip_failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the flyer pipeline")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = subparsers.add_parser('pipeline', help="End-to-end upload -> analyze -> parse -> export")
+    pipeline.add_argument('--flyers', type=int, default=60)
+    pipeline.add_argument('--workers', type=int, default=8)
+    pipeline.add_argument('--batch-size', type=int, help="Pack small flyers this many per request")
+    pipeline.add_argument('--structured', action='store_true', help="Use JSON structured output")
+    pipeline.add_argument('--stream', action='store_true', help="Use streamGenerateContent")
+    pipeline.add_argument('--no-preprocess', action='store_true', help="Send full-resolution PNGs")
+    pipeline.add_argument('--no-adaptive', action='store_true', help="Disable the adaptive concurrency limiter")
+    pipeline.add_argument('--rpm', type=int, default=0, help="Requests-per-minute budget (0 for none)")
+    pipeline.add_argument('--tpm', type=int, default=0, help="Tokens-per-minute budget (0 for none)")
+    pipeline.add_argument('--base-url', help="Use an already running Gemini stand-in instead of starting one")
+    pipeline.add_argument('--api-key', default='benchmark', help="API key, or comma-separated keys for a key pool")
+    gemini_stub.add_stub_arguments(pipeline)
+    pipeline.set_defaults(func=run_pipeline_benchmark)
+
+    parser_bench = subparsers.add_parser('parser', help="parse_flyer_data throughput and output check on parser_corpus/")
+    parser_bench.add_argument('--repeat', type=int, default=20, help="Passes over the corpus")
+    parser_bench.add_argument('--corpus', default=PARSER_CORPUS_DIR)
+    parser_bench.add_argument('--update', action='store_true', help="Rewrite expected.json from the current parser")
+    parser_bench.set_defaults(func=run_parser_benchmark)
+
+    tables = subparsers.add_parser('tables', help="create_excel_data on a synthetic catalog")
+    tables.add_argument('--products', type=int, default=100000)
+    tables.add_argument('--stores', type=int, default=20)
+    tables.add_argument('--seed', type=int, default=0)
+    tables.add_argument('--compare', action='store_true', help="Also time the row-wise build and check the output")
+    tables.set_defaults(func=run_tables_benchmark)
+
+    excel = subparsers.add_parser('excel', help="create_excel_file on a synthetic catalog")
+    excel.add_argument('--products', type=int, default=200000)
+    excel.add_argument('--stores', type=int, default=20)
+    excel.add_argument('--seed', type=int, default=0)
+    excel.add_argument('--compare', action='store_true', help="Also time the previous cell-walk export")
+    excel.add_argument('--memory', action='store_true', help="Trace peak memory (makes the exports slower)")
+    excel.set_defaults(func=run_excel_benchmark)
+
+    exports = subparsers.add_parser('exports', help="Parquet/Arrow/CSV export write and read-back times")
+    exports.add_argument('--products', type=int, default=200000)
+    exports.add_argument('--stores', type=int, default=20)
+    exports.add_argument('--seed', type=int, default=0)
+    exports.add_argument('--xlsx', action='store_true', help="Also time reading the Products sheet of the xlsx report")
+    exports.set_defaults(func=run_exports_benchmark)
+
+    search = subparsers.add_parser('search', help="Product search index build time and query latency")
+    search.add_argument('--products', type=lambda value: [int(v) for v in value.split(',')],
+                        default=[10000, 100000, 1000000], help="Comma-separated catalog sizes")
+    search.add_argument('--queries', type=int, default=500)
+    search.add_argument('--scan-queries', type=int, default=5, help="Queries to time the old linear scan on")
+    search.add_argument('--seed', type=int, default=0)
+    search.set_defaults(func=run_search_benchmark)
+
+    matching = subparsers.add_parser('matching', help="group_products scaling on synthetic product names")
+    matching.add_argument('--products', type=lambda value: [int(v) for v in value.split(',')],
+                          default=[10000, 50000, 100000, 200000], help="Comma-separated catalog sizes")
+    matching.add_argument('--seed', type=int, default=0)
+    matching.set_defaults(func=run_matching_benchmark)
+
+    args = parser.parse_args(argv)
+    # Streamlit warns about every st.* call made outside "streamlit run"
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# Tables of create_excel_data, in the order they are exported
+EXPORT_TABLES = ['stores', 'products', 'comparisons']
+
+EXPORT_FORMATS = {
+    'parquet': "Parquet",
+    'feather': "Arrow IPC (Feather)",
+    'csv': "CSV (chunked)"
+}
+
+PARQUET_COMPRESSION = os.getenv('EXPORT_PARQUET_COMPRESSION', 'zstd')
+FEATHER_COMPRESSION = os.getenv('EXPORT_FEATHER_COMPRESSION', 'zstd')
+# Directory "Write to directory" in the app writes under, one folder per export name
+EXPORT_OUTPUT_DIR = os.getenv('EXPORT_OUTPUT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports'))
+# Export names are a single plain folder name, never a path
+EXPORT_NAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,63}')
+# Rows per CSV file, big tables are split into numbered parts
+CSV_CHUNK_ROWS = int(os.getenv('EXPORT_CSV_CHUNK_ROWS', '100000'))
+
+
+def arrow_table(df):
+    """DataFrame as an Arrow table; categoricals become dictionary columns"""
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_parquet(df, sink):
+    pq.write_table(arrow_table(df), sink, compression=PARQUET_COMPRESSION)
+
+
+def write_feather(df, sink):
+    # Feather v2 is the Arrow IPC file format
+    feather.write_feather(arrow_table(df), sink, compression=FEATHER_COMPRESSION)
+
+
+def csv_parts(df, chunk_rows=CSV_CHUNK_ROWS):
+    """(part number, DataFrame slice) pairs of at most chunk_rows rows, one part for an empty table"""
+    if len(df) == 0:
+        return [(1, df)]
+    return [(idx + 1, df.iloc[start:start + chunk_rows])
+            for idx, start in enumerate(range(0, len(df), chunk_rows))]
+
+
+def export_files(excel_data, formats=tuple(EXPORT_FORMATS), csv_chunk_rows=CSV_CHUNK_ROWS):
+    """(relative path, writer, compressed) for every file of an export
+
+    writer(sink) writes the file to a binary file object; compressed says
+    whether the format is already compressed (so zipping it again is
+    pointless). Tables without columns (nothing analyzed) are skipped.
+    """
+    for name in EXPORT_TABLES:
+        df = excel_data[name]
+        if not len(df.columns):
+            continue
+        if 'parquet' in formats:
+            yield f"parquet/{name}.parquet", lambda sink, df=df: write_parquet(df, sink), True
+        if 'feather' in formats:
+            yield f"feather/{name}.arrow", lambda sink, df=df: write_feather(df, sink), True
+        if 'csv' in formats:
+            for part, chunk in csv_parts(df, csv_chunk_rows):
+                yield (f"csv/{name}/part-{part:05d}.csv",
+                       lambda sink, chunk=chunk: sink.write(chunk.to_csv(index=False).encode('utf-8')), False)
+
+
+def create_export_zip(excel_data, formats=tuple(EXPORT_FORMATS), csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Zip of the stores/products/comparisons tables in the chosen formats, as bytes"""
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        for path, writer, compressed in export_files(excel_data, formats, csv_chunk_rows):
+            info = zipfile.ZipInfo(path, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w', force_zip64=True) as sink:
+                writer(sink)
+    return output.getvalue()
+
+
+def export_output_path(name, output_root=EXPORT_OUTPUT_DIR):
+    """Directory for an export name under output_root
+
+    Raises ValueError for anything but a plain folder name (absolute paths,
+    separators, "..") and for names that resolve outside output_root, e.g.
+    through a symlink.
+    """
+    if not EXPORT_NAME_PATTERN.fullmatch(name or '') or '..' in name:
+        raise ValueError(f"Export name must be a plain folder name (letters, digits, '_', '-', '.'), got {name!r}")
+    root = os.path.realpath(output_root)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.dirname(path) != root:
+        raise ValueError(f"Export name {name!r} resolves outside {output_root}")
+    return path
+
+
+def write_export_dir(excel_data, output_dir, formats=tuple(EXPORT_FORMATS), csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Write an export under output_dir, returns the paths written
+
+    Files are written to a temporary name and renamed into place, so a job
+    reading the directory never sees a half-written file. Writing again
+    replaces the previous export of the same formats.
+    """
+    paths = []
+    for relative_path, writer, _ in export_files(excel_data, formats, csv_chunk_rows):
+        path = os.path.join(output_dir, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as sink:
+                writer(sink)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        paths.append(path)
+
+    # Drop CSV parts left over from an earlier, longer export of the same table
+    written = set(paths)
+    for directory in {os.path.dirname(path) for path in paths if path.endswith('.csv')}:
+        for name in os.listdir(directory):
+            stale_path = os.path.join(directory, name)
+            if name.startswith('part-') and name.endswith('.csv') and stale_path not in written:
+                os.remove(stale_path)
+    return paths
@@ -0,0 +1 @@
+# Lets pytest import the app's top-level modules from tests/
@@ -0,0 +1,479 @@
+import io
+import json
+import logging
+import math
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import streamlit as st
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from analysis_cache import AnalysisCache, hash_bytes, prompt_fingerprint
+from flyer_parser import FLYER_DATA_FORMAT, StreamingProductParser, merge_tile_analyses
+from gemini_client import (
+    ANALYSIS_PROMPT, BATCH_RESPONSE_SCHEMA, FLYER_RESPONSE_SCHEMA, GEMINI_MODEL, STRUCTURED_PROMPT,
+    build_batch_prompt, convert_image_to_text, convert_images_to_text, is_failed_analysis, resolve_gemini_resources, stream_image_to_text
+)
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of flyers analyzed in parallel (each one is a separate Gemini request)
+DEFAULT_MAX_WORKERS = int(os.getenv('GEMINI_MAX_WORKERS', '4'))
+MAX_WORKERS_LIMIT = 16
+
+# On-disk cache of Gemini analyses, set ANALYSIS_CACHE_ENABLED=0 to bypass it by default
+ANALYSIS_CACHE_DIR = os.getenv('ANALYSIS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.analysis_cache'))
+ANALYSIS_CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', '1') != '0'
+
+# Ask Gemini for schema-conforming JSON instead of markdown by default
+STRUCTURED_OUTPUT_ENABLED = os.getenv('STRUCTURED_OUTPUT', '0') == '1'
+
+# Tiling of very large or tall flyers (e.g. multi-page flyers stitched into one image)
+TILE_SIZE = int(os.getenv('TILE_SIZE', '1536'))
+TILE_OVERLAP = int(os.getenv('TILE_OVERLAP', '192'))
+TILE_THRESHOLD = int(os.getenv('TILE_THRESHOLD', '3000'))
+TILE_MAX_WORKERS = 4
+
+# Batching of small flyers (coupons, single-product ads) into one Gemini request
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '6'))
+BATCH_MAX_IMAGE_BYTES = int(os.getenv('BATCH_MAX_IMAGE_KB', '512')) * 1024
+BATCH_MAX_DIMENSION = int(os.getenv('BATCH_MAX_DIMENSION', '1600'))
+
+# Image pre-processing applied before flyers are base64 encoded for Gemini
+IMAGE_MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+DEFAULT_PREPROCESS = {
+    'max_dimension': int(os.getenv('IMAGE_MAX_DIMENSION', '2048')),
+    'image_format': os.getenv('IMAGE_FORMAT', 'JPEG').upper(),
+    'quality': int(os.getenv('IMAGE_QUALITY', '85')),
+    'grayscale': os.getenv('IMAGE_GRAYSCALE', '0') == '1'
+}
+
+@st.cache_resource
+def get_analysis_cache():
+    """Process-wide analysis cache shared by every session and rerun"""
+    return AnalysisCache(
+        ANALYSIS_CACHE_DIR,
+        max_bytes=int(os.getenv('ANALYSIS_CACHE_MAX_MB', '200')) * 1024 * 1024,
+        max_age=int(os.getenv('ANALYSIS_CACHE_MAX_AGE_DAYS', '30')) * 24 * 3600
+    )
+
+def preprocess_image(image, max_dimension=None, image_format='PNG', quality=85, grayscale=False):
+    """Shrink an image before it is sent to Gemini
+    
+    Applies EXIF orientation, downscales so the longest side is at most
+    max_dimension, optionally converts to grayscale and encodes as PNG, JPEG
+    or WEBP. Returns (encoded bytes, mime_type).
+    """
+    image_format = image_format.upper()
+    if image_format not in IMAGE_MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    
+    # Phone photos are often stored sideways with an EXIF rotation flag
+    image = ImageOps.exif_transpose(image)
+    
+    if max_dimension and max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    
+    if grayscale:
+        image = image.convert('L')
+    elif image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        # JPEG has no alpha channel or palette mode
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    
+    img_buffer = io.BytesIO()
+    if image_format == 'PNG':
+        image.save(img_buffer, format='PNG', optimize=True)
+    else:
+        image.save(img_buffer, format=image_format, quality=int(quality))
+    
+    return img_buffer.getvalue(), IMAGE_MIME_TYPES[image_format]
+
+def tile_spans(length, tile_size, overlap):
+    """Start/end offsets of evenly spread tiles covering length with at least overlap between neighbours"""
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"Tile overlap must be at least 0 and smaller than the tile size ({overlap} >= {tile_size})"
+                         if overlap >= 0 else f"Tile overlap must be at least 0, got {overlap}")
+    if length <= tile_size:
+        return [(0, length)]
+    step = tile_size - overlap
+    count = math.ceil((length - overlap) / step)
+    return [(round(i * (length - tile_size) / (count - 1)), round(i * (length - tile_size) / (count - 1)) + tile_size)
+            for i in range(count)]
+
+def split_into_tiles(image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Split an image into overlapping tiles in reading order (row by row)"""
+    image = ImageOps.exif_transpose(image)
+    width, height = image.size
+    return [
+        image.crop((left, top, right, bottom))
+        for top, bottom in tile_spans(height, tile_size, overlap)
+        for left, right in tile_spans(width, tile_size, overlap)
+    ]
+
+def needs_tiling(image, threshold=TILE_THRESHOLD):
+    return max(image.size) > threshold
+
+def convert_tiled_image_to_text(image, api_key, preprocess=None, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, deadline=None,
+                                structured=False):
+    """Analyze a large image as overlapping tiles in parallel and merge the results
+    
+    Returns (analysis, failed_tiles). Without a deadline each tile's request
+    gets its own GEMINI_DEADLINE from when it is sent, so tiles queued behind
+    others are not starved. The tiles that succeeded are merged even if
+    some failed; failed_tiles holds the failed tiles' error messages so the
+    caller can report (and not cache) the partial result. Only when every
+    tile fails is the analysis an error.
+    """
+    tiles = split_into_tiles(image, tile_size, overlap)
+    
+    def analyze_tile(tile):
+        if preprocess is not None:
+            tile_data, mime_type = preprocess_image(tile, **preprocess)
+            return convert_image_to_text(tile_data, api_key, mime_type=mime_type, deadline=deadline,
+                                         structured=structured)
+        return convert_image_to_text(tile, api_key, deadline=deadline, structured=structured)
+    
+    with ThreadPoolExecutor(max_workers=min(TILE_MAX_WORKERS, len(tiles))) as executor:
+        tile_analyses = list(executor.map(analyze_tile, tiles))
+    
+    failed_tiles = [a for a in tile_analyses if is_failed_analysis(a)]
+    if len(failed_tiles) == len(tiles):
+        return f"Error: all {len(tiles)} tiles failed ({failed_tiles[0]})", failed_tiles
+    if failed_tiles:
+        logger.warning("%d of %d tiles failed, merging the rest: %s", len(failed_tiles), len(tiles), failed_tiles[0])
+    
+    logger.info("Merged %d tiles of %dx%d image", len(tiles) - len(failed_tiles), *image.size)
+    return merge_tile_analyses([a for a in tile_analyses if not is_failed_analysis(a)]), failed_tiles
+
+def analysis_cache_key(cache, image_bytes, preprocess=None, tiling=None, structured=False, batched=False):
+    """Cache key of an image's analysis under the prompt and settings that produced it
+    
+    batched analyses were answered to the multi-image prompt and are keyed
+    apart from single-image ones.
+    """
+    # Pre-processing and tiling change what Gemini sees, so they are part of the key
+    settings = sorted((preprocess or {}).items()) + sorted((tiling or {}).items())
+    if tiling:
+        # Merged tiles are cached in the merge's own format, older merges are not reused
+        settings.append(('merge', FLYER_DATA_FORMAT))
+    if batched:
+        # The image count varies from batch to batch, the rest of the prompt does not
+        prompt = build_batch_prompt('N', structured)
+        if structured:
+            prompt += f"\n{json.dumps(BATCH_RESPONSE_SCHEMA, sort_keys=True)}"
+    elif structured:
+        prompt = f"{STRUCTURED_PROMPT}\n{json.dumps(FLYER_RESPONSE_SCHEMA, sort_keys=True)}"
+    else:
+        prompt = ANALYSIS_PROMPT
+    prompt_hash = prompt_fingerprint(f"{prompt}\n{settings}", GEMINI_MODEL)
+    return cache.make_key(image_bytes, prompt_hash)
+
+def is_small_flyer(image_bytes):
+    """Small flyers (coupons, single-product ads) can share one batched request"""
+    if len(image_bytes) > BATCH_MAX_IMAGE_BYTES:
+        return False
+    try:
+        # Only reads the header, the pixels are not decoded
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return max(image.size) <= BATCH_MAX_DIMENSION
+    except Exception:
+        return False
+
+def convert_flyer_image(image, api_key, mime_type, file_name, product_sink=None, structured=False):
+    """convert_image_to_text, or its streaming variant feeding product_sink when one is given"""
+    if product_sink is None:
+        return convert_image_to_text(image, api_key, mime_type=mime_type, structured=structured)
+    
+    parser = StreamingProductParser(file_name)
+    
+    def on_text(text):
+        products = parser.feed(text)
+        if products:
+            product_sink(products)
+    
+    analysis_result = stream_image_to_text(image, api_key, mime_type=mime_type, on_text=on_text, structured=structured)
+    remaining_products = parser.close()
+    if remaining_products:
+        product_sink(remaining_products)
+    return analysis_result
+
+def analyze_flyer(image_bytes, file_name, api_key, cache=None, preprocess=None, tiling=None, product_sink=None,
+                  structured=False):
+    """Analyze a single flyer image and return its analysis record
+    
+    preprocess holds preprocess_image keyword arguments, None sends the image
+    as a full-resolution PNG. tiling holds tile_size/overlap/threshold, images
+    larger than the threshold are then analyzed tile by tile. With a
+    product_sink the response is streamed and product_sink(products) is called
+    as product lines arrive. structured requests JSON output instead of markdown.
+    The record's elapsed is the wall-clock seconds spent on this flyer.
+    """
+    started = time.monotonic()
+    try:
+        cache_key = None
+        if cache is not None:
+            cache_key = analysis_cache_key(cache, image_bytes, preprocess, tiling, structured)
+            cached_analysis = cache.get(cache_key)
+            if cached_analysis is not None:
+                return {
+                    'filename': file_name,
+                    'analysis': cached_analysis,
+                    'status': 'Success',
+                    'cached': True,
+                    'elapsed': time.monotonic() - started
+                }
+        
+        image = Image.open(io.BytesIO(image_bytes))
+        failed_tiles = []
+        if tiling is not None and needs_tiling(image, tiling['threshold']):
+            image_data = None
+            analysis_result, failed_tiles = convert_tiled_image_to_text(image, api_key, preprocess=preprocess,
+                                                                        tile_size=tiling['tile_size'],
+                                                                        overlap=tiling['overlap'], structured=structured)
+        elif preprocess is not None:
+            image_data, mime_type = preprocess_image(image, **preprocess)
+            logger.info("Pre-processed %s: %d -> %d bytes (%d saved, %s)",
+                        file_name, len(image_bytes), len(image_data),
+                        len(image_bytes) - len(image_data), mime_type)
+            analysis_result = convert_flyer_image(image_data, api_key, mime_type, file_name, product_sink, structured)
+        else:
+            image_data = None
+            analysis_result = convert_flyer_image(image, api_key, 'image/png', file_name, product_sink, structured)
+        
+        status = 'Error' if is_failed_analysis(analysis_result) else 'Success'
+        
+        # Only complete analyses are worth keeping, errors and missing tiles should be retried next time
+        if cache_key and status == 'Success' and not failed_tiles:
+            cache.set(cache_key, analysis_result, filename=file_name, model=GEMINI_MODEL)
+        
+        return {
+            'filename': file_name,
+            'analysis': analysis_result,
+            'status': status,
+            'cached': False,
+            'original_bytes': len(image_bytes),
+            'payload_bytes': len(image_data) if image_data is not None else None,
+            'failed_tiles': failed_tiles,
+            'elapsed': time.monotonic() - started
+        }
+    except Exception as e:
+        return {
+            'filename': file_name,
+            'analysis': f"Error processing image: {str(e)}",
+            'status': 'Error',
+            'cached': False,
+            'elapsed': time.monotonic() - started
+        }
+
+def pixel_fingerprint(image_bytes):
+    """SHA-256 of an image's decoded pixels (after EXIF rotation) and size
+    
+    Equal for files that differ only in container, metadata or lossless
+    compression, and different as soon as one pixel differs.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+    return hash_bytes(f"{image.size}".encode('utf-8') + image.tobytes())
+
+def find_duplicate_flyers(jobs, executor=None):
+    """Group flyers that are the same picture, pixel for pixel
+    
+    Returns {member index: representative index} for every flyer that can reuse
+    another one's analysis; the representative is the first uploaded copy.
+    Only identical files or identical decoded pixels count: a flyer that
+    differs in a single price is a different flyer, so anything short of
+    exact equality is analyzed on its own.
+    """
+    def fingerprint_job(job):
+        try:
+            return pixel_fingerprint(job[1])
+        except Exception:
+            # Undecodable files can still be identical copies of each other
+            return 'bytes:' + hash_bytes(job[1])
+    
+    fingerprints = list(executor.map(fingerprint_job, jobs) if executor else map(fingerprint_job, jobs))
+    
+    representatives = {}
+    duplicates = {}
+    for idx, fingerprint in enumerate(fingerprints):
+        representative = representatives.setdefault(fingerprint, idx)
+        if representative != idx:
+            duplicates[idx] = representative
+    return duplicates
+
+def analyze_flyer_batch(batch_jobs, api_key, cache=None, preprocess=None, tiling=None, structured=False):
+    """Analyze several small flyers with one Gemini request, returning one record per flyer
+    
+    Cached flyers are skipped, and any flyer missing from the batched response
+    falls back to its own request through analyze_flyer. Batched results
+    are cached under the batch prompt's key, apart from single-image ones.
+    """
+    started = time.monotonic()
+    records = [None] * len(batch_jobs)
+    pending = []
+    
+    for position, (file_name, image_bytes) in enumerate(batch_jobs):
+        cache_key = None
+        if cache is not None:
+            cache_key = analysis_cache_key(cache, image_bytes, preprocess, tiling, structured, batched=True)
+        cached_analysis = cache.get(cache_key) if cache_key else None
+        if cached_analysis is not None:
+            records[position] = {
+                'filename': file_name,
+                'analysis': cached_analysis,
+                'status': 'Success',
+                'cached': True,
+                'elapsed': time.monotonic() - started
+            }
+            continue
+        
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            image_data, mime_type = preprocess_image(image, **(preprocess or {}))
+        except Exception as e:
+            records[position] = {
+                'filename': file_name,
+                'analysis': f"Error processing image: {str(e)}",
+                'status': 'Error',
+                'cached': False,
+                'elapsed': time.monotonic() - started
+            }
+            continue
+        pending.append((position, cache_key, image_data, mime_type))
+    
+    if len(pending) > 1:
+        analyses = convert_images_to_text([(data, mime) for _, _, data, mime in pending], api_key, structured=structured)
+        logger.info("Batched %d flyers into one request", len(pending))
+    else:
+        analyses = [None] * len(pending)
+    
+    for (position, cache_key, image_data, mime_type), analysis_result in zip(pending, analyses):
+        file_name, image_bytes = batch_jobs[position]
+        if analysis_result is None:
+            # Missing from the batched response (or a batch of one), analyze it on its own
+            records[position] = analyze_flyer(image_bytes, file_name, api_key, cache, preprocess, tiling,
+                                              structured=structured)
+            continue
+        
+        status = 'Error' if is_failed_analysis(analysis_result) else 'Success'
+        if cache_key and status == 'Success':
+            cache.set(cache_key, analysis_result, filename=file_name, model=GEMINI_MODEL)
+        
+        records[position] = {
+            'filename': file_name,
+            'analysis': analysis_result,
+            'status': status,
+            'cached': False,
+            'batched': True,
+            'original_bytes': len(image_bytes),
+            'payload_bytes': len(image_data),
+            'elapsed': time.monotonic() - started
+        }
+    
+    return records
+
+def analyze_flyers(flyer_files, api_key, max_workers=DEFAULT_MAX_WORKERS, on_result=None, cache=None, preprocess=None,
+                   tiling=None, batch_size=None, on_products=None, structured=False, skip_duplicates=False):
+    """Analyze flyers with a bounded worker pool, keeping results in upload order
+    
+    on_result(completed_count, analysis) is called from the calling thread as each
+    flyer finishes, so it is safe to update Streamlit elements from it. With
+    batch_size above 1, small flyers are packed that many per Gemini request.
+    With on_products, single-flyer requests are streamed and
+    on_products(file_name, products) is called, also from the calling thread,
+    as product lines arrive. structured switches Gemini to JSON output. With
+    skip_duplicates, flyers with identical pixels are analyzed once and the
+    copies' records point at the analyzed one through 'duplicate_of'.
+    """
+    # Worker threads have no Streamlit run context, so the cached session, key pool and
+    # telemetry are looked up here and handed to them
+    api_key = resolve_gemini_resources(api_key)
+    
+    # Read the image bytes up front so worker threads never touch the upload objects
+    jobs = []
+    for idx, flyer_file in enumerate(flyer_files):
+        file_name = getattr(flyer_file, 'name', f'Image_{idx+1}')
+        flyer_file.seek(0)
+        jobs.append((file_name, flyer_file.read()))
+        flyer_file.seek(0)
+    
+    results = [None] * len(jobs)
+    max_workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT, len(jobs) or 1))
+    
+    # Only one copy of each duplicate flyer is sent to Gemini
+    duplicates = {}
+    if skip_duplicates and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as hash_executor:
+            duplicates = find_duplicate_flyers(jobs, hash_executor)
+        if duplicates:
+            logger.info("Skipping %d duplicate flyer(s)", len(duplicates))
+    duplicate_members = {}
+    for member, representative in duplicates.items():
+        duplicate_members.setdefault(representative, []).append(member)
+    
+    # Group small flyers into batches, everything else gets its own request
+    single_indexes = [idx for idx in range(len(jobs)) if idx not in duplicates]
+    batches = []
+    if batch_size and batch_size > 1:
+        small_indexes = [idx for idx in single_indexes if is_small_flyer(jobs[idx][1])]
+        batches = [small_indexes[i:i+batch_size] for i in range(0, len(small_indexes), batch_size)]
+        batched = set(small_indexes)
+        single_indexes = [idx for idx in single_indexes if idx not in batched]
+    
+    # Worker threads hand streamed products over to the calling thread through a queue
+    product_events = queue.Queue() if on_products else None
+    
+    def drain_product_events():
+        while product_events is not None and not product_events.empty():
+            file_name, products = product_events.get_nowait()
+            on_products(file_name, products)
+    
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for idx in single_indexes:
+            file_name, image_bytes = jobs[idx]
+            product_sink = None
+            if product_events is not None:
+                product_sink = lambda products, file_name=file_name: product_events.put((file_name, products))
+            future = executor.submit(analyze_flyer, image_bytes, file_name, api_key, cache, preprocess, tiling,
+                                     product_sink, structured)
+            futures[future] = [idx]
+        for batch_indexes in batches:
+            future = executor.submit(analyze_flyer_batch, [jobs[idx] for idx in batch_indexes],
+                                     api_key, cache, preprocess, tiling, structured)
+            futures[future] = batch_indexes
+        
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            # Products streamed before a flyer finished are always delivered before its result
+            drain_product_events()
+            
+            for future in done:
+                indexes = futures[future]
+                records = future.result()
+                if isinstance(records, dict):
+                    records = [records]
+                for idx, record in zip(indexes, records):
+                    # Duplicates reuse the representative's analysis under their own file name
+                    member_records = [
+                        dict(record, filename=jobs[member][0], duplicate_of=record['filename'])
+                        for member in duplicate_members.get(idx, [])
+                    ]
+                    for result_idx, result_record in [(idx, record)] + list(zip(duplicate_members.get(idx, []), member_records)):
+                        results[result_idx] = result_record
+                        completed += 1
+                        if on_result:
+                            on_result(completed, result_record)
+    
+    return results
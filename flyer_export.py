@@ -0,0 +1,154 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from export_cache import ExportCache
+from product_matching import group_products
+from quantity import parse_quantities, unit_prices
+from xlsx_writer import write_xlsx
+
+# Bounds of the in-memory cache of export tables and workbooks
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv('EXPORT_CACHE_MAX_ENTRIES', '8'))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv('EXPORT_CACHE_MAX_MB', '256')) * 1024 * 1024
+
+@st.cache_resource
+def get_export_cache():
+    """Process-wide cache of export tables and xlsx bytes, keyed by flyer data fingerprint"""
+    return ExportCache(max_entries=EXPORT_CACHE_MAX_ENTRIES, max_bytes=EXPORT_CACHE_MAX_BYTES)
+
+def add_unit_price_columns(df, price_column, size_column='Size_Weight'):
+    """Add Quantity, Base_Unit, Unit_Price and Unit_Price_Basis columns, computed column-wise"""
+    if df.empty:
+        return df
+    quantities = parse_quantities(df[size_column])
+    df['Quantity'] = quantities['Quantity'].round(2)
+    df['Base_Unit'] = quantities['Base_Unit']
+    df['Unit_Price'], df['Unit_Price_Basis'] = unit_prices(df[price_column], quantities['Quantity'], quantities['Base_Unit'])
+    return df
+
+# First number in a price such as "$5.99" or "2 for 5"
+PRICE_NUMBER = r'(\d+\.?\d*)'
+
+def price_numbers(prices):
+    """Numeric value of each price text, 0 when there is none ("Price not found", blank)
+
+    Prices repeat a lot across a catalog, so each distinct text is parsed once.
+    """
+    codes, uniques = pd.factorize(pd.Series(prices, dtype=object), use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    numbers = uniques.astype(str).str.extract(PRICE_NUMBER, expand=False).astype(float)
+    valid = uniques.map(bool) & (uniques != 'Price not found')
+    numbers = numbers.where(valid, 0.0).fillna(0.0).to_numpy()
+    return np.where(codes >= 0, numbers[codes] if len(numbers) else 0.0, 0.0)
+
+def comparison_rows(products, group_ids, group_labels):
+    """Price_Comparisons rows: priced products of groups sold by more than one store
+
+    Rows come group by group in order of first appearance, products in their
+    original order within a group.
+    """
+    group_ids = np.asarray(group_ids)
+    store_codes = products['Store_Name'].cat.codes.to_numpy()
+    pairs = pd.DataFrame({'group': group_ids, 'store': store_codes}).drop_duplicates()
+    stores_selling = np.bincount(pairs['group'].to_numpy(), minlength=len(group_labels))[group_ids]
+    labelled = np.array([bool(label) for label in group_labels], dtype=bool)[group_ids]
+
+    keep = (stores_selling > 1) & labelled & (products['Price_Numeric'].to_numpy() > 0)
+    order = np.flatnonzero(keep)
+    order = order[np.argsort(group_ids[order], kind='stable')]
+    if not len(order):
+        return pd.DataFrame()
+
+    return pd.DataFrame({
+        'Product_Group': pd.Series(group_labels, dtype=object).to_numpy()[group_ids[order]],
+        'Product_Name': products['Product_Name'].to_numpy()[order],
+        'Store_Name': products['Store_Name'].take(order).reset_index(drop=True),
+        'Price': products['Price_Numeric'].to_numpy()[order],
+        'Size_Weight': products['Size_Weight'].to_numpy()[order],
+        'Stores_Selling': stores_selling[order]
+    })
+
+def create_excel_data(all_flyer_data):
+    """Create structured Excel data from analyzed flyers
+
+    The tables are built column by column: one pass collects each field into
+    a list, then prices, groups and comparisons are computed on whole
+    columns. Store_Name and Flyer_Source are categoricals, since a session
+    has a handful of stores and flyers repeated across many products.
+    """
+    if not all_flyer_data:
+        return {'stores': pd.DataFrame(), 'products': pd.DataFrame(), 'comparisons': pd.DataFrame()}
+
+    flyer_stores = pd.Categorical([flyer['store_name'] if flyer['store_name'] else 'Unknown Store'
+                                   for flyer in all_flyer_data])
+    flyer_sources = pd.Categorical([flyer['filename'] for flyer in all_flyer_data])
+    product_counts = np.array([len(flyer['products']) for flyer in all_flyer_data], dtype=np.int64)
+
+    # Create stores summary
+    stores = pd.DataFrame({
+        'Store_Name': flyer_stores,
+        'Slogan': [flyer['slogan'] for flyer in all_flyer_data],
+        'Address': [flyer['address'] for flyer in all_flyer_data],
+        'Website': [flyer['website'] for flyer in all_flyer_data],
+        'Phone': [flyer['phone'] for flyer in all_flyer_data],
+        'Flyer_Source': flyer_sources,
+        'Products_Count': product_counts
+    })
+
+    # Create products data, flyer-level columns repeated per product
+    all_products = [product for flyer in all_flyer_data for product in flyer['products']]
+    if not all_products:
+        return {'stores': stores, 'products': pd.DataFrame(), 'comparisons': pd.DataFrame()}
+
+    price_texts = [product['price'] for product in all_products]
+    products = pd.DataFrame({
+        'Product_ID': np.arange(1, len(all_products) + 1, dtype=np.int64),
+        'Product_Name': [product['product_name'] for product in all_products],
+        'Store_Name': pd.Categorical.from_codes(np.repeat(flyer_stores.codes, product_counts),
+                                                 flyer_stores.categories),
+        'Price_Text': price_texts,
+        'Price_Numeric': price_numbers(price_texts),
+        'Size_Weight': [product['size_weight'] for product in all_products],
+        'Description': [product['description'] for product in all_products],
+        'Flyer_Source': pd.Categorical.from_codes(np.repeat(flyer_sources.codes, product_counts),
+                                                   flyer_sources.categories)
+    })
+
+    # Group the same product across flyers (see product_matching.py)
+    group_ids, group_labels = group_products(products['Product_Name'].tolist())
+    comparisons = comparison_rows(products, group_ids, group_labels)
+
+    return {
+        'stores': stores,
+        'products': add_unit_price_columns(products, 'Price_Numeric'),
+        'comparisons': add_unit_price_columns(comparisons, 'Price')
+    }
+
+# Sheets of the Excel report, in order, with the excel_data table each one holds
+EXCEL_SHEETS = [('Stores', 'stores'), ('Products', 'products'), ('Price_Comparisons', 'comparisons')]
+MAX_COLUMN_WIDTH = 50
+
+def column_widths(df):
+    """Excel column width per column: longest header or value text plus padding, capped at MAX_COLUMN_WIDTH"""
+    widths = []
+    for column in df.columns:
+        values = df[column]
+        lengths = values.astype(str).str.len().where(values.notna(), 0)
+        widths.append(min(max(len(str(column)), int(lengths.max()) if len(lengths) else 0) + 2, MAX_COLUMN_WIDTH))
+    return widths
+
+def create_excel_file(excel_data):
+    """Create downloadable Excel file with multiple sheets
+
+    The sheets are streamed out by xlsx_writer a chunk of rows at a time,
+    with column widths computed from the DataFrames.
+    """
+    # Create Excel file in memory
+    output = io.BytesIO()
+    write_xlsx(output, [(sheet_name, excel_data[table], column_widths(excel_data[table]))
+                        for sheet_name, table in EXCEL_SHEETS])
+    output.seek(0)
+    return output
@@ -0,0 +1,368 @@
+import json
+import re
+
+import streamlit as st
+
+from price_extractor import extract_price_size
+
+# Patterns of the markdown analysis format (see ANALYSIS_PROMPT), compiled once
+STORE_NAME_PATTERN = re.compile(r'\*\*Store Name:\*\*\s*(.+?)(?:\n|\*\*)', re.IGNORECASE)
+SLOGAN_PATTERN = re.compile(r'\*\*Slogan/Motto:\*\*\s*(.+?)(?:\n|\*\*)', re.IGNORECASE)
+ADDRESS_PATTERN = re.compile(r'\*\*Address:\*\*\s*(.+?)(?:\n|\*\*)', re.IGNORECASE)
+WEBSITE_PATTERN = re.compile(r'\*\*Website:\*\*\s*(.+?)(?:\n|\*\*)', re.IGNORECASE)
+PHONE_PATTERN = re.compile(r'\*\*Phone Number:\*\*\s*(.+?)(?:\n|\*\*)', re.IGNORECASE)
+PRODUCTS_SECTION_PATTERN = re.compile(
+    r'\*\*Featured Products & Prices:\*\*(.*?)(?:\*\*Contact Information|\*\*Overall Impression|\*\*Address|\*\*Website|\*\*Phone|\Z)',
+    re.DOTALL | re.IGNORECASE
+)
+
+# Product line layouts, tried in order until one finds products
+PRODUCT_LINE_PATTERNS = [
+    re.compile(r'\*\s*\*\*(.+?):\*\*\s*(.+?)(?:\n|\Z)', re.MULTILINE | re.IGNORECASE),  # * **Product Name:** details
+    re.compile(r'\*\s*(.+?):\s*(.+?)(?:\n|\Z)', re.MULTILINE | re.IGNORECASE),          # * Product Name: details
+    re.compile(r'^\s*\*\s*(.+?)\s*[-–]\s*(.+?)(?:\n|\Z)', re.MULTILINE | re.IGNORECASE), # * Product - details
+    re.compile(r'^\s*\*\s*(.+?)\s*:\s*(.+?)(?:\n|\Z)', re.MULTILINE | re.IGNORECASE),   # * Product: details
+]
+
+# "format" of the JSON document merge_tile_analyses writes: flyer_data itself, read back field for field
+FLYER_DATA_FORMAT = 'flyer_data'
+FLYER_FIELDS = ['store_name', 'slogan', 'address', 'website', 'phone']
+PRODUCT_FIELDS = ['product_name', 'size_weight', 'price', 'description']
+
+# Fallback for analyses without a products section
+PRODUCT_LIKE_LINE = re.compile(r'[a-zA-Z]+.*\$?\d+\.?\d*')
+NAME_END = re.compile(r'[\$\d]')
+LINE_PRICE = re.compile(r'\$?(\d+\.?\d*)')
+
+def decode_structured_analysis(analysis_text):
+    """Return the JSON object of a structured-output analysis, or None for markdown analyses"""
+    text = analysis_text.strip()
+    # Tolerate a ```json fenced block around the document
+    if text.startswith('```'):
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+    if not text.startswith('{'):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def format_structured_price(price):
+    """Price text for a JSON price value, matching the "$4.99" style of markdown analyses"""
+    if price is None or price == '':
+        return ''
+    try:
+        return f"${float(str(price).replace('$', '').replace(',', '').strip()):.2f}"
+    except ValueError:
+        return ''
+
+def flyer_data_from_json(data, filename):
+    """Build the flyer_data structure straight from a structured-output analysis"""
+    if data.get('format') == FLYER_DATA_FORMAT:
+        return flyer_data_from_document(data, filename)
+    flyer_data = {
+        'filename': filename,
+        'store_name': '',
+        'slogan': '',
+        'address': '',
+        'website': '',
+        'phone': '',
+        'products': []
+    }
+    for field in ['store_name', 'slogan', 'address', 'website', 'phone']:
+        flyer_data[field] = str(data.get(field) or '').strip()
+    
+    for product in data.get('products') or []:
+        if not isinstance(product, dict):
+            continue
+        product_name = str(product.get('name') or '').strip()
+        if len(product_name) < 2:
+            continue
+        
+        size = str(product.get('size') or '').strip()
+        unit = str(product.get('unit') or '').strip()
+        price = format_structured_price(product.get('price'))
+        
+        flyer_data['products'].append({
+            'product_name': product_name,
+            'size_weight': f"{size} {unit}".strip() if size else unit,
+            'price': price if price else 'Price not found',
+            'description': str(product.get('description') or '').strip()
+        })
+    
+    return flyer_data
+
+def flyer_data_to_document(flyer_data):
+    """flyer_data as an analysis text (JSON) that parse_flyer_data reads back unchanged"""
+    document = {'format': FLYER_DATA_FORMAT}
+    document.update({field: flyer_data[field] for field in FLYER_FIELDS})
+    document['products'] = [{field: product[field] for field in PRODUCT_FIELDS} for product in flyer_data['products']]
+    return json.dumps(document, ensure_ascii=False)
+
+def flyer_data_from_document(data, filename):
+    flyer_data = {'filename': filename}
+    flyer_data.update({field: str(data.get(field) or '') for field in FLYER_FIELDS})
+    flyer_data['products'] = [
+        {field: str(product.get(field) or '') for field in PRODUCT_FIELDS}
+        for product in data.get('products') or [] if isinstance(product, dict)
+    ]
+    return flyer_data
+
+def parse_flyer_data(analysis_text, filename):
+    """Extract structured data from flyer analysis
+    
+    Structured-output (JSON) analyses are decoded directly, markdown analyses
+    (including older cached ones) go through the regex parser below.
+    """
+    
+    structured_data = decode_structured_analysis(analysis_text)
+    if structured_data is not None:
+        return flyer_data_from_json(structured_data, filename)
+    
+    # Initialize data structure
+    flyer_data = {
+        'filename': filename,
+        'store_name': '',
+        'slogan': '',
+        'address': '',
+        'website': '',
+        'phone': '',
+        'products': []
+    }
+    
+    try:
+        # Extract store name
+        store_match = STORE_NAME_PATTERN.search(analysis_text)
+        if store_match:
+            flyer_data['store_name'] = store_match.group(1).strip()
+        
+        # Extract slogan/motto
+        slogan_match = SLOGAN_PATTERN.search(analysis_text)
+        if slogan_match:
+            flyer_data['slogan'] = slogan_match.group(1).strip()
+        
+        # Extract contact info
+        address_match = ADDRESS_PATTERN.search(analysis_text)
+        if address_match:
+            flyer_data['address'] = address_match.group(1).strip()
+            
+        website_match = WEBSITE_PATTERN.search(analysis_text)
+        if website_match:
+            flyer_data['website'] = website_match.group(1).strip()
+            
+        phone_match = PHONE_PATTERN.search(analysis_text)
+        if phone_match:
+            flyer_data['phone'] = phone_match.group(1).strip()
+        
+        # Extract products - look for the products section with more flexible patterns
+        products_section = PRODUCTS_SECTION_PATTERN.search(analysis_text)
+        
+        if products_section:
+            products_text = products_section.group(1)
+            
+            # Find all product lines that start with * **Product Name:** or similar patterns
+            for pattern in PRODUCT_LINE_PATTERNS:
+                product_lines = pattern.findall(products_text)
+                if product_lines:
+                    break
+            
+            for product_line in product_lines:
+                product_name = product_line[0].strip()
+                product_details = product_line[1].strip()
+                
+                # Skip empty or invalid entries
+                if not product_name or not product_details or len(product_name) < 2:
+                    continue
+                
+                price, size, description = extract_price_size(product_name, product_details)
+                
+                flyer_data['products'].append({
+                    'product_name': product_name,
+                    'size_weight': size,
+                    'price': price if price else 'Price not found',
+                    'description': description
+                })
+        
+        # If no products found in structured format, try to extract from raw text
+        if not flyer_data['products']:
+            # Look for any product-like patterns in the entire text
+            lines = analysis_text.split('\n')
+            for line in lines:
+                # Skip header lines
+                if any(header in line.lower() for header in ['store name', 'slogan', 'contact', 'address', 'website', 'phone', 'overall impression']):
+                    continue
+                
+                # Look for lines that might contain products
+                if PRODUCT_LIKE_LINE.search(line):
+                    # Extract product name (first part before price)
+                    parts = NAME_END.split(line, 1)
+                    if parts:
+                        product_name = parts[0].strip(' -*')
+                        if len(product_name) > 2:  # Only if reasonable product name
+                            # Try to find price in the line
+                            price_match = LINE_PRICE.search(line)
+                            price = f"${price_match.group(1)}" if price_match else 'Price not found'
+                            
+                            flyer_data['products'].append({
+                                'product_name': product_name,
+                                'size_weight': '',
+                                'price': price,
+                                'description': line.strip()
+                            })
+        
+    except Exception as e:
+        st.warning(f"Error parsing data from {filename}: {str(e)}")
+    
+    return flyer_data
+
+class StreamingProductParser:
+    """Pick products out of a streamed analysis as soon as each one is complete
+    
+    Markdown analyses yield a product per completed bullet line, structured
+    (JSON) analyses one per completed object of the products array. Either
+    way the product is parsed with parse_flyer_data, so streamed products
+    match the ones produced from the full analysis afterwards.
+    """
+    
+    def __init__(self, filename=''):
+        self.filename = filename
+        self.buffer = ''
+        self.in_products = False
+        # None until the first non-blank text shows whether the analysis is JSON
+        self.structured = None
+        # JSON scanning state: open brackets, string/escape flags, the last
+        # top-level string (a key), the array being read and the product text so far
+        self.containers = []
+        self.in_string = False
+        self.escaped = False
+        self.string_chars = []
+        self.last_key = None
+        self.array_key = None
+        self.product_chars = None
+    
+    def feed(self, text):
+        """Add a chunk of streamed text, returns the products completed by it"""
+        self.buffer += text
+        if self.structured is None:
+            opening = self.buffer.lstrip()
+            if '```'.startswith(opening):
+                # Blank so far, or possibly the start of a fence
+                return []
+            if opening.startswith('```'):
+                # A ```json fence, the document starts on the next line
+                if '\n' not in opening:
+                    return []
+                opening = opening.split('\n', 1)[1].lstrip()
+                if not opening:
+                    return []
+            self.structured = opening.startswith('{')
+            if self.structured:
+                self.buffer = opening
+        
+        if self.structured:
+            text, self.buffer = self.buffer, ''
+            return self._scan_json(text)
+        
+        *lines, self.buffer = self.buffer.split('\n')
+        products = []
+        for line in lines:
+            products.extend(self._parse_line(line))
+        return products
+    
+    def close(self):
+        """Parse whatever is left once the stream has ended"""
+        line, self.buffer = self.buffer, ''
+        if self.structured:
+            return self._scan_json(line)
+        return self._parse_line(line)
+    
+    def _parse_line(self, line):
+        if re.search(r'\*\*Featured Products & Prices:\*\*', line, re.IGNORECASE):
+            self.in_products = True
+            return []
+        if re.search(r'\*\*(?:Contact Information|Overall Impression|Address|Website|Phone)', line, re.IGNORECASE):
+            self.in_products = False
+            return []
+        if not self.in_products or not line.strip().startswith('*'):
+            return []
+        return parse_flyer_data(f"**Featured Products & Prices:**\n{line}\n", self.filename)['products']
+    
+    def _scan_json(self, text):
+        products = []
+        for char in text:
+            if self.product_chars is not None:
+                self.product_chars.append(char)
+            
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.containers == ['{']:
+                        self.last_key = ''.join(self.string_chars)
+                if self.containers == ['{']:
+                    self.string_chars.append(char)
+            elif char == '"':
+                self.in_string = True
+                self.string_chars = []
+            elif char in '{[':
+                if char == '[' and self.containers == ['{']:
+                    self.array_key = self.last_key
+                if char == '{' and self.containers == ['{', '['] and self.array_key == 'products':
+                    self.product_chars = [char]
+                self.containers.append(char)
+            elif char in '}]' and self.containers:
+                self.containers.pop()
+                if self.product_chars is not None and self.containers == ['{', '[']:
+                    products.extend(self._parse_product(''.join(self.product_chars)))
+                    self.product_chars = None
+        return products
+    
+    def _parse_product(self, product_text):
+        try:
+            product = json.loads(product_text)
+        except ValueError:
+            return []
+        return flyer_data_from_json({'products': [product]}, self.filename)['products']
+
+def product_key(product):
+    """Normalized name and price, used to spot the same product seen twice"""
+    name = re.sub(r'[^a-z0-9]+', ' ', product['product_name'].lower()).strip()
+    return name, product['price']
+
+def merge_tile_analyses(tile_analyses, filename=''):
+    """Merge the analyses of a flyer's tiles into one, dropping products repeated in tile overlaps
+
+    Each tile is parsed once, markdown or JSON, and the products are merged
+    as dicts; the result is written as a flyer_data document, so nothing goes
+    through markdown again. A product only counts as repeated when an earlier
+    tile had it, products listed twice on one tile are both kept.
+    """
+    merged = parse_flyer_data('', filename)
+    seen_products = {}
+    
+    for tile_idx, analysis in enumerate(tile_analyses):
+        tile_data = parse_flyer_data(analysis, filename)
+        
+        # Store details usually only appear on one tile, keep the first one found
+        for field in FLYER_FIELDS:
+            if not merged[field] and tile_data[field]:
+                merged[field] = tile_data[field]
+        
+        for product in tile_data['products']:
+            key = product_key(product)
+            if key in seen_products and seen_products[key][0] != tile_idx:
+                # Keep whichever copy captured more detail
+                existing = seen_products[key][1]
+                if not existing['size_weight'] and product['size_weight']:
+                    existing['size_weight'] = product['size_weight']
+                if len(product['description']) > len(existing['description']):
+                    existing['description'] = product['description']
+                continue
+            merged['products'].append(dict(product))
+            seen_products.setdefault(key, (tile_idx, merged['products'][-1]))
+    
+    return flyer_data_to_document(merged)
@@ -0,0 +1,579 @@
+import base64
+import io
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import namedtuple
+from email.utils import parsedate_to_datetime
+
+import requests
+import streamlit as st
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from api_keys import ApiKeyPool, parse_api_keys
+from rate_limiter import AdaptiveLimiter
+from telemetry import CallTelemetry
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Gemini REST endpoint, point it at a local stand-in (see gemini_stub.py) for offline runs
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com/v1beta').rstrip('/')
+
+# Gemini HTTP behaviour: time budget per request once it holds an API key slot, longest wait for
+# a slot, retry attempts and backoff
+GEMINI_DEADLINE = float(os.getenv('GEMINI_DEADLINE', '120'))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv('GEMINI_QUEUE_TIMEOUT', '600'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '5'))
+GEMINI_BACKOFF_BASE = 1.0
+GEMINI_BACKOFF_CAP = 30.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Keep-alive connections kept open to the Gemini host
+GEMINI_POOL_MAXSIZE = 32
+
+# Adaptive concurrency per API key (see rate_limiter.py), with optional requests-per-minute
+# and tokens-per-minute budgets per key (0 means no budget)
+GEMINI_ADAPTIVE_CONCURRENCY = os.getenv('GEMINI_ADAPTIVE_CONCURRENCY', '1') != '0'
+GEMINI_INITIAL_CONCURRENCY = int(os.getenv('GEMINI_INITIAL_CONCURRENCY', '4'))
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '16'))
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '0'))
+GEMINI_TPM = int(os.getenv('GEMINI_TPM', '0'))
+
+# Seconds a key is left alone after a 429 without a Retry-After header
+GEMINI_KEY_COOLDOWN = float(os.getenv('GEMINI_KEY_COOLDOWN', '30'))
+
+# Optional JSON lines file that every Gemini call record is appended to
+GEMINI_TELEMETRY_LOG = os.getenv('GEMINI_TELEMETRY_LOG')
+
+# Gemini model and prompt used for flyer analysis (both feed the analysis cache key)
+GEMINI_MODEL = "gemini-1.5-flash"
+
+ANALYSIS_PROMPT = """Analyze this image and provide a detailed structured analysis. Format your response like this:
+
+**Store Name:** [Store/Business name]
+
+**Slogan/Motto:** [Any taglines or slogans]
+
+**Featured Products & Prices:**
+* **Product Name:** Size/Weight for $Price (Description/Features)
+* **Product Name:** Size/Weight for $Price (Description/Features)
+[Continue for all products]
+
+**Contact Information:**
+* **Address:** [Full address if visible]
+* **Website:** [Website URL if visible]  
+* **Phone Number:** [Phone number if visible]
+
+**Overall Impression:**
+[Describe the design, colors, main message, and overall marketing approach]
+
+Please analyze this image thoroughly and provide all visible information in this structured format."""
+
+# Structured output mode: Gemini answers with JSON matching FLYER_RESPONSE_SCHEMA
+STRUCTURED_PROMPT = """Analyze this retail flyer image and extract every visible product with its price.
+Return the store name, slogan, address, website and phone number (empty strings when not visible) and one
+entry in products for each product: name, price as a number without currency symbol, size as the numeric
+quantity (for multipacks like "12 x 12"), unit of the size (e.g. oz, lb, g, ml, pack) and a short description."""
+
+FLYER_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "store_name": {"type": "STRING"},
+        "slogan": {"type": "STRING"},
+        "address": {"type": "STRING"},
+        "website": {"type": "STRING"},
+        "phone": {"type": "STRING"},
+        "products": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "price": {"type": "NUMBER", "nullable": True},
+                    "size": {"type": "STRING"},
+                    "unit": {"type": "STRING"},
+                    "description": {"type": "STRING"}
+                },
+                "required": ["name", "price"]
+            }
+        }
+    },
+    "required": ["store_name", "products"]
+}
+
+# Batched structured requests return one flyer object per image, tagged with the image number
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": dict(FLYER_RESPONSE_SCHEMA["properties"], image={"type": "INTEGER"}),
+        "required": ["image"] + FLYER_RESPONSE_SCHEMA["required"]
+    }
+}
+
+def gemini_url(method):
+    """URL of a Gemini model method (generateContent, streamGenerateContent?alt=sse, ...)
+    
+    The API key is not part of the URL, post_with_retries sends it in the
+    x-goog-api-key header of each attempt.
+    """
+    return f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:{method}"
+
+@st.cache_resource
+def get_gemini_session():
+    """Process-wide pooled HTTP session, so flyers reuse keep-alive TLS connections
+    
+    Cached as a Streamlit resource, it is shared across reruns and user sessions.
+    Retries are handled by post_with_retries rather than the adapter.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GEMINI_POOL_MAXSIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+def make_request_limiter():
+    """Adaptive limiter for one API key, or None if disabled"""
+    if not GEMINI_ADAPTIVE_CONCURRENCY:
+        return None
+    return AdaptiveLimiter(
+        initial=GEMINI_INITIAL_CONCURRENCY,
+        max_limit=GEMINI_MAX_CONCURRENCY,
+        rpm=GEMINI_RPM,
+        tpm=GEMINI_TPM
+    )
+
+@st.cache_resource
+def get_api_key_pool(keys):
+    """Process-wide pool for a tuple of API keys, so every session shares its accounting"""
+    return ApiKeyPool(list(keys), cooldown=GEMINI_KEY_COOLDOWN, limiter_factory=make_request_limiter)
+
+def resolve_api_key_pool(api_key):
+    """ApiKeyPool for an api_key argument: a pool, one key or comma-separated keys"""
+    if isinstance(api_key, ApiKeyPool):
+        return api_key
+    return get_api_key_pool(tuple(parse_api_keys(api_key)))
+
+@st.cache_resource
+def get_call_telemetry():
+    """Process-wide store of per-call Gemini telemetry (see telemetry.py)"""
+    return CallTelemetry(log_path=GEMINI_TELEMETRY_LOG)
+
+# Process-wide objects a Gemini call needs, resolved together on the script thread
+GeminiResources = namedtuple('GeminiResources', ['session', 'key_pool', 'telemetry'])
+
+def resolve_gemini_resources(api_key):
+    """GeminiResources for an api_key argument: resources, a pool, one key or comma-separated keys
+    
+    The getters are Streamlit resources, which need the script thread's run
+    context. Call this on the script thread and hand the result to worker
+    threads as their api_key, so they never call the getters themselves.
+    """
+    if isinstance(api_key, GeminiResources):
+        return api_key
+    return GeminiResources(get_gemini_session(), resolve_api_key_pool(api_key) if api_key else None,
+                           get_call_telemetry())
+
+def usage_tokens(result):
+    """Prompt and candidate token counts from a response's usageMetadata"""
+    usage = result.get('usageMetadata') or {}
+    return {
+        'prompt_tokens': usage.get('promptTokenCount'),
+        'candidate_tokens': usage.get('candidatesTokenCount')
+    }
+
+def record_call(call, started, api_key=None):
+    """Finish a call record started at time.perf_counter() value started and store it"""
+    call.setdefault('outcome', 'ok')
+    call['latency_seconds'] = time.perf_counter() - started
+    
+    # Tokens count against the quota of the key that served the last attempt
+    call.pop('deadline', None)
+    key_pool, leased_key = call.pop('key_lease', (None, None))
+    if leased_key:
+        call['api_key'] = leased_key.label
+        key_pool.add_tokens(leased_key, (call.get('prompt_tokens') or 0) + (call.get('candidate_tokens') or 0))
+    telemetry = api_key.telemetry if isinstance(api_key, GeminiResources) else get_call_telemetry()
+    telemetry.record(**call)
+
+def parse_retry_after(response):
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date), or None"""
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+    return random.uniform(0, min(GEMINI_BACKOFF_CAP, GEMINI_BACKOFF_BASE * (2 ** attempt)))
+
+def post_with_retries(url, payload, deadline=None, max_retries=GEMINI_MAX_RETRIES, session=None, stream=False,
+                      stats=None, api_key=None):
+    """POST a JSON payload, retrying connection errors, timeouts, 429 and 5xx responses
+    
+    deadline is an absolute time.monotonic() value covering every attempt and
+    backoff sleep, including waits for a key. By default the deadline is
+    GEMINI_DEADLINE from when the first attempt gets a key slot, so requests
+    queued behind a throttled pool don't use up their budget before they are
+    sent; the wait for that first slot is capped at GEMINI_QUEUE_TIMEOUT.
+    stats['deadline'] holds the deadline in force. Raises
+    requests.exceptions.Timeout once it has passed, and
+    otherwise returns the last response, which may still be an error status.
+    With stream=True the body is left unread for the caller to iterate.
+    If a stats dict is given it is updated with request_bytes, retries, status
+    and ttfb_seconds (time to response headers) of the last attempt.
+    With an api_key (a key, comma-separated keys, an ApiKeyPool or GeminiResources) every
+    attempt waits for the least-loaded healthy key with a free slot, sends it
+    in the x-goog-api-key header and reports the outcome back to the pool.
+    After a 429 the next attempt goes straight to another key if one is free.
+    """
+    if isinstance(api_key, GeminiResources):
+        session = session or api_key.session
+        key_pool = api_key.key_pool
+    else:
+        session = session or get_gemini_session()
+        key_pool = resolve_api_key_pool(api_key) if api_key else None
+    if stats is None:
+        stats = {}
+    queue_deadline = deadline if deadline is not None else time.monotonic() + GEMINI_QUEUE_TIMEOUT
+    
+    # Serialize once, retries resend the same bytes
+    body = json.dumps(payload).encode('utf-8')
+    stats['request_bytes'] = len(body)
+    
+    attempt = 0
+    while True:
+        if deadline is not None and deadline - time.monotonic() <= 0:
+            raise requests.exceptions.Timeout("Deadline exceeded")
+        
+        stats['retries'] = attempt
+        headers = {"Content-Type": "application/json"}
+        lease = None
+        if key_pool:
+            try:
+                lease = key_pool.acquire(deadline if deadline is not None else queue_deadline)
+            except TimeoutError:
+                raise requests.exceptions.Timeout("Deadline exceeded")
+            stats['key_lease'] = (key_pool, lease[0])
+            headers["x-goog-api-key"] = lease[0].key
+        if deadline is None:
+            deadline = time.monotonic() + GEMINI_DEADLINE
+            stats['deadline'] = deadline
+        remaining = max(0.001, deadline - time.monotonic())
+        try:
+            response = session.post(url, data=body, headers=headers,
+                                     timeout=(min(10.0, remaining), remaining), stream=stream)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if lease:
+                key_pool.release(*lease)
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            if delay >= deadline - time.monotonic():
+                raise
+        except Exception:
+            if lease:
+                key_pool.release(*lease)
+            raise
+        else:
+            stats['status'] = response.status_code
+            stats['ttfb_seconds'] = response.elapsed.total_seconds()
+            retry_after = parse_retry_after(response)
+            if lease:
+                key_pool.release(*lease, response.status_code, stats['ttfb_seconds'], retry_after)
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= max_retries:
+                return response
+            delay = retry_after
+            if response.status_code == 429 and lease and key_pool.has_available_key(exclude=lease[0]):
+                # The throttled key is cooling down, another one can take the retry now
+                delay = 0.0
+            elif delay is None:
+                delay = backoff_delay(attempt)
+            # Not worth waiting if the retry could not finish before the deadline
+            if delay >= deadline - time.monotonic():
+                return response
+            response.close()
+        
+        logger.info("Retrying Gemini request in %.1fs (attempt %d of %d)", delay, attempt + 1, max_retries)
+        time.sleep(delay)
+        attempt += 1
+
+def encode_image_base64(image, mime_type='image/png'):
+    """Base64 encode a PIL image (as PNG) or already encoded image bytes, returns (data, mime_type)"""
+    if isinstance(image, bytes):
+        image_data = image
+    else:
+        img_buffer = io.BytesIO()
+        image.save(img_buffer, format='PNG')
+        image_data = img_buffer.getvalue()
+        mime_type = 'image/png'
+    return base64.b64encode(image_data).decode(), mime_type
+
+def build_analysis_payload(img_base64, mime_type, structured=False):
+    """generateContent request body for one image, optionally asking for schema-conforming JSON"""
+    payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": STRUCTURED_PROMPT if structured else ANALYSIS_PROMPT},
+                    {
+                        "inline_data": {
+                            "mime_type": mime_type,
+                            "data": img_base64
+                        }
+                    }
+                ]
+            }
+        ]
+    }
+    if structured:
+        payload["generationConfig"] = {
+            "responseMimeType": "application/json",
+            "responseSchema": FLYER_RESPONSE_SCHEMA
+        }
+    return payload
+
+def convert_image_to_text(image, api_key, mime_type='image/png', deadline=None, structured=False):
+    """Convert image to text using Gemini Vision API - Structured Analysis
+    
+    image can be a PIL image (sent as lossless PNG) or bytes already encoded
+    by preprocess_image, in which case mime_type must describe them. deadline
+    is an absolute time.monotonic() value, by default GEMINI_DEADLINE from when
+    the request gets an API key slot (see post_with_retries).
+    With structured=True the analysis is a JSON document (see FLYER_RESPONSE_SCHEMA)
+    instead of markdown; parse_flyer_data reads both.
+    """
+    call = {'kind': 'generate', 'images': 1}
+    started = time.perf_counter()
+    
+    try:
+        # Convert image to base64
+        img_base64, mime_type = encode_image_base64(image, mime_type)
+        call['encode_seconds'] = time.perf_counter() - started
+        
+        # Gemini API endpoint
+        url = gemini_url("generateContent")
+        
+        # Structured analysis prompt
+        payload = build_analysis_payload(img_base64, mime_type, structured)
+        
+        # Make API request, retrying transient failures until the flyer's deadline
+        response = post_with_retries(url, payload, deadline=deadline, stats=call, api_key=api_key)
+        
+        if response.status_code == 200:
+            result = response.json()
+            call.update(usage_tokens(result))
+            if 'candidates' in result and len(result['candidates']) > 0:
+                extracted_text = result['candidates'][0]['content']['parts'][0]['text']
+                return extracted_text
+            else:
+                call['outcome'] = 'empty'
+                return "No analysis generated"
+        else:
+            call['outcome'] = 'error'
+            return api_error_message(response)
+            
+    except requests.exceptions.Timeout:
+        call['outcome'] = 'timeout'
+        return "Request timed out. Please try again."
+    except Exception as e:
+        call['outcome'] = 'error'
+        return f"Error: {str(e)}"
+    finally:
+        record_call(call, started, api_key)
+
+def api_error_message(response):
+    """Error message for a failed Gemini response (the streaming endpoint wraps errors in a list)"""
+    error_info = response.json() if response.content else {"error": "Unknown error"}
+    if isinstance(error_info, list):
+        error_info = error_info[0] if error_info else {}
+    return f"API Error: {error_info.get('error', {}).get('message', 'Request failed')}"
+
+def stream_image_to_text(image, api_key, mime_type='image/png', deadline=None, on_text=None, structured=False):
+    """Convert image to text with the streamGenerateContent endpoint
+    
+    Same contract as convert_image_to_text, except on_text(chunk) is called with
+    each piece of text as soon as Gemini sends it. The deadline also bounds
+    reading the stream.
+    """
+    call = {'kind': 'stream', 'images': 1}
+    started = time.perf_counter()
+    
+    try:
+        img_base64, mime_type = encode_image_base64(image, mime_type)
+        call['encode_seconds'] = time.perf_counter() - started
+        
+        url = gemini_url("streamGenerateContent?alt=sse")
+        payload = build_analysis_payload(img_base64, mime_type, structured)
+        
+        response = post_with_retries(url, payload, deadline=deadline, stream=True, stats=call, api_key=api_key)
+        deadline = call.get('deadline', deadline)
+        if response.status_code != 200:
+            call['outcome'] = 'error'
+            return api_error_message(response)
+        
+        # Server-sent events, one "data: {json}" line per chunk
+        chunks = []
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise requests.exceptions.Timeout("Deadline exceeded")
+                if not line or not line.startswith('data:'):
+                    continue
+                event = json.loads(line[len('data:'):])
+                if 'usageMetadata' in event:
+                    call.update(usage_tokens(event))
+                candidates = event.get('candidates') or [{}]
+                parts = candidates[0].get('content', {}).get('parts', [])
+                text = "".join(part.get('text', '') for part in parts)
+                if text:
+                    if not chunks:
+                        call['first_text_seconds'] = time.perf_counter() - started
+                    chunks.append(text)
+                    if on_text:
+                        on_text(text)
+        finally:
+            response.close()
+        
+        if not chunks:
+            call['outcome'] = 'empty'
+            return "No analysis generated"
+        return "".join(chunks)
+    
+    except requests.exceptions.Timeout:
+        call['outcome'] = 'timeout'
+        return "Request timed out. Please try again."
+    except Exception as e:
+        call['outcome'] = 'error'
+        return f"Error: {str(e)}"
+    finally:
+        record_call(call, started, api_key)
+
+def batch_marker(number):
+    return f"=== IMAGE {number} ==="
+
+def build_batch_prompt(image_count, structured=False):
+    """Prompt for analyzing several images in one request, each answered under its own marker"""
+    if structured:
+        return (
+            f"You will receive {image_count} separate images, each preceded by a marker line such as "
+            f"\"{batch_marker(1)}\". Analyze every image independently and return a JSON array with one "
+            f"object per image, setting image to the number from its marker.\n\n"
+            f"For each image: {STRUCTURED_PROMPT}"
+        )
+    return (
+        f"You will receive {image_count} separate images, each preceded by a marker line such as "
+        f"\"{batch_marker(1)}\". Analyze every image independently. For each image, first repeat its "
+        f"marker line exactly as given on its own line, then give the analysis for that image only.\n\n"
+        f"For each image: {ANALYSIS_PROMPT}"
+    )
+
+def split_batch_response(response_text, image_count):
+    """Split a batched response into per-image analyses (None where an image is missing)"""
+    analyses = [None] * image_count
+    sections = re.split(r'^\s*=+\s*IMAGE\s+(\d+)\s*=+\s*$', response_text, flags=re.MULTILINE | re.IGNORECASE)
+    # re.split with one group gives [preamble, number, text, number, text, ...]
+    for number, section_text in zip(sections[1::2], sections[2::2]):
+        idx = int(number) - 1
+        if 0 <= idx < image_count and section_text.strip() and analyses[idx] is None:
+            analyses[idx] = section_text.strip()
+    return analyses
+
+def split_structured_batch_response(response_text, image_count):
+    """Split a batched JSON array response into per-image JSON analyses (None where an image is missing)"""
+    analyses = [None] * image_count
+    try:
+        flyers = json.loads(response_text)
+    except ValueError:
+        return analyses
+    for flyer in flyers if isinstance(flyers, list) else []:
+        if not isinstance(flyer, dict):
+            continue
+        try:
+            idx = int(flyer.pop('image')) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= idx < image_count and analyses[idx] is None:
+            analyses[idx] = json.dumps(flyer)
+    return analyses
+
+def convert_images_to_text(images, api_key, deadline=None, structured=False):
+    """Analyze several small images in a single Gemini request
+    
+    images is a list of (encoded bytes, mime_type). Returns one entry per image:
+    its analysis text, None if the response had no section for it, or the same
+    error message for every image if the request itself failed.
+    """
+    call = {'kind': 'batch', 'images': len(images)}
+    started = time.perf_counter()
+    
+    try:
+        url = gemini_url("generateContent")
+        
+        # One marker text part followed by one inline_data part per image
+        parts = [{"text": build_batch_prompt(len(images), structured)}]
+        for number, (image_data, mime_type) in enumerate(images, start=1):
+            parts.append({"text": batch_marker(number)})
+            parts.append({
+                "inline_data": {
+                    "mime_type": mime_type,
+                    "data": base64.b64encode(image_data).decode()
+                }
+            })
+        call['encode_seconds'] = time.perf_counter() - started
+        payload = {"contents": [{"parts": parts}]}
+        if structured:
+            payload["generationConfig"] = {
+                "responseMimeType": "application/json",
+                "responseSchema": BATCH_RESPONSE_SCHEMA
+            }
+        
+        response = post_with_retries(url, payload, deadline=deadline, stats=call, api_key=api_key)
+        
+        if response.status_code == 200:
+            result = response.json()
+            call.update(usage_tokens(result))
+            if 'candidates' in result and len(result['candidates']) > 0:
+                response_parts = result['candidates'][0]['content'].get('parts', [])
+                response_text = "".join(part.get('text', '') for part in response_parts)
+                if structured:
+                    return split_structured_batch_response(response_text, len(images))
+                return split_batch_response(response_text, len(images))
+            call['outcome'] = 'empty'
+            error_message = "No analysis generated"
+        else:
+            call['outcome'] = 'error'
+            error_message = api_error_message(response)
+    except requests.exceptions.Timeout:
+        call['outcome'] = 'timeout'
+        error_message = "Request timed out. Please try again."
+    except Exception as e:
+        call['outcome'] = 'error'
+        error_message = f"Error: {str(e)}"
+    finally:
+        record_call(call, started, api_key)
+    
+    return [error_message] * len(images)
+
+# Prefixes of the messages convert_image_to_text returns instead of an analysis
+ANALYSIS_ERROR_PREFIXES = ("Error", "API Error", "Request timed out", "No analysis generated")
+
+def is_failed_analysis(analysis_text):
+    """Check whether convert_image_to_text returned an error message rather than an analysis"""
+    return not analysis_text or analysis_text.startswith(ANALYSIS_ERROR_PREFIXES)
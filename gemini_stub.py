@@ -0,0 +1,354 @@
+"""Local stand-in for the Gemini generateContent API
+
+Serves generateContent and streamGenerateContent (SSE) so the whole
+upload -> analyze -> parse -> export pipeline can run without a network or a
+GEMINI_API_KEY. Responses are replayed from recordings when one matches the
+request, otherwise synthesized (from fixture analyses if given). Latency,
+server errors and 429 rate limiting can be injected, including a per-key
+requests-per-minute quota to exercise GEMINI_API_KEYS pools.
+
+    python gemini_stub.py --port 8765 --latency 0.8 --rate-limit-rate 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta streamlit run app.py
+
+Record real responses for later replay with --upstream and --record-dir.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+STUB_STORES = ['FreshMart', 'Green Grocer', 'Value Foods', 'City Market', 'Harvest Pantry', 'Corner Store']
+STUB_PRODUCTS = [
+    ('Organic Milk', 'gal'), ('Whole Wheat Bread', 'oz'), ('Large Eggs', 'count'), ('Cheddar Cheese', 'oz'),
+    ('Greek Yogurt', 'oz'), ('Bananas', 'lb'), ('Chicken Breast', 'lb'), ('Orange Juice', 'fl oz'),
+    ('Ground Coffee', 'oz'), ('Basmati Rice', 'lb'), ('Olive Oil', 'ml'), ('Pasta Sauce', 'oz'),
+    ('Spaghetti', 'lb'), ('Butter', 'lb'), ('Apples', 'lb'), ('Atlantic Salmon', 'lb'),
+    ('Sparkling Water', 'pack'), ('Peanut Butter', 'oz'), ('Cereal', 'oz'), ('Tomatoes', 'lb')
+]
+
+# Rough token accounting so usageMetadata looks like the real thing
+TOKENS_PER_IMAGE = 258
+CHARS_PER_TOKEN = 4
+
+
+def request_key(path, payload):
+    """Stable key of a request, used to look up recordings
+
+    Streaming and non-streaming calls with the same body share a recording.
+    """
+    method = path.split('?')[0].rsplit(':', 1)[-1].replace('streamGenerateContent', 'generateContent')
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{method}\n{body}".encode('utf-8')).hexdigest()
+
+
+class GeminiStub:
+    """Response source and fault injection settings for the stub server"""
+
+    def __init__(self, latency=0.5, latency_jitter=0.3, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, record_dir=None, upstream=None, fixtures_dir=None, seed=None, key_rpm=0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.record_dir = record_dir
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.fixtures = self._load_fixtures(fixtures_dir)
+        self.rng = random.Random(seed)
+        self.key_rpm = key_rpm
+        self.counters = {'requests': 0, 'replayed': 0, 'recorded': 0, 'synthesized': 0, 'errors': 0, 'rate_limited': 0}
+        self.key_requests = defaultdict(int)
+        self._key_windows = defaultdict(deque)
+        self._lock = threading.Lock()
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+
+    def _load_fixtures(self, fixtures_dir):
+        fixtures = []
+        if fixtures_dir and os.path.isdir(fixtures_dir):
+            for name in sorted(os.listdir(fixtures_dir)):
+                if name.endswith(('.txt', '.md', '.json')):
+                    with open(os.path.join(fixtures_dir, name), 'r', encoding='utf-8') as f:
+                        fixtures.append(f.read())
+        return fixtures
+
+    def count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            if len(self.key_requests) > 1:
+                stats['keys'] = {key[-4:]: count for key, count in self.key_requests.items()}
+            return stats
+
+    def over_key_quota(self, api_key):
+        """Count a request against its key, True if the key is over its per-minute quota"""
+        now = time.monotonic()
+        with self._lock:
+            self.key_requests[api_key] += 1
+            if not self.key_rpm:
+                return False
+            window = self._key_windows[api_key]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= self.key_rpm:
+                return True
+            window.append(now)
+            return False
+
+    def delay(self):
+        with self._lock:
+            delay = self.rng.gauss(self.latency, self.latency * self.latency_jitter)
+        return max(0.0, delay)
+
+    def injected_fault(self, api_key=''):
+        """Return (status, body, headers) for an injected failure, or None"""
+        if self.over_key_quota(api_key):
+            self.count('rate_limited')
+            body = {"error": {"code": 429, "message": "Quota exceeded for this key (stub)", "status": "RESOURCE_EXHAUSTED"}}
+            return 429, body, {}
+        with self._lock:
+            roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.count('rate_limited')
+            body = {"error": {"code": 429, "message": "Resource has been exhausted (stub)", "status": "RESOURCE_EXHAUSTED"}}
+            return 429, body, {'Retry-After': f"{self.retry_after:g}"}
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.count('errors')
+            body = {"error": {"code": 500, "message": "Internal error (stub)", "status": "INTERNAL"}}
+            return 500, body, {}
+        return None
+
+    def recording_path(self, key):
+        return os.path.join(self.record_dir, f"{key}.json")
+
+    def replay(self, key):
+        if not self.record_dir:
+            return None
+        try:
+            with open(self.recording_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def record(self, path, payload, api_key=None):
+        """Forward a request to the real API and keep its response for replay
+
+        Streaming requests are forwarded as plain generateContent calls, the
+        stub re-streams the recorded response itself.
+        """
+        upstream_path = path.split('/v1beta/', 1)[-1].replace(':streamGenerateContent?alt=sse&', ':generateContent?')
+        upstream_path = upstream_path.replace(':streamGenerateContent', ':generateContent')
+        headers = {'x-goog-api-key': api_key} if api_key else {}
+        response = requests.post(f"{self.upstream}/{upstream_path}", json=payload, headers=headers, timeout=120)
+        recording = {'status': response.status_code, 'body': response.text,
+                     'content_type': response.headers.get('Content-Type', 'application/json')}
+        if response.status_code == 200:
+            with open(self.recording_path(request_key(path, payload)), 'w', encoding='utf-8') as f:
+                json.dump(recording, f)
+            self.count('recorded')
+        return recording
+
+    def synthesize_flyer(self, image_data, structured):
+        """Deterministic analysis for one image, derived from a hash of its bytes"""
+        seed = int(hashlib.sha256(image_data.encode('ascii')).hexdigest()[:12], 16)
+        rng = random.Random(seed)
+        if self.fixtures:
+            fixture = self.fixtures[seed % len(self.fixtures)]
+            if structured == fixture.lstrip().startswith('{'):
+                return fixture
+
+        store = rng.choice(STUB_STORES)
+        products = []
+        for name, unit in rng.sample(STUB_PRODUCTS, rng.randint(4, 12)):
+            size = rng.choice([1, 2, 5, 12, 16, 24, 32, 500]) if unit != 'count' else 12
+            products.append({'name': name, 'price': round(rng.uniform(0.99, 19.99), 2),
+                             'size': str(size), 'unit': unit, 'description': rng.choice(['On sale', 'Fresh', 'Family size', ''])})
+
+        if structured:
+            return json.dumps({'store_name': store, 'slogan': 'Quality for less', 'address': f"{rng.randint(1, 999)} Main St",
+                               'website': f"www.{store.lower().replace(' ', '')}.com", 'phone': f"555-{rng.randint(1000, 9999)}",
+                               'products': products})
+
+        lines = [f"**Store Name:** {store}", "", "**Slogan/Motto:** Quality for less", "", "**Featured Products & Prices:**"]
+        for product in products:
+            description = f" ({product['description']})" if product['description'] else ''
+            lines.append(f"* **{product['name']}:** {product['size']} {product['unit']} for ${product['price']:.2f}{description}")
+        lines += ["", "**Contact Information:**", f"* **Address:** {rng.randint(1, 999)} Main St",
+                  f"* **Website:** www.{store.lower().replace(' ', '')}.com", f"* **Phone Number:** 555-{rng.randint(1000, 9999)}",
+                  "", "**Overall Impression:**", "A bright weekly grocery flyer (synthesized by gemini_stub)."]
+        return "\n".join(lines)
+
+    def synthesize(self, payload):
+        """Build a generateContent response body for a request"""
+        parts = payload.get('contents', [{}])[0].get('parts', [])
+        prompt = "".join(part.get('text', '') for part in parts)
+        images = [part['inline_data']['data'] for part in parts if 'inline_data' in part]
+        generation_config = payload.get('generationConfig', {})
+        structured = generation_config.get('responseMimeType') == 'application/json'
+
+        if len(images) > 1:
+            # Batched request: answer every image under its marker (or as a tagged JSON array)
+            if structured:
+                flyers = [dict(json.loads(self.synthesize_flyer(data, True)), image=number)
+                          for number, data in enumerate(images, start=1)]
+                text = json.dumps(flyers)
+            else:
+                text = "\n\n".join(f"=== IMAGE {number} ===\n{self.synthesize_flyer(data, False)}"
+                                   for number, data in enumerate(images, start=1))
+        elif images:
+            text = self.synthesize_flyer(images[0], structured)
+        else:
+            text = "No image received"
+
+        self.count('synthesized')
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": {
+                "promptTokenCount": TOKENS_PER_IMAGE * len(images) + len(prompt) // CHARS_PER_TOKEN,
+                "candidatesTokenCount": len(text) // CHARS_PER_TOKEN,
+                "totalTokenCount": TOKENS_PER_IMAGE * len(images) + (len(prompt) + len(text)) // CHARS_PER_TOKEN
+            }
+        }
+
+
+def make_handler(stub):
+    class GeminiStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            data = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_stream(self, body, total_delay):
+            """Send a response as server-sent events, spreading the latency over the chunks"""
+            text = body['candidates'][0]['content']['parts'][0]['text']
+            chunks = [text[i:i + 80] for i in range(0, len(text), 80)] or ['']
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for number, chunk in enumerate(chunks):
+                event = {"candidates": [{"content": {"parts": [{"text": chunk}], "role": "model"}}]}
+                if number == len(chunks) - 1:
+                    event["usageMetadata"] = body.get("usageMetadata", {})
+                self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(total_delay / len(chunks))
+            self.close_connection = True
+
+        def do_POST(self):
+            stub.count('requests')
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self.send_json(400, {"error": {"code": 400, "message": "Invalid JSON payload"}})
+                return
+
+            if not re.search(r'/models/[^/:]+:(generateContent|streamGenerateContent)', self.path):
+                self.send_json(404, {"error": {"code": 404, "message": f"Unknown method {self.path}"}})
+                return
+            streaming = ':streamGenerateContent' in self.path
+
+            delay = stub.delay()
+            api_key = self.headers.get('x-goog-api-key', '')
+            fault = stub.injected_fault(api_key)
+            if fault:
+                time.sleep(delay / 4)
+                self.send_json(*fault)
+                return
+
+            key = request_key(self.path, payload)
+            recording = stub.replay(key)
+            if recording is not None:
+                stub.count('replayed')
+            elif stub.upstream:
+                recording = stub.record(self.path, payload, api_key)
+
+            if recording is not None and (recording['status'] != 200 or not streaming):
+                time.sleep(delay)
+                self.send_json(recording['status'], recording['body'])
+                return
+
+            body = stub.synthesize(payload) if recording is None else json.loads(recording['body'])
+            if streaming:
+                self.send_stream(body, delay)
+            else:
+                time.sleep(delay)
+                self.send_json(200, body)
+
+    return GeminiStubHandler
+
+
+def start_stub_server(stub, host='127.0.0.1', port=0):
+    """Run the stub in a background thread, returns (server, base URL for GEMINI_BASE_URL)"""
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1beta"
+
+
+def add_stub_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.5, help="Mean response latency in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.3, help="Latency standard deviation as a fraction of the mean")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument('--key-rpm', type=int, default=0, help="Per API key requests-per-minute quota, 429 beyond it")
+    parser.add_argument('--record-dir', help="Directory of recorded responses to replay (and to record into)")
+    parser.add_argument('--upstream', help="Real API base URL to forward unrecorded requests to, e.g. "
+                                           "https://generativelanguage.googleapis.com/v1beta")
+    parser.add_argument('--fixtures', help="Directory of analysis texts (.txt/.md markdown or .json) to synthesize from")
+    parser.add_argument('--seed', type=int, help="Random seed for latency and fault injection")
+
+
+def stub_from_args(args):
+    return GeminiStub(latency=args.latency, latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+                      rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, record_dir=args.record_dir,
+                      upstream=args.upstream, fixtures_dir=args.fixtures, seed=args.seed,
+                      key_rpm=args.key_rpm)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Gemini stand-in server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = stub_from_args(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stub))
+    server.daemon_threads = True
+    print(f"Gemini stub listening, set GEMINI_BASE_URL=http://{args.host}:{args.port}/v1beta")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(stub.stats()))
+
+
+if __name__ == '__main__':
+    main()
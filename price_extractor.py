@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+
+# Price patterns in priority order, the first one that matches anywhere wins
+PRICE_PATTERNS = [
+    r'\$(\d+\.?\d*)',  # $5.99
+    r'(\d+\.?\d*)\s*(?:dollars?|bucks?)',  # 5.99 dollars
+    r'(\d+\.?\d*)\s*(?:for|each|ea)',  # 5.99 for
+    r'(\d+\.?\d*)\s*(?:\$|dollars?)',  # 5.99$
+]
+
+# Size/weight patterns in priority order, multipacks first so "12 x 355ml" is kept whole
+SIZE_PATTERNS = [
+    r'(\d+\s*[x×]\s*\d+\.?\d*\s*(?:fl\s*oz|oz|ml|l|gal|g|kg|lbs?)\b)',  # multi-pack like "12 x 12oz"
+    r'(\d+\.?\d*\s*(?:gal|gallon|gallons)\b)',  # gallons
+    r'(\d+\.?\d*\s*(?:l|liter|liters|litre|litres)\b)',  # liters
+    r'(\d+\.?\d*\s*(?:ml|milliliter|milliliters|millilitre|millilitres)\b)',  # milliliters
+    r'(\d+\.?\d*\s*(?:oz|ounce|ounces|fl\s*oz|fluid\s*ounce)\b)',  # ounces
+    r'(\d+\.?\d*\s*(?:lb|lbs|pound|pounds)\b)',  # pounds
+    r'(\d+\.?\d*\s*(?:kg|kilogram|kilograms)\b)',  # kilograms
+    r'(\d+\.?\d*\s*(?:g|gram|grams)\b)',  # grams
+    r'(\d+\.?\d*\s*(?:pack|count|ct|pieces?|pcs?)\b)',  # count/pack
+    r'(\d+\.?\d*\s*(?:qt|quart|quarts)\b)',  # quarts
+    r'(\d+\.?\d*\s*(?:pt|pint|pints)\b)',  # pints
+    r'(\d+\.?\d*(?:g|kg|ml|l|oz|lb|lbs|pack|count|ct|gal|qt|pt)\b)',  # shorter versions
+]
+
+ANY_NUMBER = re.compile(r'(\d+\.?\d*)')
+DOLLAR_AMOUNT = re.compile(r'\$\d+\.?\d*')
+SIZE_WORDS = re.compile(
+    r'\d+\.?\d*\s*(?:g|kg|ml|l|oz|lb|lbs|pack|count|ct|gal|gallon|gallons|liter|liters|litre|litres|milliliter|milliliters|'
+    r'quart|quarts|pint|pints|qt|pt|fl\s*oz|fluid\s*ounce|gram|grams|kilogram|kilograms|milliliter|milliliters|ounce|ounces|'
+    r'pound|pounds)\b',
+    re.IGNORECASE
+)
+FILLER = re.compile(r'\bfor\b|\(|\)|,|\s+', re.IGNORECASE)
+
+
+class PriorityPattern:
+    """Search several single-group patterns at once, the first listed pattern that matches wins
+
+    Same result as trying each pattern with re.search in turn, but usually in
+    one pass: the patterns are compiled into one alternation, and after a
+    match only the higher-priority patterns are searched for further on.
+    first is an optional character class every match starts with, letting the
+    scan skip other positions without trying each alternative.
+    """
+
+    def __init__(self, patterns, flags=0, first=None):
+        for pattern in patterns:
+            if re.compile(pattern).groups != 1:
+                raise ValueError(f"Pattern must have exactly one group: {pattern}")
+        prefix = f"(?={first})" if first else ''
+        # _alternations[k] searches for any of the first k patterns; alternative i's group is group i + 1
+        self._alternations = [None] + [
+            re.compile(prefix + '(?:' + '|'.join(f"(?:{pattern})" for pattern in patterns[:count]) + ')', flags)
+            for count in range(1, len(patterns) + 1)
+        ]
+
+    def search(self, text):
+        """Group 1 of the highest-priority pattern found in text (leftmost occurrence), or None"""
+        best = None
+        pos = 0
+        count = len(self._alternations) - 1
+        while count:
+            match = self._alternations[count].search(text, pos)
+            if match is None:
+                break
+            # At any one position the alternation reports the highest-priority pattern matching there
+            best = match.group(match.lastindex)
+            count = match.lastindex - 1
+            pos = match.start() + 1
+        return best
+
+
+PRICE_SEARCH = PriorityPattern(PRICE_PATTERNS, re.IGNORECASE, first=r'[\d$]')
+SIZE_SEARCH = PriorityPattern(SIZE_PATTERNS, re.IGNORECASE, first=r'\d')
+
+
+@lru_cache(maxsize=4096)
+def literal_pattern(text):
+    """Case-insensitive pattern for a literal string (sizes repeat a lot across a catalog)"""
+    return re.compile(re.escape(text), re.IGNORECASE)
+
+
+def extract_price_size(product_name, product_details):
+    """Split a product line into (price, size, description)
+
+    price is "$<amount>" or '' when the details have no number at all, size
+    comes from the details or else the product name, and description is what
+    is left of the details once price, size and filler words are removed.
+    """
+    amount = PRICE_SEARCH.search(product_details)
+    if amount is None:
+        number_match = ANY_NUMBER.search(product_details)
+        amount = number_match.group(1) if number_match else None
+    price = f"${amount}" if amount is not None else ''
+
+    size = SIZE_SEARCH.search(product_details)
+    if size is None and product_name:
+        size = SIZE_SEARCH.search(product_name)
+    size = size.strip() if size is not None else ''
+
+    description = product_details
+    if price:
+        description = DOLLAR_AMOUNT.sub('', description)
+    if size:
+        description = literal_pattern(size).sub('', description)
+        description = SIZE_WORDS.sub('', description)
+    description = FILLER.sub(' ', description).strip()
+
+    return price, size, description
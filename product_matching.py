@@ -0,0 +1,252 @@
+import re
+
+import numpy as np
+
+from quantity import QUANTITY_PATTERN
+
+# Words that describe a product rather than say what it is
+STOPWORDS = {
+    'a', 'and', 'assorted', 'bag', 'big', 'box', 'club', 'each', 'extra', 'family', 'for', 'fresh', 'large', 'medium',
+    'new', 'of', 'on', 'organic', 'pack', 'premium', 'sale', 'select', 'selected', 'size', 'small', 'the', 'value',
+    'varieties', 'variety', 'with'
+}
+
+# MinHash signature length and LSH banding (NUM_BANDS bands of NUM_PERM // NUM_BANDS rows). Three rows
+# per band makes names with Jaccard similarity 0.6 collide in some band with probability ~0.98 and 2/3 ~0.996,
+# while names sharing one word in five (0.2) rarely become candidates
+NUM_PERM = 48
+NUM_BANDS = 16
+# Above one half, so a name never matches one that only adds a word to it ("Milk" / "Almond Milk")
+MATCH_THRESHOLD = 0.6
+
+# Candidates whose MinHash similarity estimate falls this far below the threshold are
+# dropped without computing their exact Jaccard similarity
+ESTIMATE_MARGIN = 0.25
+
+# Buckets larger than this are verified against their first member only instead of pairwise
+MAX_PAIRWISE_BUCKET = 50
+
+# Tokens in at most this many distinct names are "rare": every pair of names sharing one is a candidate
+MAX_RARE_TOKEN_NAMES = 20
+
+_MERSENNE_PRIME = (1 << 31) - 1
+# Runs of letters not touching a digit, so "2%" and "12oz" leave nothing behind
+_WORD = re.compile(r'(?<![a-z0-9])[a-z]+(?![a-z0-9])')
+
+
+def stem(token):
+    """Crude plural folding so "eggs"/"egg", "berries"/"berry" and "cookies"/"cookie" share a token
+
+    Stems are only compared, never shown, so "berri" and "cooki" are fine.
+    """
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'i'
+    if len(token) > 3 and token.endswith('ie'):
+        return token[:-1]
+    if len(token) > 3 and token.endswith('y'):
+        return token[:-1] + 'i'
+    if len(token) > 4 and token.endswith('oes'):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def product_tokens(name):
+    """Tokens that identify a product in name order, sizes and filler words dropped"""
+    # Sizes go first so their units ("oz", "ml") don't make unrelated products look alike
+    text = QUANTITY_PATTERN.sub(' ', str(name)).lower()
+    words = _WORD.findall(text)
+    tokens = [stem(w) for w in words if w not in STOPWORDS] or [stem(w) for w in words]
+    return list(dict.fromkeys(tokens))
+
+
+def normalize_product_name(name):
+    """Sorted tuple of product_tokens, equal for names that differ only in order, size or filler"""
+    return tuple(sorted(product_tokens(name)))
+
+
+def jaccard(a, b):
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash_signatures(token_sets, num_perm=NUM_PERM, seed=0):
+    """(len(token_sets), num_perm) MinHash signatures, computed for all sets at once"""
+    vocabulary = {}
+    set_ids, token_ids = [], []
+    for set_idx, tokens in enumerate(token_sets):
+        for token in tokens:
+            set_ids.append(set_idx)
+            token_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+
+    signatures = np.full((len(token_sets), num_perm), _MERSENNE_PRIME, dtype=np.int64)
+    if not token_ids:
+        return signatures
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+    # Random (hashed) token ids keep the universal hash from seeing consecutive integers
+    token_hashes = rng.integers(0, _MERSENNE_PRIME, size=len(vocabulary), dtype=np.int64)[np.asarray(token_ids)]
+    hashes = (np.outer(token_hashes, a) + b) % _MERSENNE_PRIME
+    # set_ids is sorted (sets were visited in order), so every set's rows are contiguous
+    set_ids = np.asarray(set_ids)
+    starts = np.flatnonzero(np.r_[True, set_ids[1:] != set_ids[:-1]])
+    signatures[set_ids[starts]] = np.minimum.reduceat(hashes, starts, axis=0)
+    return signatures
+
+
+def bucket_pair_codes(bucket_ids, count, max_size):
+    """Codes (a * count + b) of every pair of rows sharing a bucket of at most max_size rows"""
+    _, bucket_ids, bucket_sizes = np.unique(bucket_ids, return_inverse=True, return_counts=True)
+    order = np.argsort(bucket_ids, kind='stable')
+    sorted_ids = bucket_ids[order]
+    small = bucket_sizes[sorted_ids] <= max_size
+    codes = []
+    # Rows offset apart in bucket order pair up when they landed in the same (small) bucket
+    for offset in range(1, min(max_size, int(bucket_sizes.max(initial=0)))):
+        same = (sorted_ids[:-offset] == sorted_ids[offset:]) & small[offset:]
+        codes.append(order[:-offset][same] * count + order[offset:][same])
+    return codes, order, sorted_ids, bucket_sizes, small
+
+
+def token_index(token_sets):
+    """Inverted index: (sorted token ids, set index per entry), entries grouped by token"""
+    vocabulary = {}
+    token_ids, set_ids = [], []
+    for set_idx, tokens in enumerate(token_sets):
+        for token in tokens:
+            token_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+            set_ids.append(set_idx)
+    token_ids = np.asarray(token_ids, dtype=np.int64)
+    order = np.argsort(token_ids, kind='stable')
+    return token_ids[order], np.asarray(set_ids, dtype=np.int64)[order]
+
+
+def rare_token_pairs(token_sets, max_names=MAX_RARE_TOKEN_NAMES):
+    """(pairs, 2) array of sets sharing a token that few sets have
+
+    Brand and variety words are rare and telling; LSH can miss a pair whose
+    similarity sits just above the threshold, this blocking step cannot.
+    """
+    token_ids, set_ids = token_index(token_sets)
+    if not len(token_ids):
+        return np.empty((0, 2), dtype=np.int64)
+    count = len(token_sets)
+    codes, order, _, _, _ = bucket_pair_codes(token_ids, count, max_names)
+    codes = [set_ids[code // count] * count + set_ids[code % count] for code in codes]
+    if not codes:
+        return np.empty((0, 2), dtype=np.int64)
+    codes = np.unique(np.concatenate(codes))
+    pairs = np.column_stack([codes // count, codes % count])
+    pairs.sort(axis=1)
+    return pairs
+
+
+def candidate_pairs(signatures, bands=NUM_BANDS):
+    """(pairs, 2) array of rows whose signatures agree on every row of at least one band (LSH blocking)
+
+    Buckets of up to MAX_PAIRWISE_BUCKET rows yield all their pairs, larger
+    ones pair each member with the bucket's first row only.
+    """
+    count = len(signatures)
+    rows_per_band = signatures.shape[1] // bands
+    codes = []
+    for band in range(bands):
+        # Fold the band's rows into one 64-bit key; a rare key collision only adds a candidate
+        keys = np.zeros(count, dtype=np.uint64)
+        for row in signatures[:, band * rows_per_band:(band + 1) * rows_per_band].T:
+            keys = keys * np.uint64(_MERSENNE_PRIME) + row.astype(np.uint64)
+        band_codes, order, sorted_ids, bucket_sizes, small = bucket_pair_codes(keys, count, MAX_PAIRWISE_BUCKET)
+        codes.extend(band_codes)
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        first = np.repeat(order[starts], bucket_sizes[sorted_ids[starts]])
+        large = ~small & (first != order)
+        codes.append(first[large] * count + order[large])
+    if not codes:
+        return np.empty((0, 2), dtype=np.int64)
+    codes = np.unique(np.concatenate(codes))
+    pairs = np.column_stack([codes // count, codes % count])
+    pairs.sort(axis=1)
+    return pairs
+
+
+def group_products(names, threshold=MATCH_THRESHOLD, num_perm=NUM_PERM, bands=NUM_BANDS, seed=0):
+    """Cluster product names that refer to the same product
+
+    Names are normalized to token sets; identical sets share a group outright.
+    Candidate pairs of distinct sets come from MinHash LSH and from an
+    inverted index of rare tokens, so only names likely to be similar are
+    compared. Groups are then formed by complete linkage: the most common
+    unassigned set founds a group, and its candidates join in order of
+    similarity only while their Jaccard similarity to every member is at
+    least threshold, so "Chocolate" and "Milk" never meet through "Chocolate
+    Milk". Returns (group id per name, group labels), group ids numbered in
+    order of first appearance; a label is the group's most common name as
+    written, or empty for names with no identifying words.
+    """
+    # Catalogs repeat names a lot, tokenize each distinct name once
+    set_index = {}
+    name_sets = {}
+    for name in dict.fromkeys(names):
+        tokens = normalize_product_name(name)
+        name_sets[name] = set_index.setdefault(tokens, len(set_index))
+    unique_sets = list(set_index)
+    token_sets = [set(tokens) for tokens in unique_sets]
+    set_ids = np.array([name_sets[name] for name in names], dtype=np.int64)
+    if not len(set_ids):
+        return set_ids, []
+
+    # Exact similarity of every candidate pair that could plausibly reach the threshold
+    neighbors = [[] for _ in unique_sets]
+    if len(unique_sets) > 1:
+        signatures = minhash_signatures(unique_sets, num_perm=num_perm, seed=seed)
+        pairs = np.unique(np.r_[candidate_pairs(signatures, bands=bands), rare_token_pairs(unique_sets)], axis=0)
+        # The share of agreeing signature rows estimates Jaccard similarity
+        agreement = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+        for a, b in pairs[agreement >= threshold - ESTIMATE_MARGIN].tolist():
+            similarity = jaccard(token_sets[a], token_sets[b])
+            if similarity >= threshold:
+                neighbors[a].append((similarity, b))
+                neighbors[b].append((similarity, a))
+
+    # Complete linkage, founders taken from the most common sets down (first appearance breaks ties)
+    set_counts = np.bincount(set_ids, minlength=len(unique_sets))
+    _, first_seen = np.unique(set_ids, return_index=True)
+    set_groups = np.full(len(unique_sets), -1, dtype=np.int64)
+    group_count = 0
+    for founder in np.lexsort((first_seen, -set_counts)).tolist():
+        if set_groups[founder] >= 0:
+            continue
+        members = [founder]
+        set_groups[founder] = group_count
+        for _, candidate in sorted(neighbors[founder], key=lambda item: (-item[0], first_seen[item[1]])):
+            if set_groups[candidate] < 0 and all(jaccard(token_sets[candidate], token_sets[member]) >= threshold
+                                                 for member in members[1:]):
+                members.append(candidate)
+                set_groups[candidate] = group_count
+        group_count += 1
+
+    # Number groups by first appearance
+    _, first_seen, group_ids = np.unique(set_groups[set_ids], return_index=True, return_inverse=True)
+    rank = np.empty(len(first_seen), dtype=np.int64)
+    rank[np.argsort(first_seen, kind='stable')] = np.arange(len(first_seen))
+    group_ids = rank[group_ids.ravel()]
+
+    # Label each group with its most common name as written (then the shortest, then the first seen)
+    name_counts = {}
+    for name in names:
+        name_counts[name] = name_counts.get(name, 0) + 1
+    best = {}
+    group_of_set = np.empty(len(unique_sets), dtype=np.int64)
+    group_of_set[set_ids] = group_ids
+    for order, (name, count) in enumerate(name_counts.items()):
+        group = int(group_of_set[name_sets[name]])
+        key = (-count, len(str(name)), order)
+        if group not in best or key < best[group][0]:
+            best[group] = (key, name)
+    labels = [str(best[group][1]) if unique_sets[name_sets[best[group][1]]] else '' for group in range(len(first_seen))]
+    return group_ids, labels
@@ -0,0 +1,98 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Base units every size is normalized to
+GRAMS = 'g'
+MILLILITRES = 'ml'
+COUNT = 'count'
+
+# Unit spellings (lower case, spaces and dots removed) -> (base unit, base units per unit)
+UNIT_FACTORS = {
+    'g': (GRAMS, 1.0), 'gram': (GRAMS, 1.0), 'grams': (GRAMS, 1.0),
+    'kg': (GRAMS, 1000.0), 'kilogram': (GRAMS, 1000.0), 'kilograms': (GRAMS, 1000.0),
+    'oz': (GRAMS, 28.349523125), 'ounce': (GRAMS, 28.349523125), 'ounces': (GRAMS, 28.349523125),
+    'lb': (GRAMS, 453.59237), 'lbs': (GRAMS, 453.59237), 'pound': (GRAMS, 453.59237), 'pounds': (GRAMS, 453.59237),
+    'ml': (MILLILITRES, 1.0), 'milliliter': (MILLILITRES, 1.0), 'milliliters': (MILLILITRES, 1.0),
+    'millilitre': (MILLILITRES, 1.0), 'millilitres': (MILLILITRES, 1.0),
+    'l': (MILLILITRES, 1000.0), 'liter': (MILLILITRES, 1000.0), 'liters': (MILLILITRES, 1000.0),
+    'litre': (MILLILITRES, 1000.0), 'litres': (MILLILITRES, 1000.0),
+    'floz': (MILLILITRES, 29.5735295625), 'fluidounce': (MILLILITRES, 29.5735295625),
+    'fluidounces': (MILLILITRES, 29.5735295625),
+    'gal': (MILLILITRES, 3785.411784), 'gallon': (MILLILITRES, 3785.411784), 'gallons': (MILLILITRES, 3785.411784),
+    'qt': (MILLILITRES, 946.352946), 'quart': (MILLILITRES, 946.352946), 'quarts': (MILLILITRES, 946.352946),
+    'pt': (MILLILITRES, 473.176473), 'pint': (MILLILITRES, 473.176473), 'pints': (MILLILITRES, 473.176473),
+    'pack': (COUNT, 1.0), 'count': (COUNT, 1.0), 'ct': (COUNT, 1.0),
+    'piece': (COUNT, 1.0), 'pieces': (COUNT, 1.0), 'pc': (COUNT, 1.0), 'pcs': (COUNT, 1.0)
+}
+
+# Unit prices are quoted per 100 g, per 100 ml and per item
+UNIT_PRICE_BASIS = {GRAMS: (100.0, 'per 100 g'), MILLILITRES: (100.0, 'per 100 ml'), COUNT: (1.0, 'per item')}
+
+# Optional "12 x" multipack count, an amount and a unit; longer spellings come first
+QUANTITY_PATTERN = re.compile(
+    r'(?:(?P<pack>\d+)\s*[x×]\s*)?'
+    r'(?P<amount>\d+(?:\.\d+)?|\.\d+)\s*'
+    r'(?P<unit>fl\.?\s*oz|fluid\s*ounces?|gallons?|gal|lit(?:er|re)s?|millilit(?:er|re)s?|ml|l|ounces?|oz|'
+    r'pounds?|lbs?|kilograms?|kg|grams?|g|quarts?|qt|pints?|pt|pack|count|ct|pieces?|pcs?)\b',
+    re.IGNORECASE
+)
+
+
+def unit_factor(unit):
+    """(base unit, base units per unit) for a unit as written, or (None, None)"""
+    return UNIT_FACTORS.get(re.sub(r'[\s.]', '', unit.lower()), (None, None))
+
+
+def parse_quantity(size_text):
+    """Canonical (quantity, base unit) for a size such as "2 lb", "500g" or "12 x 355ml"
+
+    Multipacks are multiplied out ("12 x 12oz" is 4082.3 g). Returns
+    (None, None) when the text has no recognizable size.
+    """
+    match = QUANTITY_PATTERN.search(size_text or '')
+    if not match:
+        return None, None
+    base_unit, factor = unit_factor(match.group('unit'))
+    if base_unit is None:
+        return None, None
+    quantity = float(match.group('amount')) * factor
+    if match.group('pack'):
+        quantity *= int(match.group('pack'))
+    return quantity, base_unit
+
+
+def parse_quantities(sizes):
+    """Vectorized parse_quantity over a Series of sizes, returns Quantity and Base_Unit columns
+
+    Catalogs repeat the same few sizes, so each distinct size is parsed once.
+    """
+    codes, uniques = pd.factorize(pd.Series(sizes, dtype=object).fillna(''))
+    parts = pd.Series(uniques, dtype=object).str.extract(QUANTITY_PATTERN)
+
+    units = parts['unit'].str.lower().str.replace(r'[\s.]', '', regex=True)
+    base_units = units.map(lambda unit: UNIT_FACTORS.get(unit, (None, None))[0])
+    factors = units.map(lambda unit: UNIT_FACTORS.get(unit, (None, np.nan))[1]).astype(float)
+    quantities = parts['amount'].astype(float) * factors * parts['pack'].astype(float).fillna(1.0)
+
+    quantities = quantities.to_numpy()[codes] if len(codes) else np.array([], dtype=float)
+    base_units = base_units.to_numpy(dtype=object)[codes] if len(codes) else np.array([], dtype=object)
+    index = sizes.index if isinstance(sizes, pd.Series) else None
+    return pd.DataFrame({'Quantity': quantities, 'Base_Unit': base_units}, index=index)
+
+
+def unit_prices(prices, quantities, base_units):
+    """Price per 100 g / 100 ml / item, and the matching basis label, for aligned columns
+
+    NaN (and an empty basis) where the size is unknown or the price is not positive.
+    """
+    prices = pd.Series(prices, dtype=float)
+    quantities = pd.Series(quantities, index=prices.index, dtype=float)
+    base_units = pd.Series(base_units, index=prices.index, dtype=object)
+
+    multipliers = base_units.map({unit: basis[0] for unit, basis in UNIT_PRICE_BASIS.items()})
+    labels = base_units.map({unit: basis[1] for unit, basis in UNIT_PRICE_BASIS.items()})
+    valid = (prices > 0) & (quantities > 0) & multipliers.notna()
+    unit_price = (prices / quantities * multipliers).where(valid).round(4)
+    return unit_price, labels.where(valid, '')
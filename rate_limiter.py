@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+
+# Window the requests-per-minute and tokens-per-minute budgets are measured over
+BUDGET_WINDOW = 60.0
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter for Gemini requests
+
+    Up to limit requests may be in flight at once. Every successful request
+    raises the limit by increase / limit (about +increase per round of
+    requests), while a throttled request (429/503) or one much slower than
+    the running latency baseline multiplies it by decrease. Only requests that
+    started after the last cut can cut it again, so a burst of 429s from one
+    overloaded round counts once.
+
+    Optional rpm and tpm budgets hold requests back until the last minute's
+    requests and tokens leave room for them.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=16, increase=1.0, decrease=0.5, rpm=0, tpm=0,
+                 latency_tolerance=2.5, latency_alpha=0.1, min_latency_samples=5):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency_tolerance = latency_tolerance
+        self.latency_alpha = latency_alpha
+        self.min_latency_samples = min_latency_samples
+
+        self.in_flight = 0
+        self.decreases = 0
+        self.latency_baseline = None
+        self.latency_samples = 0
+        self.last_decrease = 0.0
+        self._requests = deque()
+        self._tokens = deque()
+        self._token_total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def _expire(self, now):
+        while self._requests and now - self._requests[0] >= BUDGET_WINDOW:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= BUDGET_WINDOW:
+            self._token_total -= self._tokens.popleft()[1]
+
+    def _has_room(self):
+        """Whether a request may start now: a free slot and room left in both budgets"""
+        if self.in_flight >= self.current_limit:
+            return False
+        if self.rpm and len(self._requests) >= self.rpm:
+            return False
+        return not (self.tpm and self._token_total >= self.tpm and self._tokens)
+
+    def try_acquire(self):
+        """Take a request slot if one is free right now, returns its start time or None
+
+        Callers that need to wait (ApiKeyPool.acquire) poll this, so they can
+        choose between several keys' limiters instead of blocking on one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if not self._has_room():
+                return None
+            self.in_flight += 1
+            self._requests.append(now)
+            return now
+
+    def release(self, started, status=None, latency=None):
+        """Return a slot taken at started, adjusting the limit from the outcome
+
+        status is the HTTP status (None for connection errors and timeouts)
+        and latency the seconds the request took.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if status in (429, 503):
+                self._cut(started)
+            elif status is not None and status < 400 and latency is not None:
+                if self._is_slow(latency):
+                    self._cut(started)
+                else:
+                    self.limit = min(self.max_limit, self.limit + self.increase / max(self.limit, 1.0))
+                self._observe_latency(latency)
+
+    def _cut(self, started):
+        if started < self.last_decrease:
+            return
+        self.limit = max(float(self.min_limit), self.limit * self.decrease)
+        self.last_decrease = time.monotonic()
+        self.decreases += 1
+
+    def _is_slow(self, latency):
+        return (self.latency_samples >= self.min_latency_samples
+                and latency > self.latency_baseline * self.latency_tolerance)
+
+    def _observe_latency(self, latency):
+        if self.latency_baseline is None:
+            self.latency_baseline = latency
+        else:
+            self.latency_baseline += self.latency_alpha * (latency - self.latency_baseline)
+        self.latency_samples += 1
+
+    def add_tokens(self, tokens):
+        """Count tokens used by a finished request against the tokens-per-minute budget"""
+        if not tokens:
+            return
+        with self._lock:
+            self._tokens.append((time.monotonic(), tokens))
+            self._token_total += tokens
+
+    def load(self):
+        """Fraction of the current limit in use"""
+        with self._lock:
+            return self.in_flight / self.current_limit
+
+    def stats(self):
+        """Limit and budget usage, ApiKeyPool.stats() adds them to each key's counters"""
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                'limit': self.current_limit,
+                'requests_last_minute': len(self._requests),
+                'tokens_last_minute': self._token_total,
+                'decreases': self.decreases
+            }
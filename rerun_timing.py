@@ -0,0 +1,80 @@
+import time
+from contextlib import contextmanager
+
+# Name of the row timing the whole script
+WHOLE_SCRIPT = "Whole script"
+
+
+class RerunTimings:
+    """Last rerun cost of each app section, one per session
+
+    Streamlit reruns the whole script on most interactions, but a section
+    rendered in a fragment reruns alone when its own widgets change. Each
+    section is timed as either part of a full run or a fragment-only rerun,
+    so the two costs can be compared. A section that runs twice within the
+    same full run is a fragment rerun.
+    """
+
+    def __init__(self):
+        self.run_id = 0
+        self.run_started = None
+        self.sections = {}
+
+    def start_run(self):
+        """Call at the top of the script"""
+        self.run_id += 1
+        self.run_started = time.perf_counter()
+
+    def finish_run(self):
+        """Call at the end of the script"""
+        if self.run_started is not None:
+            self._record(WHOLE_SCRIPT, time.perf_counter() - self.run_started, fragment=False)
+            self.run_started = None
+
+    @contextmanager
+    def section(self, name):
+        section = self.sections.get(name)
+        fragment = section is not None and section['run_id'] == self.run_id
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - started, fragment)
+
+    def _record(self, name, seconds, fragment):
+        section = self.sections.setdefault(name, {
+            'run_id': None, 'full_seconds': None, 'fragment_seconds': None, 'fragment_reruns': 0, 'last_fragment': False
+        })
+        section['run_id'] = self.run_id
+        section['last_fragment'] = fragment
+        if fragment:
+            section['fragment_seconds'] = seconds
+            section['fragment_reruns'] += 1
+        else:
+            section['full_seconds'] = seconds
+
+    def describe(self, name):
+        """One-line readout of a section's latest run, e.g. for a caption under it"""
+        section = self.sections.get(name)
+        if section is None:
+            return ""
+        if not section['last_fragment']:
+            return f"Rendered in {section['full_seconds'] * 1000:.0f} ms as part of a full page run"
+        whole = self.sections.get(WHOLE_SCRIPT)
+        readout = f"Section-only rerun in {section['fragment_seconds'] * 1000:.0f} ms"
+        if whole is not None and whole['full_seconds'] is not None:
+            readout += f" • the last full page run took {whole['full_seconds'] * 1000:.0f} ms"
+        return readout
+
+    def rows(self):
+        """[{section, full run ms, fragment rerun ms, fragment reruns}], whole script last"""
+        names = [name for name in self.sections if name != WHOLE_SCRIPT]
+        if WHOLE_SCRIPT in self.sections:
+            names.append(WHOLE_SCRIPT)
+        return [{
+            'Section': name,
+            'Full run (ms)': None if section['full_seconds'] is None else round(section['full_seconds'] * 1000, 1),
+            'Section-only rerun (ms)': (None if section['fragment_seconds'] is None
+                                        else round(section['fragment_seconds'] * 1000, 1)),
+            'Section-only reruns': section['fragment_reruns']
+        } for name, section in ((name, self.sections[name]) for name in names)]
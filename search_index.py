@@ -0,0 +1,448 @@
+import bisect
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from export_cache import ExportCache
+from flyer_export import price_numbers
+
+# Substring queries are looked up by their character trigrams
+NGRAM = 3
+# Words of a normalized name, for token and prefix queries
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+# Columns of a search result, in display order
+RESULT_COLUMNS = ['Product_Name', 'Store_Name', 'Price_Text', 'Price_Numeric', 'Size_Weight']
+
+# Fuzzy search: words are compared by the trigrams of the word padded like pg_trgm ("  word ")
+WORD_PAD_START = '  '
+WORD_PAD_END = ' '
+# Least trigram similarity (shared / all distinct trigrams) for a word to count as a match
+FUZZY_MIN_SIMILARITY = float(os.getenv('SEARCH_FUZZY_MIN_SIMILARITY', '0.3'))
+# Typos trigrams miss on short words (transpositions, "mlk") are caught by edit distance up to this
+FUZZY_MAX_EDITS = 1
+# Results returned by a fuzzy search, best first
+FUZZY_RESULT_LIMIT = int(os.getenv('SEARCH_FUZZY_LIMIT', '50'))
+# Relevance of a match in the description relative to one in the name
+DESCRIPTION_WEIGHT = 0.5
+# Added to the relevance of names containing the whole query as typed
+SUBSTRING_BONUS = 0.5
+# Autocomplete suggestions shown for the search box
+SUGGESTION_LIMIT = int(os.getenv('SEARCH_SUGGESTION_LIMIT', '8'))
+
+# Per-term results and charts kept across reruns
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '256'))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_MB', '64')) * 1024 * 1024
+
+
+@st.cache_resource
+def get_search_cache():
+    """Process-wide cache of per-term search results and serialized charts, keyed by term and data fingerprint"""
+    return ExportCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, max_bytes=SEARCH_CACHE_MAX_BYTES)
+
+
+def normalize(text):
+    """Form names and queries are compared in (lower case, like the search always did)"""
+    return str(text).lower()
+
+
+def char_codes(text):
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.int64)
+
+
+def ngram_codes(text):
+    """Distinct character n-grams of a normalized string as int64 codes (21 bits per character)"""
+    chars = char_codes(text)
+    if len(chars) < NGRAM:
+        return np.empty(0, dtype=np.int64)
+    codes = chars[:len(chars) - NGRAM + 1].copy()
+    for offset in range(1, NGRAM):
+        codes = (codes << 21) | chars[offset:len(chars) - NGRAM + 1 + offset]
+    return np.unique(codes)
+
+
+def ngram_postings(texts):
+    """Postings of the character n-grams of each text (n-gram code -> text positions)"""
+    # All texts in one buffer, separated by NUL so no n-gram spans two texts
+    chars = char_codes('\0'.join(texts))
+    lengths = np.fromiter((len(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+    owners = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)[:len(chars)]
+
+    count = max(len(chars) - NGRAM + 1, 0)
+    codes = chars[:count].copy()
+    valid = chars[:count] != 0
+    for offset in range(1, NGRAM):
+        window = chars[offset:count + offset]
+        codes = (codes << 21) | window
+        valid &= window != 0
+    return Postings(codes[valid], owners[:count][valid])
+
+
+def pad_word(word):
+    return WORD_PAD_START + word + WORD_PAD_END
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (adjacent swaps count as one edit), or limit + 1 once above limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def best_per_id(ids, scores):
+    """Distinct ids with the highest score each"""
+    order = np.lexsort((-scores, ids))
+    ids, scores = ids[order], scores[order]
+    first = np.r_[True, ids[1:] != ids[:-1]] if len(ids) else np.empty(0, bool)
+    return ids[first], scores[first]
+
+
+def concat_ranges(starts, stops):
+    """Positions starts[0]:stops[0], starts[1]:stops[1], ... as one array, without a Python loop"""
+    lengths = stops - starts
+    return np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+
+class Postings:
+    """Sorted keys, each with a sorted array of ids (CSR layout)"""
+
+    def __init__(self, keys, ids):
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        # Drop repeats of the same (key, id) pair
+        keep = np.r_[True, (keys[1:] != keys[:-1]) | (ids[1:] != ids[:-1])] if len(keys) else np.empty(0, bool)
+        keys, ids = keys[keep], ids[keep]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, np.int64)
+        self.keys = keys[starts]
+        self.offsets = np.r_[starts, len(keys)]
+        self.ids = ids.astype(np.int32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        idx = np.searchsorted(self.keys, key)
+        if idx == len(self.keys) or self.keys[idx] != key:
+            return self.ids[:0]
+        return self.ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def get_range(self, start, stop):
+        """Ids of the keys at positions start:stop, merged and deduplicated"""
+        return np.unique(self.ids[self.offsets[start]:self.offsets[stop]])
+
+    def get_positions(self, positions):
+        """Ids of the keys at the given positions, merged and deduplicated"""
+        return np.unique(self.ids[concat_ranges(self.offsets[positions], self.offsets[positions + 1])])
+
+    def get_many(self, keys, weights):
+        """(ids, weight of the key each id came from) for the postings of keys; absent keys are skipped"""
+        positions = np.searchsorted(self.keys, keys)
+        present = positions < len(self.keys)
+        present[present] = self.keys[positions[present]] == keys[present]
+        positions = positions[present]
+        starts, stops = self.offsets[positions], self.offsets[positions + 1]
+        return self.ids[concat_ranges(starts, stops)], np.repeat(weights[present], stops - starts)
+
+
+class ProductSearchIndex:
+    """Search index over the products of an analysis, built once and queried per search
+
+    Product names are normalized (lower-cased) and deduplicated; two indexes
+    map them back to products:
+
+    - an n-gram index (character trigrams -> names) answers substring
+      queries: the names holding every trigram of the query are the only
+      candidates, and just those are checked for the substring itself;
+    - a token index (words -> names) answers whole-word and word-prefix
+      queries, prefixes through binary search over the sorted words.
+
+    For fuzzy search the words of names and descriptions form one sorted
+    vocabulary with its own trigram index, so a misspelled query word is
+    matched against the vocabulary rather than against every product.
+
+    Numeric prices are computed once at build time, so results need no
+    regex work.
+    """
+
+    def __init__(self, products_data):
+        names = pd.Series([product['Product_Name'] for product in products_data], dtype=object)
+        self.products = pd.DataFrame({
+            'Product_Name': names,
+            'Store_Name': [product['Store_Name'] for product in products_data],
+            'Price_Text': [product['Price'] for product in products_data],
+            'Price_Numeric': price_numbers([product['Price'] for product in products_data]),
+            'Size_Weight': [product['Size_Weight'] for product in products_data]
+        }, columns=RESULT_COLUMNS)
+
+        # Distinct normalized names and descriptions, and the products of each (CSR by name/description id)
+        self.names, self._name_products, self._name_offsets = self._distinct(names)
+        descriptions = pd.Series([product.get('Description') or '' for product in products_data], dtype=object)
+        self.descriptions, self._description_products, self._description_offsets = self._distinct(descriptions)
+
+        self._ngrams = ngram_postings(self.names)
+        self._short_names = [idx for idx, name in enumerate(self.names) if len(name) < NGRAM]
+        self._build_word_index()
+        self._build_suggestions()
+
+    def __len__(self):
+        return len(self.products)
+
+    @staticmethod
+    def _distinct(texts):
+        """(distinct normalized texts, product rows grouped by text, offsets of each text's rows)"""
+        codes, unique_texts = pd.factorize(texts.fillna('').map(normalize))
+        order = np.argsort(codes, kind='stable')
+        offsets = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(unique_texts)))]
+        return list(unique_texts), order.astype(np.int32), offsets
+
+    def _build_word_index(self):
+        name_words = pd.Series(self.names, dtype=object).str.findall(TOKEN_PATTERN).explode().dropna()
+        description_words = pd.Series(self.descriptions, dtype=object).str.findall(TOKEN_PATTERN).explode().dropna()
+        # One sorted vocabulary; sort=True keeps word ids in word order for prefix search
+        word_codes, words = pd.factorize(pd.concat([name_words, description_words]), sort=True)
+        self.words = list(words)
+        name_codes, description_codes = word_codes[:len(name_words)], word_codes[len(name_words):]
+        self._name_words = Postings(name_codes.astype(np.int64), name_words.index.to_numpy(dtype=np.int64))
+        self._description_words = Postings(description_codes.astype(np.int64),
+                                           description_words.index.to_numpy(dtype=np.int64))
+
+        # Trigrams of the padded words, for fuzzy matching of query words
+        self._word_ngrams = ngram_postings([pad_word(word) for word in self.words])
+        self._word_ngram_counts = np.bincount(self._word_ngrams.ids, minlength=len(self.words))
+        self._word_lengths = np.fromiter((len(word) for word in self.words), dtype=np.int64, count=len(self.words))
+
+    def _build_suggestions(self):
+        name_ids = np.repeat(np.arange(len(self.names)), np.diff(self._name_offsets))
+        # Stores carrying each name (products are grouped by name, so name ids follow _name_products)
+        self._store_counts = (pd.DataFrame({'name': name_ids,
+                                            'store': self.products['Store_Name'].to_numpy()[self._name_products]})
+                              .groupby('name')['store'].nunique()
+                              .reindex(range(len(self.names)), fill_value=0).to_numpy())
+        # Each name as first written in the flyers, for display
+        first_rows = self._name_products[self._name_offsets[:-1]]
+        self._display_names = self.products['Product_Name'].to_numpy()[first_rows]
+        # Names in sorted order, so the names starting with a prefix are one contiguous range
+        self._sorted_name_ids = np.argsort(np.asarray(self.names, dtype=object), kind='stable')
+        self._sorted_names = [self.names[idx] for idx in self._sorted_name_ids.tolist()]
+
+    def _top_names(self, name_ids, limit):
+        """name_ids ordered by store count (then name), cut to limit"""
+        counts = self._store_counts[name_ids]
+        if len(name_ids) > limit:
+            keep = np.argpartition(-counts, limit - 1)[:limit]
+            name_ids, counts = name_ids[keep], counts[keep]
+        order = sorted(range(len(name_ids)), key=lambda idx: (-counts[idx], self.names[name_ids[idx]]))
+        return name_ids[order]
+
+    def suggest(self, prefix, limit=SUGGESTION_LIMIT):
+        """Autocomplete for prefix: (name, store count) pairs, carried by the most stores first
+
+        Names starting with prefix come first, from a binary search over the
+        sorted names; when they are fewer than limit, names with a later word
+        starting with prefix fill the rest. An empty prefix gives the names
+        most stores carry.
+        """
+        prefix = normalize(prefix).lstrip()
+        start = bisect.bisect_left(self._sorted_names, prefix)
+        stop = bisect.bisect_left(self._sorted_names, prefix + '\U0010ffff')
+        name_ids = self._top_names(self._sorted_name_ids[start:stop], limit)
+        if prefix and len(name_ids) < limit:
+            word_starts = np.setdiff1d(self.substring_names(' ' + prefix), name_ids, assume_unique=True)
+            name_ids = np.r_[name_ids, self._top_names(word_starts, limit - len(name_ids))]
+        return [(self._display_names[idx], int(self._store_counts[idx])) for idx in name_ids.tolist()]
+
+    def _products_of(self, name_ids):
+        """Product row numbers (sorted, as in products_data) of the given name ids"""
+        if not len(name_ids):
+            return np.empty(0, dtype=np.int64)
+        name_ids = np.asarray(name_ids)
+        positions = concat_ranges(self._name_offsets[name_ids], self._name_offsets[name_ids + 1])
+        return np.sort(self._name_products[positions])
+
+    def substring_names(self, query):
+        """Ids of the names containing query"""
+        query = normalize(query)
+        if not query:
+            return np.arange(len(self.names))
+        codes = ngram_codes(query)
+        if not len(codes):
+            return self._short_query_names(query)
+        postings = sorted((self._ngrams.get(code) for code in codes), key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        if len(query) == NGRAM:
+            return candidates
+        return np.array([idx for idx in candidates.tolist() if query in self.names[idx]], dtype=np.int64)
+
+    def _short_query_names(self, query):
+        """substring_names for a query shorter than an n-gram
+
+        A longer name contains the query exactly when one of its n-grams
+        does, so matching n-grams are found among the distinct n-gram keys
+        and their names merged; names shorter than an n-gram are checked
+        directly.
+        """
+        keys = self._ngrams.keys
+        key_chars = [(keys >> (21 * (NGRAM - 1 - idx))) & 0x1FFFFF for idx in range(NGRAM)]
+        matching = np.zeros(len(keys), dtype=bool)
+        query_chars = char_codes(query).tolist()
+        for offset in range(NGRAM - len(query_chars) + 1):
+            at_offset = np.ones(len(keys), dtype=bool)
+            for idx, char in enumerate(query_chars):
+                at_offset &= key_chars[offset + idx] == char
+            matching |= at_offset
+        name_ids = self._ngrams.get_positions(np.flatnonzero(matching))
+        short_ids = [idx for idx in self._short_names if query in self.names[idx]]
+        return np.union1d(name_ids, np.array(short_ids, dtype=np.int64)) if short_ids else name_ids
+
+    def token_names(self, query):
+        """Ids of the names having every word of query as a whole word"""
+        words = TOKEN_PATTERN.findall(normalize(query))
+        if not words:
+            return np.empty(0, dtype=np.int64)
+        result = None
+        for word in dict.fromkeys(words):
+            idx = bisect.bisect_left(self.words, word)
+            if idx == len(self.words) or self.words[idx] != word:
+                return np.empty(0, dtype=np.int64)
+            posting = self._name_words.get(idx)
+            result = posting if result is None else np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+    def prefix_names(self, prefix):
+        """Ids of the names with a word starting with prefix"""
+        prefix = normalize(prefix).strip()
+        if not prefix:
+            return np.empty(0, dtype=np.int64)
+        start = bisect.bisect_left(self.words, prefix)
+        stop = bisect.bisect_left(self.words, prefix + '\U0010ffff')
+        # Word ids are positions in the vocabulary; find where they start and stop among the name postings
+        start, stop = np.searchsorted(self._name_words.keys, [start, stop])
+        return self._name_words.get_range(start, stop)
+
+    def similar_words(self, word):
+        """(word ids, similarity in 0..1) of the vocabulary words close to a normalized query word
+
+        Similarity is the share of distinct padded trigrams two words have in
+        common. Words too short for that to be reliable also match within
+        FUZZY_MAX_EDITS edits.
+        """
+        codes = ngram_codes(pad_word(word))
+        hits, _ = self._word_ngrams.get_many(codes, np.zeros(len(codes)))
+        if not len(hits):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        ids, shared = np.unique(hits, return_counts=True)
+        similarity = shared / (len(codes) + self._word_ngram_counts[ids] - shared)
+
+        matched = similarity >= FUZZY_MIN_SIMILARITY
+        # One edit changes at most NGRAM + 1 trigrams (a swap), so only words that close are worth the edit distance
+        near = (~matched & (shared >= len(codes) - (NGRAM + 1) * FUZZY_MAX_EDITS)
+                & (np.abs(self._word_lengths[ids] - len(word)) <= FUZZY_MAX_EDITS))
+        if len(word) >= NGRAM:
+            for position in np.flatnonzero(near).tolist():
+                other = self.words[ids[position]]
+                edits = edit_distance(word, other, FUZZY_MAX_EDITS)
+                if edits <= FUZZY_MAX_EDITS:
+                    matched[position] = True
+                    similarity[position] = max(similarity[position], 1 - edits / max(len(word), len(other)))
+        return ids[matched], similarity[matched]
+
+    def _fuzzy_scores(self, postings, query_words):
+        """(text ids, mean over query words of the best similarity of any word of the text)"""
+        ids, scores = [], []
+        for word_ids, similarity in query_words:
+            text_ids, text_scores = postings.get_many(word_ids, similarity)
+            text_ids, text_scores = best_per_id(text_ids, text_scores)
+            ids.append(text_ids)
+            scores.append(text_scores)
+        ids, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        return ids, np.bincount(inverse, weights=np.concatenate(scores), minlength=len(ids)) / len(query_words)
+
+    def _product_scores(self, offsets, members, text_ids, scores):
+        """(product rows, score) for scored names or descriptions"""
+        starts, stops = offsets[text_ids], offsets[text_ids + 1]
+        return members[concat_ranges(starts, stops)].astype(np.int64), np.repeat(scores, stops - starts)
+
+    def fuzzy_find(self, query, limit=FUZZY_RESULT_LIMIT):
+        """(product rows, relevance) of the best matches for a possibly misspelled query
+
+        Each query word is matched to similar vocabulary words; a name scores
+        the mean of its best similarity per query word, plus SUBSTRING_BONUS
+        when it contains the query as typed. Descriptions score the same way,
+        weighted by DESCRIPTION_WEIGHT, and a product keeps its better score.
+        Results are ordered by relevance, then by price with unpriced products
+        last, and cut to limit (None for all).
+        """
+        query_words = [self.similar_words(word) for word in dict.fromkeys(TOKEN_PATTERN.findall(normalize(query)))]
+        if not query_words:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        name_ids, name_scores = self._fuzzy_scores(self._name_words, query_words)
+        substring_ids = self.substring_names(query)
+        name_ids, name_scores = best_per_id(
+            np.r_[name_ids, substring_ids],
+            np.r_[name_scores + SUBSTRING_BONUS * np.isin(name_ids, substring_ids, assume_unique=True),
+                  np.full(len(substring_ids), SUBSTRING_BONUS)])
+        description_ids, description_scores = self._fuzzy_scores(self._description_words, query_words)
+
+        name_rows, name_relevance = self._product_scores(self._name_offsets, self._name_products, name_ids, name_scores)
+        description_rows, description_relevance = self._product_scores(
+            self._description_offsets, self._description_products, description_ids,
+            DESCRIPTION_WEIGHT * description_scores)
+        rows, relevance = best_per_id(np.r_[name_rows, description_rows],
+                                      np.r_[name_relevance, description_relevance])
+
+        if limit is not None and len(rows) > limit:
+            # Only rows at least as relevant as the limit-th best can make the cut (ties go to price)
+            cutoff = -np.partition(-relevance, limit - 1)[limit - 1]
+            keep = relevance >= cutoff
+            rows, relevance = rows[keep], relevance[keep]
+        prices = self.products['Price_Numeric'].to_numpy()[rows]
+        order = np.lexsort((rows, np.where(prices > 0, prices, np.inf), -relevance))[:limit]
+        return rows[order], relevance[order]
+
+    def results(self, rows):
+        """Result table for product row numbers, numbered from 1"""
+        results = self.products.iloc[rows].reset_index(drop=True)
+        results.index = range(1, len(results) + 1)
+        return results
+
+    def find(self, query):
+        """Row numbers of the products whose name contains query (case-insensitive), in catalog order"""
+        return self._products_of(self.substring_names(query))
+
+    def search(self, query):
+        """Products whose name contains query (case-insensitive), in catalog order"""
+        return self.results(self.find(query))
+
+    def search_words(self, query):
+        """Products whose name has every word of query"""
+        return self.results(self._products_of(self.token_names(query)))
+
+    def search_prefix(self, prefix):
+        """Products whose name has a word starting with prefix"""
+        return self.results(self._products_of(self.prefix_names(prefix)))
+
+    def fuzzy_search(self, query, limit=FUZZY_RESULT_LIMIT):
+        """Best matches for a possibly misspelled query, most relevant and then cheapest first"""
+        rows, relevance = self.fuzzy_find(query, limit)
+        results = self.results(rows)
+        results['Relevance'] = relevance.round(3)
+        return results
@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds, the last bucket catches everything above
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+BYTES_BUCKETS = [64 * 1024, 256 * 1024, 512 * 1024, 1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024]
+TOKEN_BUCKETS = [250, 500, 1000, 2000, 4000, 8000, 16000]
+
+# Numeric fields of a call record and the buckets used to summarise them
+HISTOGRAM_FIELDS = {
+    'encode_seconds': LATENCY_BUCKETS,
+    'ttfb_seconds': LATENCY_BUCKETS,
+    'latency_seconds': LATENCY_BUCKETS,
+    'request_bytes': BYTES_BUCKETS,
+    'prompt_tokens': TOKEN_BUCKETS,
+    'candidate_tokens': TOKEN_BUCKETS
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), int(round(pct / 100 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def bucket_label(bound, previous):
+    return f"<= {bound:g}" if previous is None else f"{previous:g} - {bound:g}"
+
+
+class CallTelemetry:
+    """Thread-safe store of per-call Gemini telemetry
+
+    Keeps the most recent max_records call records in memory for histograms
+    and summaries, and optionally appends every record to a JSON lines file.
+    """
+
+    def __init__(self, max_records=10000, log_path=None):
+        self.records = deque(maxlen=max_records)
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    def record(self, **fields):
+        fields.setdefault('timestamp', time.time())
+        with self._lock:
+            self.records.append(fields)
+            if self.log_path:
+                try:
+                    with open(self.log_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(fields) + "\n")
+                except OSError:
+                    pass
+        return fields
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.records)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+    def histogram(self, field, buckets=None):
+        """[(bucket label, count)] for a numeric field"""
+        buckets = buckets or HISTOGRAM_FIELDS[field]
+        counts = [0] * (len(buckets) + 1)
+        for record in self.snapshot():
+            value = record.get(field)
+            if value is None:
+                continue
+            for idx, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            else:
+                counts[-1] += 1
+
+        labels = [bucket_label(bound, buckets[idx - 1] if idx else None) for idx, bound in enumerate(buckets)]
+        labels.append(f"> {buckets[-1]:g}")
+        return list(zip(labels, counts))
+
+    def summary(self):
+        records = self.snapshot()
+        summary = {
+            'calls': len(records),
+            'errors': sum(1 for r in records if r.get('outcome') != 'ok'),
+            'retries': sum(r.get('retries') or 0 for r in records),
+            'images': sum(r.get('images') or 0 for r in records),
+            'prompt_tokens': sum(r.get('prompt_tokens') or 0 for r in records),
+            'candidate_tokens': sum(r.get('candidate_tokens') or 0 for r in records),
+            'request_bytes': sum(r.get('request_bytes') or 0 for r in records)
+        }
+        for field in ['encode_seconds', 'ttfb_seconds', 'latency_seconds']:
+            values = [r[field] for r in records if r.get(field) is not None]
+            summary[field] = {
+                'mean': sum(values) / len(values) if values else 0.0,
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99)
+            }
+        return summary
+
+    def to_jsonl(self):
+        return "".join(json.dumps(record) + "\n" for record in self.snapshot())
@@ -0,0 +1,90 @@
+import os
+import time
+
+from analysis_cache import AnalysisCache
+
+
+def entry_bytes(cache, key):
+    return os.path.getsize(cache._path(key))
+
+
+def walked_bytes(cache_dir):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(cache_dir) for name in names if name.endswith('.json'))
+
+
+def backdate(cache, key, seconds):
+    path = cache._path(key)
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime - seconds))
+
+
+def test_round_trip_and_miss(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.set('abc', 'analysis text', filename='flyer.png')
+    assert cache.get('abc') == 'analysis text'
+    assert cache.get('missing') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_evicts_least_recently_used_to_fit_max_bytes(tmp_path):
+    cache = AnalysisCache(str(tmp_path), max_bytes=10 ** 9)
+    for key in ('k1', 'k2', 'k3'):
+        cache.set(key, 'x' * 500)
+        time.sleep(0.01)
+    size = entry_bytes(cache, 'k1')
+    cache.max_bytes = size * 3
+    # Reading k1 makes k2 the least recently used
+    assert cache.get('k1') is not None
+    cache.set('k4', 'x' * 500)
+
+    assert cache.get('k2') is None
+    assert all(cache.get(key) is not None for key in ('k1', 'k3', 'k4'))
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_running_totals_match_the_directory(tmp_path):
+    cache = AnalysisCache(str(tmp_path), max_bytes=20000, sweep_interval=7)
+    for idx in range(60):
+        cache.set(f"key{idx}", 'x' * (100 + idx * 10))
+        cache.set(f"key{idx // 2}", 'y' * 50)
+    stats = cache.stats()
+    assert stats['bytes'] == walked_bytes(tmp_path) <= 20000
+    assert stats['entries'] == sum(len(names) for _, _, names in os.walk(tmp_path))
+
+    reopened = AnalysisCache(str(tmp_path), max_bytes=20000)
+    assert reopened.stats()['bytes'] == stats['bytes']
+
+
+def test_age_is_measured_from_the_write_not_the_last_read(tmp_path):
+    cache = AnalysisCache(str(tmp_path), max_age=100)
+    cache.set('old', 'analysis')
+    backdate(cache, 'old', 60)
+    # A hit must not make the entry look younger
+    assert cache.get('old') == 'analysis'
+    backdate(cache, 'old', 60)
+    assert cache.get('old') is None
+    assert not os.path.exists(cache._path('old'))
+    assert cache.stats()['evictions'] == 1
+
+
+def test_sweep_drops_expired_entries_that_are_never_read(tmp_path):
+    AnalysisCache(str(tmp_path)).set('stale', 'analysis')
+    cache = AnalysisCache(str(tmp_path), max_age=100, sweep_interval=1)
+    backdate(cache, 'stale', 200)
+    cache.set('fresh', 'analysis')
+
+    assert not os.path.exists(cache._path('stale'))
+    assert cache.stats()['entries'] == 1
+
+
+def test_clear(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.set('a', 'analysis')
+    cache.set('b', 'analysis')
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
+    assert cache.get('a') is None
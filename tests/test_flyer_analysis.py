@@ -0,0 +1,64 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import flyer_analysis
+from analysis_cache import AnalysisCache
+from flyer_analysis import analysis_cache_key, analyze_flyer_batch, find_duplicate_flyers
+
+
+def flyer_image(price, font_size=24):
+    image = Image.new('RGB', (1200, 1600), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=font_size)
+    for row in range(8):
+        draw.rectangle([100, 100 + row * 180, 300, 250 + row * 180], fill=(40 * row, 120, 200))
+        draw.text((350, 150 + row * 180), f"Item {row} ${row}.49", fill='black', font=font)
+    draw.text((350, 60), f"Bananas {price}/lb", fill='black', font=font)
+    return image
+
+
+def encode(image, image_format='PNG', **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('font_size', [14, 24])
+@pytest.mark.parametrize('other_price', ['$2.98', '$3.49'])
+def test_changed_price_is_not_a_duplicate(font_size, other_price):
+    jobs = [('a.png', encode(flyer_image('$2.99', font_size))), ('b.png', encode(flyer_image(other_price, font_size)))]
+    assert find_duplicate_flyers(jobs) == {}
+
+
+def test_identical_pixels_are_duplicates():
+    image = flyer_image('$2.99')
+    jobs = [
+        ('a.png', encode(image)),
+        ('copy.png', encode(image)),
+        ('recompressed.png', encode(image, compress_level=1)),
+        ('other.png', encode(flyer_image('$2.98'))),
+        ('lossy.jpg', encode(image, 'JPEG', quality=95))
+    ]
+    assert find_duplicate_flyers(jobs) == {1: 0, 2: 0}
+
+
+def test_undecodable_files_only_match_identical_bytes():
+    jobs = [('a.png', b'not an image'), ('b.png', b'not an image'), ('c.png', b'something else')]
+    assert find_duplicate_flyers(jobs) == {1: 0}
+
+
+def test_batched_analyses_are_cached_under_the_batch_prompt(tmp_path, monkeypatch):
+    monkeypatch.setattr(flyer_analysis, 'convert_images_to_text',
+                        lambda images, api_key, structured=False: [f"**Store Name:** Store {i}" for i in range(len(images))])
+    cache = AnalysisCache(str(tmp_path))
+    jobs = [(f'coupon{i}.png', encode(flyer_image(f'${i}.99').resize((300, 400)))) for i in range(2)]
+
+    records = analyze_flyer_batch(jobs, 'key', cache=cache)
+
+    assert [record['status'] for record in records] == ['Success', 'Success']
+    for (_, image_bytes), record in zip(jobs, records):
+        assert cache.get(analysis_cache_key(cache, image_bytes)) is None
+        assert cache.get(analysis_cache_key(cache, image_bytes, batched=True)) == record['analysis']
+    assert all(record['cached'] for record in analyze_flyer_batch(jobs, 'key', cache=cache))
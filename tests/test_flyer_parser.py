@@ -0,0 +1,63 @@
+import json
+import random
+
+import pytest
+
+from flyer_parser import StreamingProductParser, merge_tile_analyses, parse_flyer_data
+
+STRUCTURED_ANALYSIS = json.dumps({
+    'store_name': 'Fresh Mart {Downtown}',
+    'slogan': 'Prices "you" love [really]',
+    'products': [
+        {'name': 'Bananas', 'price': None, 'description': ''},
+        {'name': 'Deli Special', 'price': 20, 'description': 'Sandwich {platter}, "serves" 10 \\ more'},
+        {'name': 'Milk', 'price': 3.49, 'size': '1', 'unit': 'gal'}
+    ],
+    'address': '1 Main St'
+}, indent=1)
+
+MARKDOWN_ANALYSIS = """**Store Name:** Corner Grocer
+
+**Featured Products & Prices:**
+* **Apples:** $1.99/lb
+* **Bread:** $2.50 - whole wheat, 24 oz
+
+**Address:** 5 Elm St
+"""
+
+
+def stream(text, chunk_sizes):
+    parser = StreamingProductParser('flyer.png')
+    products = []
+    position = 0
+    for size in chunk_sizes:
+        products.extend(parser.feed(text[position:position + size]))
+        position += size
+    products.extend(parser.feed(text[position:]))
+    return products + parser.close()
+
+
+@pytest.mark.parametrize('analysis', [STRUCTURED_ANALYSIS, MARKDOWN_ANALYSIS, f"```json\n{STRUCTURED_ANALYSIS}\n```"])
+@pytest.mark.parametrize('seed', range(5))
+def test_streamed_products_match_the_full_analysis(analysis, seed):
+    rng = random.Random(seed)
+    chunk_sizes = [rng.randint(1, 12) for _ in range(len(analysis))]
+    assert stream(analysis, chunk_sizes) == parse_flyer_data(analysis, 'flyer.png')['products']
+
+
+def test_structured_products_arrive_before_the_document_ends():
+    parser = StreamingProductParser('flyer.png')
+    cutoff = STRUCTURED_ANALYSIS.index('"Milk"')
+    products = parser.feed(STRUCTURED_ANALYSIS[:cutoff])
+    assert [product['product_name'] for product in products] == ['Bananas', 'Deli Special']
+
+
+def test_tile_merge_keeps_a_priceless_product_and_its_neighbour():
+    tiles = [
+        json.dumps({'products': [{'name': 'Bananas', 'price': None}, {'name': 'Deli Special', 'price': 20}]}),
+        json.dumps({'products': [{'name': 'Deli Special', 'price': 20, 'description': 'Serves 10'}]})
+    ]
+    merged = parse_flyer_data(merge_tile_analyses(tiles), '')
+    assert [(product['product_name'], product['price'], product['description']) for product in merged['products']] == [
+        ('Bananas', 'Price not found', ''), ('Deli Special', '$20.00', 'Serves 10')
+    ]
@@ -0,0 +1,167 @@
+import datetime
+import threading
+import time
+
+import pytest
+import requests
+
+import gemini_client
+from api_keys import ApiKeyPool
+from rate_limiter import AdaptiveLimiter
+from telemetry import CallTelemetry
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.elapsed = datetime.timedelta(milliseconds=10)
+        self.body = body if body is not None else {'candidates': [{'content': {'parts': [{'text': 'analysis'}]}}]}
+        self.content = b'{}'
+
+    def json(self):
+        return self.body
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Answers POSTs with the given responses in order, remembering the key each one used"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.keys = []
+
+    def post(self, url, data=None, headers=None, timeout=None, stream=False):
+        self.keys.append(headers.get('x-goog-api-key'))
+        return self.responses.pop(0)
+
+
+def test_worker_calls_record_telemetry_without_the_streamlit_getters(monkeypatch):
+    def getter_called():
+        raise AssertionError("get_call_telemetry called from a worker thread")
+
+    telemetry = CallTelemetry()
+    resources = gemini_client.GeminiResources(FakeSession([FakeResponse(200)]), ApiKeyPool(['key-one']), telemetry)
+    monkeypatch.setattr(gemini_client, 'get_call_telemetry', getter_called)
+    monkeypatch.setattr(gemini_client, 'get_gemini_session', getter_called)
+
+    results = []
+    worker = threading.Thread(target=lambda: results.append(
+        gemini_client.convert_image_to_text(b'image', resources, mime_type='image/png')))
+    worker.start()
+    worker.join()
+
+    assert results == ['analysis']
+    assert len(telemetry.snapshot()) == 1
+    assert telemetry.snapshot()[0]['api_key'] == resources.key_pool.keys[0].label
+
+
+
+class SlowSession(FakeSession):
+    def __init__(self, seconds, count):
+        super().__init__([FakeResponse(200) for _ in range(count)])
+        self.seconds = seconds
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, timeout=None, stream=False):
+        time.sleep(self.seconds)
+        with self.lock:
+            return super().post(url, data, headers, timeout, stream)
+
+
+def test_deadline_starts_once_a_key_slot_is_leased(monkeypatch):
+    # One request at a time, each taking most of the deadline: the last one queues for
+    # longer than the deadline but must still get its full budget once it is sent
+    monkeypatch.setattr(gemini_client, 'GEMINI_DEADLINE', 0.5)
+    pool = ApiKeyPool(['key-one'], limiter_factory=lambda: AdaptiveLimiter(initial=1, max_limit=1))
+    session = SlowSession(0.3, 3)
+
+    statuses = []
+    workers = [threading.Thread(target=lambda: statuses.append(
+        gemini_client.post_with_retries('url', {}, session=session, api_key=pool).status_code)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert statuses == [200, 200, 200]
+
+
+def test_explicit_deadline_covers_the_wait_for_a_key(monkeypatch):
+    pool = ApiKeyPool(['key-one'], limiter_factory=lambda: AdaptiveLimiter(initial=1, max_limit=1))
+    lease = pool.acquire()
+    try:
+        with pytest.raises(requests.exceptions.Timeout):
+            gemini_client.post_with_retries('url', {}, deadline=time.monotonic() + 0.2,
+                                            session=FakeSession([]), api_key=pool)
+    finally:
+        pool.release(*lease)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff sleeps of post_with_retries, recorded instead of slept; backoff_delay returns a fixed 1.5 s"""
+    recorded = []
+    monkeypatch.setattr(gemini_client.time, 'sleep', recorded.append)
+    monkeypatch.setattr(gemini_client, 'backoff_delay', lambda attempt: 1.5)
+    return recorded
+
+
+@pytest.mark.parametrize('retry_after, expected_sleep', [(None, 1.5), ('0.2', 0.2)])
+def test_single_key_429_waits_before_retrying(sleeps, retry_after, expected_sleep):
+    headers = {'Retry-After': retry_after} if retry_after else {}
+    session = FakeSession([FakeResponse(429, headers), FakeResponse(429, headers), FakeResponse(200)])
+    pool = ApiKeyPool(['key-one'], cooldown=0.01)
+
+    response = gemini_client.post_with_retries('url', {}, session=session, api_key=pool,
+                                               deadline=time.monotonic() + 60)
+
+    assert response.status_code == 200
+    assert sleeps == [expected_sleep, expected_sleep]
+
+
+def test_several_keys_429_retries_on_another_key_at_once(sleeps):
+    session = FakeSession([FakeResponse(429), FakeResponse(200)])
+    pool = ApiKeyPool(['key-one', 'key-two'], cooldown=30)
+
+    response = gemini_client.post_with_retries('url', {}, session=session, api_key=pool)
+
+    assert response.status_code == 200
+    assert session.keys == ['key-one', 'key-two']
+    assert sleeps == [0.0]
+
+
+def test_several_keys_429_with_retry_after_still_moves_to_a_free_key(sleeps):
+    session = FakeSession([FakeResponse(429, {'Retry-After': '20'}), FakeResponse(200)])
+    pool = ApiKeyPool(['key-one', 'key-two'])
+
+    gemini_client.post_with_retries('url', {}, session=session, api_key=pool)
+
+    assert session.keys == ['key-one', 'key-two']
+    assert sleeps == [0.0]
+    assert pool.stats()['keys'][0]['cooldown'] > 19
+
+
+def test_several_keys_all_throttled_back_off(sleeps):
+    session = FakeSession([FakeResponse(429), FakeResponse(429), FakeResponse(200)])
+    pool = ApiKeyPool(['key-one', 'key-two'], cooldown=0.05)
+
+    response = gemini_client.post_with_retries('url', {}, session=session, api_key=pool,
+                                               deadline=time.monotonic() + 60)
+
+    assert response.status_code == 200
+    assert session.keys[:2] == ['key-one', 'key-two']
+    assert sleeps == [0.0, 1.5]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    session = FakeSession([FakeResponse(503) for _ in range(3)])
+
+    response = gemini_client.post_with_retries('url', {}, session=session, api_key=ApiKeyPool(['key-one']),
+                                               max_retries=2, deadline=time.monotonic() + 60)
+
+    assert response.status_code == 503
+    assert sleeps == [1.5, 1.5]
+    assert session.responses == []
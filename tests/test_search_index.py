@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from benchmark import misspell, search_queries, synthetic_search_products
+from search_index import TOKEN_PATTERN, ProductSearchIndex
+
+
+def product(name, store='Fresh Mart', price='$1.99', description=''):
+    return {'Product_ID': 1, 'Product_Name': name, 'Store_Name': store, 'Price': price, 'Size_Weight': '',
+            'Description': description, 'Flyer_Source': 'flyer.png'}
+
+
+EDGE_PRODUCTS = [
+    product('Bananas'), product('BANANA bread'), product('Crème Brûlée'), product('7UP'), product('Ü'),
+    product('Eggs, Large (12 ct)'), product('Bananas'), product('a'), product('Mac & Cheese'), product('')
+]
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    products = synthetic_search_products(3000, seed=1)
+    return products, ProductSearchIndex(products)
+
+
+def scan(products, query):
+    """The linear scan the search index replaces"""
+    return [idx for idx, product in enumerate(products) if query.lower() in product['Product_Name'].lower()]
+
+
+def test_find_matches_the_linear_scan(catalog):
+    products, index = catalog
+    for query in search_queries(products, 300, seed=2) + ['', ' ', 'zzzz', 'a', 'ch']:
+        assert index.find(query).tolist() == scan(products, query), query
+
+
+@pytest.mark.parametrize('query', ['', 'ban', 'BANANA', 'an', 'è', 'brûlée', 'ü', '7', 'up', ', l', '(12', '&', 'a', 'x'])
+def test_find_matches_the_linear_scan_on_edge_cases(query):
+    index = ProductSearchIndex(EDGE_PRODUCTS)
+    assert index.find(query).tolist() == scan(EDGE_PRODUCTS, query)
+
+
+def test_search_returns_the_scanned_products_in_catalog_order(catalog):
+    products, index = catalog
+    results = index.search('che')
+    assert results['Product_Name'].tolist() == [products[idx]['Product_Name'] for idx in scan(products, 'che')]
+    assert results.index.tolist() == list(range(1, len(results) + 1))
+
+
+def test_word_and_prefix_search_match_a_scan_over_words(catalog):
+    products, index = catalog
+    for query in search_queries(products, 100, seed=3):
+        words = TOKEN_PATTERN.findall(query.lower())
+        name_words = [set(TOKEN_PATTERN.findall(product['Product_Name'].lower())) for product in products]
+        expected_words = [name for name, vocabulary in zip(products, name_words) if words and set(words) <= vocabulary]
+        assert index.search_words(query)['Product_Name'].tolist() == [p['Product_Name'] for p in expected_words], query
+
+        prefix = query.strip().lower()
+        expected_prefix = [p['Product_Name'] for p, vocabulary in zip(products, name_words)
+                           if prefix and any(word.startswith(prefix) for word in vocabulary)]
+        assert index.search_prefix(query)['Product_Name'].tolist() == expected_prefix, query
+
+
+def test_fuzzy_search_finds_the_product_behind_a_typo(catalog):
+    products, index = catalog
+    rng = random.Random(4)
+    for _ in range(100):
+        name = rng.choice(products)['Product_Name']
+        words = name.split()
+        typo = rng.randrange(len(words))
+        query = ' '.join(misspell(word, rng) if idx == typo else word for idx, word in enumerate(words))
+        assert name in index.fuzzy_search(query)['Product_Name'].tolist(), query
+
+
+def test_suggestions_start_with_the_prefix_and_rank_by_store_count():
+    index = ProductSearchIndex([product('Bananas', store) for store in ('A', 'B', 'C')]
+                               + [product('Banana Bread', 'A'), product('Apples', 'A')])
+    assert index.suggest('ban') == [('Bananas', 3), ('Banana Bread', 1)]
+    assert index.suggest('zz') == []
@@ -0,0 +1,181 @@
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+
+# Rows turned into XML per step; bounds memory whatever the sheet size
+CHUNK_ROWS = 10000
+
+# zlib level for the sheets; sheet XML is very repetitive, so level 1 is nearly as small and far faster
+COMPRESS_LEVEL = 1
+
+# Control characters XML 1.0 does not allow
+ILLEGAL_XML_CHARS = r'[\x00-\x08\x0b\x0c\x0e-\x1f]'
+
+# Cell with no value, keeps the following cells of the row in their columns
+EMPTY_CELL = '<c/>'
+
+# Style index of header cells in STYLES_XML (bold, thin border, centred like DataFrame.to_excel)
+HEADER_STYLE = 1
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{index}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>{sheets}</sheets></workbook>'
+)
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{sheets}<Relationship Id="rId{styles_id}" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+SHEET_REL = (
+    '<Relationship Id="rId{index}" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet{index}.xml"/>'
+)
+STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" '
+    'applyAlignment="1"><alignment horizontal="center" vertical="top"/></xf></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+)
+
+
+def column_letter(index):
+    """Excel column letters for a 0-based column index (0 -> A, 26 -> AA)"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def escape_text(values):
+    """XML-escape a Series of strings, dropping characters XML cannot hold"""
+    return (values.str.replace(ILLEGAL_XML_CHARS, '', regex=True)
+            .str.replace('&', '&amp;', regex=False)
+            .str.replace('<', '&lt;', regex=False)
+            .str.replace('>', '&gt;', regex=False))
+
+
+def value_cells(values):
+    """<c> elements for distinct values of one column"""
+    if pd.api.types.is_bool_dtype(values):
+        return ('<c t="b"><v>' + values.astype(int).astype(str) + '</v></c>').tolist()
+    if pd.api.types.is_numeric_dtype(values):
+        numbers = values.astype(float)
+        text = values.astype(str) if pd.api.types.is_integer_dtype(values) else numbers.astype(str)
+        cells = '<c><v>' + text + '</v></c>'
+        return cells.where(np.isfinite(numbers.to_numpy()), EMPTY_CELL).tolist()
+    text = escape_text(values.astype(str))
+    cells = '<c t="inlineStr"><is><t xml:space="preserve">' + text + '</t></is></c>'
+    # Empty strings are left out, as openpyxl does
+    return cells.where(text != '', EMPTY_CELL).tolist()
+
+
+def column_cells(values):
+    """<c> elements for one column of a chunk, as an object array
+
+    Flyer tables repeat the same stores, sizes and prices over and over, so
+    each distinct value is rendered once and the cells are picked by code.
+    Cells carry no r attribute, so a missing value is an empty <c/>.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    cells = np.array(value_cells(pd.Series(uniques)) + [EMPTY_CELL], dtype=object)
+    return cells[codes]
+
+
+def write_sheet(stream, df, widths=None):
+    """Write one worksheet's XML to a binary stream, CHUNK_ROWS rows at a time"""
+    stream.write(SHEET_START.encode('utf-8'))
+    if widths:
+        cols = ''.join(f'<col min="{idx}" max="{idx}" width="{width}" customWidth="1"/>'
+                       for idx, width in enumerate(widths, start=1))
+        stream.write(f'<cols>{cols}</cols>'.encode('utf-8'))
+    stream.write(b'<sheetData>')
+
+    if len(df.columns):
+        header = ''.join(
+            f'<c r="{column_letter(idx)}1" t="inlineStr" s="{HEADER_STYLE}"><is><t>{escape(str(column))}</t></is></c>'
+            for idx, column in enumerate(df.columns)
+        )
+        stream.write(f'<row r="1">{header}</row>'.encode('utf-8'))
+
+        for start in range(0, len(df), CHUNK_ROWS):
+            chunk = df.iloc[start:start + CHUNK_ROWS]
+            # One row per line of a (rows, columns + 2) grid: row start tag, cells, row end tag
+            grid = np.empty((len(chunk), len(df.columns) + 2), dtype=object)
+            grid[:, 0] = [f'<row r="{number}">' for number in range(start + 2, start + 2 + len(chunk))]
+            for idx, column in enumerate(chunk.columns, start=1):
+                grid[:, idx] = column_cells(chunk[column])
+            grid[:, -1] = '</row>'
+            stream.write(''.join(grid.ravel().tolist()).encode('utf-8'))
+
+    stream.write(b'</sheetData></worksheet>')
+
+
+def write_xlsx(output, sheets):
+    """Write DataFrames to an xlsx file (path or binary file object)
+
+    sheets is a list of (sheet name, DataFrame, column widths or None).
+    Rows are converted to XML a chunk at a time and streamed into the zip,
+    so memory stays flat however long the sheets are. Strings are written
+    inline, numbers and booleans as values, missing values and empty strings
+    as empty cells.
+    """
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES_XML.format(
+            sheets=''.join(SHEET_CONTENT_TYPE.format(index=idx) for idx in range(1, len(sheets) + 1))))
+        archive.writestr('_rels/.rels', ROOT_RELS_XML)
+        archive.writestr('xl/workbook.xml', WORKBOOK_XML.format(sheets=''.join(
+            f'<sheet name={quoteattr(name)} sheetId="{idx}" r:id="rId{idx}"/>'
+            for idx, (name, _, _) in enumerate(sheets, start=1))))
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML.format(
+            sheets=''.join(SHEET_REL.format(index=idx) for idx in range(1, len(sheets) + 1)),
+            styles_id=len(sheets) + 1))
+        archive.writestr('xl/styles.xml', STYLES_XML)
+        for idx, (_, df, widths) in enumerate(sheets, start=1):
+            with archive.open(f'xl/worksheets/sheet{idx}.xml', 'w', force_zip64=True) as stream:
+                write_sheet(stream, df, widths)